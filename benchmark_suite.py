@@ -0,0 +1,154 @@
+#%%
+import io
+import json
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import argparse
+import numpy as np
+from PIL import Image
+from skimage import filters, transform
+from emd_convert.emd_reader import VeloxEMD
+from emd_convert.preview import convert_to_8bit, map_to_8bit, bin_image, make_preview
+from emd_convert.power_spectrum import power_spectrum
+from emd_convert.scalebar import add_scalebar
+from emd_convert.convert_emd2mrc import write_mrc, write_mrc_stack
+from emd_convert.convert_emd2tiff import write_tiff
+from emd_convert.synthetic_emd import make_fixture_set, SIZES
+
+
+#%%
+# Function definitions:
+def measure(func, *args, repeats:int=1, track_memory:bool=True, **kwargs):
+    """Call func `repeats` times and return its result, the best wall time in seconds and
+    the peak of newly allocated memory in MiB (via tracemalloc, numpy reports its buffers there).
+    """
+
+    best = np.inf
+    peak = 0
+    for _ in range(repeats):
+        if track_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+        if track_memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    return result, best, peak / 2**20
+
+def benchmark_frame(emd_file:Path, out_dir:Path, repeats=1, track_memory=True, skip=())->dict:
+    """Time every stage of the converters on a single frame fixture."""
+
+    results = {}
+    def run(stage, func, *args, **kwargs):
+        if stage in skip:
+            return None
+        result, seconds, peak_mb = measure(func, *args, repeats=repeats, track_memory=track_memory, **kwargs)
+        results[stage] = {"time": seconds, "peak_mb": peak_mb}
+        print(f"    {stage:20s} {seconds:8.3f} s {peak_mb:9.1f} MiB")
+        return result
+
+    def load():
+        with VeloxEMD(emd_file) as emd:
+            return emd.data, emd.pixel_size
+
+    img, px_size = run("load", load)
+    run("median", filters.median, img)
+    run("power_spectrum", power_spectrum, img, px_size)
+    run("rescale", transform.rescale, img, scale=0.5, anti_aliasing=True)
+    run("bin", bin_image, img, 2)
+    run("to_8bit_legacy", convert_to_8bit, img)
+    run("to_8bit", map_to_8bit, img)
+    run("preview_legacy", make_preview, img, px_size, order="legacy")
+    preview, preview_px_size = make_preview(img, px_size, mode="bin")
+    run("preview_fast", make_preview, img, px_size)
+    run("preview_bin", make_preview, img, px_size, mode="bin")
+    run("scalebar", lambda: add_scalebar(Image.fromarray(preview), preview, preview_px_size))
+    run("png_encode", lambda: Image.fromarray(preview).save(io.BytesIO(), format="PNG"))
+    run("mrc_write", write_mrc, img, px_size, out_dir / "bench.mrc")
+    run("tiff_write", write_tiff, img, px_size, out_dir / "bench.tiff")
+    return results
+
+def benchmark_stack(emd_file:Path, out_dir:Path, repeats=1, track_memory=True, skip=())->dict:
+    """Time loading a stack and streaming it into an mrc stack."""
+
+    def load():
+        with VeloxEMD(emd_file) as emd:
+            return emd.data
+
+    def stream():
+        with VeloxEMD(emd_file) as emd:
+            return write_mrc_stack(emd, out_dir / "bench_stack.mrc")
+
+    results = {}
+    for stage, func in [("stack_load", load), ("stack_mrc_stream", stream)]:
+        if stage in skip:
+            continue
+        _, seconds, peak_mb = measure(func, repeats=repeats, track_memory=track_memory)
+        results[stage] = {"time": seconds, "peak_mb": peak_mb}
+        print(f"    {stage:20s} {seconds:8.3f} s {peak_mb:9.1f} MiB")
+    return results
+
+def compare_to_baseline(results:dict, baseline:dict, tolerance=0.2)->list:
+    """Print the time ratio of every stage to the baseline and return the stages that got slower than 1 + tolerance."""
+
+    regressions = []
+    print(f"\n{'fixture':28s} {'stage':20s} {'baseline':>9s} {'now':>9s} {'ratio':>6s}")
+    for fixture, stages in results.items():
+        for stage, res in stages.items():
+            ref = baseline.get(fixture, {}).get(stage)
+            if ref is None:
+                continue
+            ratio = res["time"] / ref["time"]
+            flag = ""
+            if ratio > 1 + tolerance:
+                flag = "SLOWER"
+                regressions.append((fixture, stage, ratio))
+            elif ratio < 1 - tolerance:
+                flag = "faster"
+            print(f"{fixture:28s} {stage:20s} {ref['time']:9.3f} {res['time']:9.3f} {ratio:6.2f} {flag}")
+    return regressions
+
+
+
+##################################################################################################
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark every conversion stage on synthetic Velox EMD files and compare against a stored baseline. Runs offline."
+    )
+
+    parser.add_argument("--fixture-dir", default="bench_fixtures", help="Where the synthetic .emd files are generated / reused (default: bench_fixtures)")
+    parser.add_argument("--sizes", nargs="+", choices=SIZES, default=["1k", "4k"])
+    parser.add_argument("--stack-frames", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--skip", nargs="*", default=[], help="Stages to skip, e.g. median on 16k frames")
+    parser.add_argument("--no-memory", action="store_true", help="Don't track peak memory (tracemalloc slows down small allocations)")
+    parser.add_argument("--baseline", default=None, help="Baseline json (default: <fixture-dir>/baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative slowdown reported as regression (default: 0.2)")
+
+    args = parser.parse_args()
+    fixture_dir = Path(args.fixture_dir)
+    baseline_path = Path(args.baseline) if args.baseline else fixture_dir / "baseline.json"
+
+    fixtures = make_fixture_set(fixture_dir, args.sizes, args.stack_frames)
+    results = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        for emd_file in fixtures:
+            print(emd_file.name)
+            with VeloxEMD(emd_file) as emd:
+                is_stack = emd.n_frames > 1
+            bench = benchmark_stack if is_stack else benchmark_frame
+            results[emd_file.stem] = bench(emd_file, Path(out_dir), args.repeats, not args.no_memory, args.skip)
+
+    if baseline_path.exists():
+        with open(baseline_path) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        print(f"\n{len(regressions)} stage(s) slower than the baseline")
+    if args.save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=1)
+        print(f"Saved baseline to {baseline_path}")
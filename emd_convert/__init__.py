@@ -0,0 +1,49 @@
+"""Conversion of Velox EMD files to png (with scalebar), tiff, mrc and zarr.
+
+The converters also work on image arrays that are already in memory, e.g.
+
+    import io
+    from emd_convert import load_emd, write_png
+
+    img_data, px_size = load_emd(emd_file)
+    png = io.BytesIO()
+    write_png(img_data, px_size, png)
+
+The functions listed below are imported from their module on first access, so importing the package
+(and starting the emd-convert command) stays cheap.
+"""
+import importlib
+
+
+# name -> module
+_EXPORTS = {
+    "VeloxEMD": "emd_reader",
+    "UnsupportedLayoutError": "emd_reader",
+    "load_emd": "emd_reader",
+    "read_pixel_size": "emd_reader",
+    "make_preview": "preview",
+    "add_scalebar": "scalebar",
+    "contrast_limits": "contrast",
+    "write_png": "convert_emd2png_add_scalebar",
+    "write_tiff": "convert_emd2tiff",
+    "write_mrc": "convert_emd2mrc",
+    "write_zarr": "convert_emd2zarr",
+    "convert_to_png": "convert_emd2png_add_scalebar",
+    "convert_to_pyramid": "convert_emd2png_add_scalebar",
+    "convert_to_tiff": "convert_emd2tiff",
+    "convert_to_mrc": "convert_emd2mrc",
+    "convert_to_zarr": "convert_emd2zarr",
+    "convert_to_formats": "convert_emd_multi",
+    "run_batch": "batch",
+    "select_files": "catalogue",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+
+def __dir__():
+    return sorted([*globals(), *_EXPORTS])
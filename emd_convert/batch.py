@@ -0,0 +1,204 @@
+#%%
+import itertools
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from .profiling import profile_file, RunReport
+from .conversion_cache import describe_outputs
+from .cluster import ClaimQueue, parse_shard, shard_files, NODE_NAME, DEFAULT_STALE_AFTER
+
+
+#%%
+# Function definitions:
+def _convert_one(convert_func, emd_file:Path, kwargs:dict, describe:bool=False):
+    """Call the converter for a single file and catch every exception, so that one broken .emd file
+    doesn't take down the whole batch. Has to live on module level to be picklable for the process pool.
+
+    Args:
+        convert_func (callable): One of the convert_to_... functions
+        emd_file (Path): The path of the emd file
+        kwargs (dict): Additional keyword arguments for the converter
+        describe (bool, optional): Return the manifest records of the written files (with their checksums,
+            see conversion_cache.describe_outputs) instead of the result of the converter. Defaults to False.
+
+    Returns:
+        tuple: (result of the converter, error message or None, profiling record)
+    """
+
+    with profile_file(emd_file) as profile:
+        try:
+            result = convert_func(emd_file, **kwargs)
+        except Exception as e:
+            result = None
+            profile.failure = f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+        record = profile.finish(result)
+    if describe and result:
+        # hash the outputs here in the worker instead of one after another in the main process
+        result = describe_outputs(result)
+    return result, profile.failure, record
+
+
+def _converter_name(convert_func)->str:
+    # Without the package name, so that manifests written by the former stand-alone scripts stay valid
+    module = convert_func.__module__.rpartition(".")[2]
+    return f"{module}.{convert_func.__name__}"
+
+
+def add_batch_arguments(parser):
+    """Add the options shared by all batch converters (parallelism and conversion cache) to an argparse parser."""
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes for parallel conversion (default: 1)")
+    parser.add_argument("--no-cache", action="store_true", help="Convert all files again, ignoring and not updating the conversion manifest")
+    parser.add_argument("--hash", action="store_true", help="Also compare sha256 checksums of the .emd files, so that re-exported but unchanged files are not converted again, and of the outputs")
+    parser.add_argument("--report", default=None, help="JSON Lines file for the per file timing report (default: conversion_report.jsonl in emd_dir)")
+    parser.add_argument("--no-report", action="store_true", help="Don't write the timing report (the summary table is still printed)")
+    parser.add_argument("--where", default=None, help="Only convert files whose metadata matches this SQL condition, e.g. \"pixel_size < 2e-10 AND frames = 1\" (see emd-convert catalogue)")
+    parser.add_argument("--memory-budget", type=float, default=None, help="Memory in MiB for all parallel conversions together. Files are only started if their estimated "
+                        "working set (from the header) fits, files too large for the budget run alone (default: no limit)")
+    parser.add_argument("--shard", type=parse_shard, default=None, help="Only convert shard i of N (\"i/N\"), for running one converter per node on a shared directory")
+    parser.add_argument("--queue", action="store_true", help="Share the files with the converters of other nodes through claim files in <emd_dir>/.emd_queue (see emd-convert cluster)")
+    parser.add_argument("--stale-after", type=float, default=DEFAULT_STALE_AFTER, help=f"Seconds after which the claim of a crashed node is taken over (default: {DEFAULT_STALE_AFTER})")
+
+
+def _distributed(args)->bool:
+    # converters with their own options (emd-convert watch) don't have the distributed ones
+    return getattr(args, "shard", None) is not None or getattr(args, "queue", False)
+
+
+def manifest_from_args(args, emd_dir:Path):
+    """The ConversionManifest for emd_dir as configured by the options from add_batch_arguments (None for --no-cache)."""
+    if args.no_cache:
+        return None
+    from .conversion_cache import ConversionManifest, MANIFEST_NAME
+    if _distributed(args):
+        # every node writes its own manifest, merged by emd-convert cluster --merge
+        save_path = Path(emd_dir) / f"{Path(MANIFEST_NAME).stem}.{NODE_NAME}.json"
+        return ConversionManifest.for_directory(emd_dir, use_hash=args.hash, save_path=save_path)
+    return ConversionManifest.for_directory(emd_dir, use_hash=args.hash)
+
+
+def emd_files_from_args(args, emd_dir:Path, wildcard:str, sharded:bool=True)->list:
+    """The emd files below emd_dir matching wildcard, the --where condition and (if sharded) the --shard from add_batch_arguments."""
+    if args.where is None:
+        emd_files = sorted(Path(emd_dir).rglob(wildcard))
+    else:
+        from .catalogue import select_files
+        emd_files = select_files(emd_dir, wildcard, args.where, jobs=args.jobs)
+    if sharded and args.shard is not None:
+        emd_files = shard_files(emd_files, emd_dir, args.shard)
+    return emd_files
+
+
+def memory_budget_from_args(args)->int:
+    """--memory-budget in bytes, None without a budget."""
+    return args.memory_budget and int(args.memory_budget * 2**20)
+
+
+def claims_from_args(args, emd_dir:Path)->ClaimQueue:
+    """The ClaimQueue of emd_dir for --queue, otherwise None."""
+    if not args.queue:
+        return None
+    return ClaimQueue.for_directory(emd_dir, stale_after=args.stale_after)
+
+
+def report_from_args(args, emd_dir:Path)->RunReport:
+    """The RunReport as configured by the options from add_batch_arguments."""
+    if args.no_report:
+        return RunReport()
+    if args.report is None and _distributed(args):
+        # one report per node, merged by emd-convert cluster --merge
+        return RunReport(Path(emd_dir) / f"conversion_report.{NODE_NAME}.jsonl")
+    return RunReport(args.report or Path(emd_dir) / "conversion_report.jsonl")
+
+
+def run_batch(convert_func, emd_files, jobs:int=1, manifest=None, report=None, claims=None, memory_budget=None, **kwargs)->list:
+    """Convert all emd files with the given converter function, either one after another (jobs=1)
+    or in a pool of `jobs` worker processes. The converter itself is the same in both cases,
+    so the written files are identical to the serial path.
+
+    Args:
+        convert_func (callable): One of the convert_to_... functions (first argument is the emd file path)
+        emd_files (iterable of Path): The emd files to convert
+        jobs (int, optional): Number of worker processes. Defaults to 1 (no pool).
+        manifest (ConversionManifest, optional): If given, files that are up to date according to the manifest
+            are skipped and finished conversions are recorded in it. Defaults to None.
+        report (RunReport, optional): Collects the per stage timings of every file. Defaults to a RunReport
+            that only prints the summary table.
+        claims (ClaimQueue, optional): Shared work queue of a distributed run, every file is claimed right before
+            its conversion and skipped if another node claimed it. Defaults to None.
+        memory_budget (int, optional): Bytes available to all worker processes together. A file is only started
+            if the working set estimated from its header (see scheduler.estimate_working_set) fits next to the
+            running ones. Defaults to None (no limit).
+        **kwargs: Passed on to convert_func
+
+    Returns:
+        list: (emd_file, error message) tuples for every failed conversion
+    """
+
+    emd_files = list(emd_files)
+    converter = _converter_name(convert_func)
+    if manifest is not None:
+        n_found = len(emd_files)
+        emd_files = [emd_file for emd_file in emd_files if not manifest.is_up_to_date(emd_file, converter, kwargs)]
+        print(f"{n_found - len(emd_files)} of {n_found} files are up to date")
+    n_files = len(emd_files)
+    failures = []
+    if report is None:
+        report = RunReport()
+
+    def finished(i, emd_file, result, error, record):
+        if claims is not None:
+            claims.release(emd_file, ok=error is None)
+        report.add(record)
+        if error is None:
+            if manifest is not None and result:
+                manifest.record(emd_file, converter, kwargs, result)
+            print(f"[{i}/{n_files}] Done: {emd_file.name}")
+        else:
+            print(f"[{i}/{n_files}] FAILED: {emd_file.name}\n{error}")
+            failures.append((emd_file, error))
+
+    # lazy, so that files are only claimed when a worker is about to convert them
+    claimed = (emd_file for emd_file in emd_files if claims is None or claims.claim(emd_file, converter, kwargs))
+    try:
+        if jobs <= 1:
+            for i, emd_file in enumerate(claimed, start=1):
+                finished(i, emd_file, *_convert_one(convert_func, emd_file, kwargs, describe=manifest is not None))
+        else:
+            print(f"Converting {n_files} files with {jobs} worker processes")
+            budget = None
+            if memory_budget is not None:
+                from .scheduler import MemoryBudget, estimate_working_set
+                budget = MemoryBudget(memory_budget, lambda emd_file: estimate_working_set(emd_file, converter, **kwargs))
+                print(f"Memory budget: {memory_budget / 2**20:.0f} MiB")
+            # keep two files per worker submitted, with a budget only as many as run (the budget counts the submitted ones)
+            max_submitted = 2 * jobs if budget is None else jobs
+            futures = {}
+            waiting = None
+            counter = itertools.count(1)
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                while True:
+                    while len(futures) < max_submitted:
+                        if waiting is None:
+                            waiting = next(claimed, None)
+                        if waiting is None or (budget is not None and not budget.admit(waiting)):
+                            break
+                        futures[pool.submit(_convert_one, convert_func, waiting, kwargs, manifest is not None)] = waiting
+                        waiting = None
+                    if not futures:
+                        break
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        emd_file = futures.pop(future)
+                        if budget is not None:
+                            budget.release(emd_file)
+                        finished(next(counter), emd_file, *future.result())
+    finally:
+        if claims is not None:
+            claims.close()
+
+    if manifest is not None:
+        manifest.save()
+
+    report.summary()
+
+    return failures
@@ -0,0 +1,197 @@
+#%%
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from .emd_reader import VeloxEMD, UnsupportedLayoutError
+
+
+#%%
+# Function definitions:
+CATALOGUE_NAME = ".emd_catalogue.sqlite"
+COLUMNS = {
+    "path": "TEXT PRIMARY KEY",
+    "size": "INTEGER",
+    "mtime_ns": "INTEGER",
+    "pixel_size": "REAL",           # px width in meter
+    "pixel_size_y": "REAL",         # px height in meter
+    "magnification": "REAL",
+    "acquisition_time": "REAL",     # unix time in seconds
+    "detector": "TEXT",
+    "height": "INTEGER",
+    "width": "INTEGER",
+    "frames": "INTEGER",
+    "dtype": "TEXT",
+    "error": "TEXT",                # why the header couldn't be read, NULL for readable files
+}
+
+def _metadata_value(metadata:dict, key:str, convert=float):
+    # dotted keys like "Optics.NominalMagnification", None for missing entries
+    value = metadata
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        return None
+
+def read_header(emd_file:Path)->dict:
+    """Read the catalogue entry of an emd file from its header and metadata only, without touching the image data.
+    Errors are stored in the entry instead of being raised, so one broken file doesn't stop the indexing.
+
+    Args:
+        emd_file (Path): The path of the emd file
+
+    Returns:
+        dict: Values for the COLUMNS of the catalogue
+    """
+
+    stat = emd_file.stat()
+    entry = dict.fromkeys(COLUMNS)
+    entry.update(path=str(emd_file.resolve()), size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    try:
+        with VeloxEMD(emd_file) as emd:
+            metadata = emd.metadata
+            px_size = emd.pixel_size
+            px_height, px_width = px_size if isinstance(px_size, tuple) else (px_size, px_size)
+            height, width = emd.shape[-2:]
+            entry.update(
+                pixel_size=px_width,
+                pixel_size_y=px_height,
+                magnification=_metadata_value(metadata, "Optics.NominalMagnification"),
+                acquisition_time=_metadata_value(metadata, "Acquisition.AcquisitionStartDatetime.DateTime"),
+                detector=_metadata_value(metadata, "BinaryResult.Detector", str),
+                height=height,
+                width=width,
+                frames=emd.n_frames,
+                dtype=str(emd.dtype),
+            )
+    except (OSError, UnsupportedLayoutError) as e:
+        entry["error"] = f"{type(e).__name__}: {e}"
+    return entry
+
+
+class Catalogue:
+    """SQLite index of the header metadata (pixel size, magnification, acquisition time, detector, shape, dtype)
+    of all .emd files below a directory, for selecting files with SQL conditions instead of file name wildcards.
+
+    Updates are incremental: only files that are new or whose size / mtime changed are read again
+    (in parallel worker processes), unchanged files cost one stat.
+
+    Usage:
+        catalogue = Catalogue.for_directory(emd_dir)
+        catalogue.update(sorted(emd_dir.rglob("*.emd")), jobs=8)
+        emd_files = catalogue.query("pixel_size < 2e-10 AND frames = 1")
+    """
+
+    def __init__(self, db_path:Path):
+        self.db_path = Path(db_path)
+        self._db = sqlite3.connect(self.db_path)
+        columns = ", ".join(f"{name} {sql_type}" for name, sql_type in COLUMNS.items())
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS emd_files ({columns})")
+
+    @classmethod
+    def for_directory(cls, emd_dir:Path):
+        return cls(Path(emd_dir) / CATALOGUE_NAME)
+
+    def close(self):
+        self._db.close()
+
+    def update(self, emd_files, jobs:int=1, prune_dir:Path=None)->int:
+        """Add new and changed files to the catalogue.
+
+        Args:
+            emd_files (iterable of Path): The emd files that should be in the catalogue
+            jobs (int, optional): Number of worker processes reading headers. Defaults to 1.
+            prune_dir (Path, optional): Remove entries below this directory whose file no longer exists. Defaults to None.
+
+        Returns:
+            int: Number of (re-)indexed files
+        """
+
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in self._db.execute("SELECT path, size, mtime_ns FROM emd_files")}
+        outdated = []
+        for emd_file in emd_files:
+            stat = os.stat(emd_file)
+            if known.get(str(Path(emd_file).resolve())) != (stat.st_size, stat.st_mtime_ns):
+                outdated.append(Path(emd_file))
+
+        if outdated:
+            print(f"Indexing {len(outdated)} new or changed files")
+            if jobs <= 1:
+                entries = [read_header(emd_file) for emd_file in outdated]
+            else:
+                with ProcessPoolExecutor(max_workers=jobs) as pool:
+                    entries = list(pool.map(read_header, outdated, chunksize=64))
+            placeholders = ", ".join(f":{name}" for name in COLUMNS)
+            with self._db:
+                self._db.executemany(f"INSERT OR REPLACE INTO emd_files VALUES ({placeholders})", entries)
+
+        if prune_dir is not None:
+            prefix = str(Path(prune_dir).resolve()) + os.sep
+            vanished = [(path,) for path in known if path.startswith(prefix) and not os.path.exists(path)]
+            with self._db:
+                self._db.executemany("DELETE FROM emd_files WHERE path = ?", vanished)
+        return len(outdated)
+
+    def query(self, where:str="1", params=())->list:
+        """Paths of the files matching an SQL condition on the COLUMNS, e.g. "magnification IN (57000, 92000)".
+        Files whose header couldn't be read have NULL metadata and only match conditions like "error IS NOT NULL".
+        """
+        rows = self._db.execute(f"SELECT path FROM emd_files WHERE {where} ORDER BY path", params)
+        return [Path(path) for path, in rows]
+
+    def rows(self, where:str="1", params=())->list:
+        """Full catalogue entries (as dicts) of the files matching where."""
+        cursor = self._db.execute(f"SELECT * FROM emd_files WHERE {where} ORDER BY path", params)
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+
+def select_files(emd_dir:Path, wildcard:str, where:str=None, jobs:int=1)->list:
+    """The files below emd_dir matching wildcard and, if given, the catalogue condition where.
+    The catalogue of emd_dir is updated on the way.
+    """
+
+    emd_dir = Path(emd_dir)
+    emd_files = sorted(emd_dir.rglob(wildcard))
+    if where is None:
+        return emd_files
+    catalogue = Catalogue.for_directory(emd_dir)
+    try:
+        catalogue.update(emd_files, jobs=jobs, prune_dir=emd_dir)
+        selected = set(catalogue.query(where))
+    finally:
+        catalogue.close()
+    emd_files = [emd_file for emd_file in emd_files if emd_file.resolve() in selected]
+    print(f"{len(emd_files)} files match {where!r}")
+    return emd_files
+
+
+
+##################################################################################################
+
+def add_arguments(parser):
+    """Add the options of `emd-convert catalogue` to its argparse parser."""
+    parser.description = "Index the metadata of all EMD files below a directory in a SQLite catalogue and list the files matching a condition."
+    parser.add_argument("emd_dir")
+    parser.add_argument("wildcard", nargs="?", default="*.emd")
+    parser.add_argument("--where", default="1", help=f"SQL condition on the columns {', '.join(COLUMNS)}, e.g. \"pixel_size < 2e-10\"")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes reading headers (default: 1)")
+
+def main(args):
+    """Run `emd-convert catalogue` with the options parsed by add_arguments."""
+    emd_dir = Path(args.emd_dir)
+    assert emd_dir.exists() and emd_dir.is_dir()
+
+    catalogue = Catalogue.for_directory(emd_dir)
+    catalogue.update(sorted(emd_dir.rglob(args.wildcard)), jobs=args.jobs, prune_dir=emd_dir)
+    for row in catalogue.rows(args.where):
+        if row["error"] is not None:
+            print(f"{row['path']}: {row['error']}")
+        else:
+            print(f"{row['path']}: {row['width']}x{row['height']}x{row['frames']} {row['dtype']}, "
+                  f"px size {row['pixel_size']:.3e} m, magnification {row['magnification']}, {row['detector']}")
+    catalogue.close()
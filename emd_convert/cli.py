@@ -0,0 +1,53 @@
+#%%
+import argparse
+import importlib
+import sys
+
+
+#%%
+# Function definitions:
+# command -> (module, one line help). The module of a command is only imported when the command runs (or its
+# options are shown), so `emd-convert --help` doesn't pay for numpy, skimage, h5py, ... at all.
+COMMANDS = {
+    "png": ("convert_emd2png_add_scalebar", "Convert to png with scalebar (or Deep Zoom / pyramidal tiff)"),
+    "tiff": ("convert_emd2tiff", "Convert to calibrated 16 bit tiff"),
+    "mrc": ("convert_emd2mrc", "Convert to mrc (stacks streamed in row bands)"),
+    "zarr": ("convert_emd2zarr", "Convert to chunked OME-NGFF zarr"),
+    "multi": ("convert_emd_multi", "Read every file once and write png, mrc and tiff"),
+    "contact-sheet": ("contact_sheet", "Pages of thumbnails for a directory"),
+    "watch": ("watch_emd", "Convert new files as soon as the microscope finished writing them"),
+    "serve": ("preview_server", "Local HTTP server rendering png previews on demand"),
+    "catalogue": ("catalogue", "Index the metadata of all files and list the matching ones (headers only)"),
+    "cluster": ("cluster", "Queue status and merging of distributed runs"),
+    "compare-denoise": ("denoise", "Time the denoise backends and check them against the skimage median"),
+    "fixtures": ("synthetic_emd", "Generate synthetic Velox EMD files for benchmarks"),
+}
+
+def _command_name(argv:list)->str:
+    # the top level parser has no options of its own, so the first positional argument is the command
+    return next((arg for arg in argv if not arg.startswith("-")), None)
+
+def build_parser(command:str=None)->argparse.ArgumentParser:
+    """The argparse parser of the emd-convert CLI. Only the options of `command` are added (importing its module),
+    the other commands are listed with their help text only.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="emd-convert",
+        description="Convert Velox EMD files to png, tiff, mrc and zarr, and the tools around it. "
+        "Run emd-convert <command> --help for the options of a command.",
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="command", required=True)
+    for name, (module_name, help) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help, description=help)
+        if name == command:
+            module = importlib.import_module(f".{module_name}", __package__)
+            module.add_arguments(subparser)
+            subparser.set_defaults(run=module.main)
+    return parser
+
+def main(argv:list=None):
+    """Entry point of the emd-convert command."""
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_parser(_command_name(argv)).parse_args(argv)
+    args.run(args)
@@ -0,0 +1,243 @@
+#%%
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+from pathlib import Path
+import argparse
+from .profiling import RunReport
+from .conversion_cache import ConversionManifest, MANIFEST_NAME
+
+
+#%%
+# Function definitions:
+QUEUE_DIR = ".emd_queue"
+DEFAULT_STALE_AFTER = 600
+# unique per running converter, names the per node manifest and report files
+NODE_NAME = f"{socket.gethostname()}.{os.getpid()}"
+
+def parse_shard(shard:str)->tuple:
+    """Parse "i/N" (1 <= i <= N) for argparse."""
+    try:
+        i, n = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard has to look like i/N, got {shard!r}")
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f"Shard index has to be between 1 and {n}, got {i}")
+    return i, n
+
+def shard_files(emd_files, emd_dir:Path, shard:tuple)->list:
+    """The files of shard (i, N): a file belongs to the shard whose index matches the crc32 of its path
+    relative to emd_dir. The assignment doesn't depend on the order of the files or on the mount point of the share,
+    and files that appear between the start of two nodes don't shift the other files to other shards.
+    """
+    i, n = shard
+    emd_files = [
+        emd_file for emd_file in emd_files
+        if zlib.crc32(Path(emd_file).relative_to(emd_dir).as_posix().encode()) % n == i - 1
+    ]
+    print(f"Shard {i}/{n}: {len(emd_files)} files")
+    return emd_files
+
+
+class ClaimQueue:
+    """Work queue on a shared file system without any service: before converting a file, a node creates a claim file
+    for it with O_EXCL, which only one node can succeed with. Finished claims are renamed to .done (or .failed),
+    so the other nodes skip the file. The claim name is a hash of the relative path, size and mtime of the file,
+    the converter and its parameters, so changed files or parameters are converted again in later runs.
+
+    Claims of running conversions are touched every stale_after / 4 seconds. Claims that weren't touched
+    for stale_after seconds (crashed or killed node) are taken over by the next node that comes along.
+    Keep stale_after well above the clock skew between the nodes.
+    Delete the .failed files in the queue directory to retry failed conversions.
+    """
+
+    def __init__(self, queue_dir:Path, emd_dir:Path, stale_after:float=DEFAULT_STALE_AFTER):
+        self.queue_dir = Path(queue_dir)
+        self.queue_dir.mkdir(parents=True, exist_ok=True)
+        self.emd_dir = Path(emd_dir)
+        self.stale_after = stale_after
+        self._held = {}     # emd_file -> claim path
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    @classmethod
+    def for_directory(cls, emd_dir:Path, **kwargs):
+        return cls(Path(emd_dir) / QUEUE_DIR, emd_dir, **kwargs)
+
+    def _claim_path(self, emd_file:Path, converter:str, params:dict)->Path:
+        stat = emd_file.stat()
+        job = [Path(emd_file).relative_to(self.emd_dir).as_posix(), stat.st_size, stat.st_mtime_ns, converter, params]
+        name = hashlib.sha1(json.dumps(job, sort_keys=True, default=str).encode()).hexdigest()
+        return self.queue_dir / f"{name}.claim"
+
+    def _finished(self, claim_path:Path)->bool:
+        return claim_path.with_suffix(".done").exists() or claim_path.with_suffix(".failed").exists()
+
+    def _create(self, claim_path:Path, emd_file:Path):
+        fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"file": str(emd_file), "node": NODE_NAME, "claimed": time.time()}, f)
+
+    def _is_stale(self, claim_path:Path)->bool:
+        try:
+            return time.time() - claim_path.stat().st_mtime > self.stale_after
+        except FileNotFoundError:
+            return False
+
+    def _take_over(self, claim_path:Path, emd_file:Path)->bool:
+        # renaming is atomic, only one of several nodes that found the claim stale gets it
+        stale_path = claim_path.with_suffix(f".stale.{NODE_NAME}")
+        try:
+            os.rename(claim_path, stale_path)
+        except FileNotFoundError:
+            return False
+        if not self._is_stale(stale_path):
+            # another node took the claim over in the meantime, put its fresh claim back
+            try:
+                os.link(stale_path, claim_path)
+            except FileExistsError:
+                pass
+            stale_path.unlink()
+            return False
+        with open(stale_path) as f:
+            previous = json.load(f).get("node")
+        stale_path.unlink()
+        print(f"Taking over the stale claim of {previous} for {emd_file.name}")
+        try:
+            self._create(claim_path, emd_file)
+        except FileExistsError:
+            return False
+        return True
+
+    def claim(self, emd_file:Path, converter:str, params:dict)->bool:
+        """Try to claim emd_file for this node. False if another node is converting it or it is already finished."""
+        claim_path = self._claim_path(emd_file, converter, params)
+        if self._finished(claim_path):
+            return False
+        try:
+            self._create(claim_path, emd_file)
+        except FileExistsError:
+            if not self._is_stale(claim_path) or not self._take_over(claim_path, emd_file):
+                return False
+        if self._finished(claim_path):
+            # finished by another node between the check and the claim
+            claim_path.unlink()
+            return False
+        with self._lock:
+            self._held[emd_file] = claim_path
+        self._start_heartbeat()
+        return True
+
+    def release(self, emd_file:Path, ok:bool=True):
+        """Mark a claimed file as done (or failed, so that the other nodes don't retry it in this run)."""
+        with self._lock:
+            claim_path = self._held.pop(emd_file)
+        try:
+            os.replace(claim_path, claim_path.with_suffix(".done" if ok else ".failed"))
+        except FileNotFoundError:
+            print(f"The claim for {emd_file.name} was taken over by another node")
+
+    def _start_heartbeat(self):
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._touch_claims, daemon=True)
+            self._heartbeat.start()
+
+    def _touch_claims(self):
+        while not self._stop.wait(self.stale_after / 4):
+            with self._lock:
+                claim_paths = list(self._held.values())
+            for claim_path in claim_paths:
+                try:
+                    os.utime(claim_path)
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        """Stop the heartbeat and give up the claims of unfinished files, e.g. after Ctrl+C."""
+        self._stop.set()
+        with self._lock:
+            claim_paths, self._held = list(self._held.values()), {}
+        for claim_path in claim_paths:
+            claim_path.unlink(missing_ok=True)
+
+    def status(self)->dict:
+        """Number of running, done and failed claims in the queue directory."""
+        counts = {"claim": 0, "done": 0, "failed": 0}
+        for path in self.queue_dir.iterdir():
+            suffix = path.suffix.lstrip(".")
+            if suffix in counts:
+                counts[suffix] += 1
+        return counts
+
+
+def merge_reports(emd_dir:Path, report_path:Path=None):
+    """Append the per node reports conversion_report.<node>.jsonl of a distributed run to one report
+    (default: conversion_report.jsonl in emd_dir), delete them and print the summary of the whole run.
+    The wall time of the run is the span from the first start to the last end of a conversion on any node.
+    """
+
+    emd_dir = Path(emd_dir)
+    node_reports = sorted(emd_dir.glob("conversion_report.*.jsonl"))
+    if not node_reports:
+        print("No per node reports to merge")
+        return None
+    report = RunReport(report_path or emd_dir / "conversion_report.jsonl")
+    for node_report in node_reports:
+        with open(node_report) as f:
+            for line in f:
+                if line.strip():
+                    report.add(json.loads(line))
+    print(f"Merged the reports of {len(node_reports)} nodes")
+    for node_report in node_reports:
+        node_report.unlink()
+    timed = [record for record in report.records if "end" in record]
+    wall = max(r["end"] for r in timed) - min(r["end"] - r["wall"] for r in timed) if timed else None
+    report.summary(wall=wall)
+    return report
+
+def merge_manifests(emd_dir:Path):
+    """Merge the per node conversion manifests of a distributed run into the manifest of emd_dir and delete them."""
+    emd_dir = Path(emd_dir)
+    node_manifests = sorted(emd_dir.glob(f"{Path(MANIFEST_NAME).stem}.*.json"))
+    if not node_manifests:
+        return
+    manifest = ConversionManifest.for_directory(emd_dir)
+    for node_manifest in node_manifests:
+        with open(node_manifest) as f:
+            for emd_file, converters in json.load(f).items():
+                manifest.entries.setdefault(emd_file, {}).update(converters)
+    manifest.save()
+    for node_manifest in node_manifests:
+        node_manifest.unlink()
+    print(f"Merged the manifests of {len(node_manifests)} nodes")
+
+
+
+##################################################################################################
+
+def add_arguments(parser):
+    """Add the options of `emd-convert cluster` to its argparse parser."""
+    parser.description = (
+        "Show the work queue of a distributed conversion (--shard / --queue of the converters) "
+        "and merge the per node reports and manifests once all nodes finished."
+    )
+    parser.add_argument("emd_dir")
+    parser.add_argument("--merge", action="store_true", help="Merge the per node reports and conversion manifests")
+    parser.add_argument("--report", default=None, help="Report to merge into (default: conversion_report.jsonl in emd_dir)")
+
+def main(args):
+    """Run `emd-convert cluster` with the options parsed by add_arguments."""
+    emd_dir = Path(args.emd_dir)
+    assert emd_dir.exists() and emd_dir.is_dir()
+
+    if (emd_dir / QUEUE_DIR).exists():
+        counts = ClaimQueue.for_directory(emd_dir).status()
+        print(f"Queue: {counts['claim']} running, {counts['done']} done, {counts['failed']} failed")
+    if args.merge:
+        merge_manifests(emd_dir)
+        merge_reports(emd_dir, args.report)
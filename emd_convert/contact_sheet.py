@@ -0,0 +1,141 @@
+#%%
+import math
+from pathlib import Path
+import numpy as np
+from PIL import Image, ImageDraw
+from .emd_reader import load_emd
+from .preview import make_preview, scale_px_size
+from .scalebar import add_scalebar, get_font
+from .conversion_cache import atomic_write
+from .batch import run_batch, add_batch_arguments, manifest_from_args, report_from_args, emd_files_from_args, claims_from_args, memory_budget_from_args
+from .profiling import stage, record_failure
+
+
+#%%
+# Function definitions:
+THUMBNAIL_DIR = ".thumbnails"
+
+def thumbnail_path(emd_file:Path, emd_dir:Path, thumb_dir:Path)->Path:
+    """Cache location of the thumbnail of an emd file, unique also for equally named files in sub directories."""
+    relative = Path(emd_file).relative_to(emd_dir).with_suffix("")
+    return Path(thumb_dir) / ("__".join(relative.parts) + ".png")
+
+def make_thumbnail(emd_file:Path, emd_dir:Path, thumb_dir:Path, thumb_size=256)->Path:
+    """Render a denoised 8 bit thumbnail with scalebar of an emd file into the thumbnail cache.
+    The image is binned by an integer factor close to the thumbnail size before the median filter,
+    so only a small image is filtered, and then resized to fit into thumb_size x thumb_size.
+
+    Args:
+        emd_file (Path): The path of the emd file
+        emd_dir (Path): The directory of the session (thumbnail names are relative to it)
+        thumb_dir (Path): The thumbnail cache directory
+        thumb_size (int, optional): Size of the longer side of the thumbnail. Defaults to 256.
+
+    Returns:
+        Path: The path of the written thumbnail.
+    """
+
+    try:
+        with stage("load"):
+            img_data, px_size = load_emd(emd_file)
+    except OSError as e:
+        record_failure(f"Could not read {emd_file.name}: {e}")
+        return None
+    if img_data.ndim == 3:
+        # stacks: single frames are too noisy for a thumbnail
+        img_data = img_data.mean(axis=0, dtype=np.float32)
+
+    with stage("preview"):
+        factor = max(max(img_data.shape[-2:]) // thumb_size, 1)
+        img_data, px_size = make_preview(img_data, px_size, downsample_factor=1 / factor, mode="bin")
+        im = Image.fromarray(img_data)
+        im.thumbnail((thumb_size, thumb_size))
+        px_size = scale_px_size(px_size, (img_data.shape[0] / im.height, img_data.shape[1] / im.width))
+        if isinstance(px_size, tuple):
+            # the scalebar is horizontal
+            px_size = px_size[1]
+
+    with stage("scalebar"):
+        add_scalebar(im, np.asarray(im), px_size_meter=px_size, fontsize_fraction=1/12)
+
+    save_dest = thumbnail_path(emd_file, emd_dir, thumb_dir)
+    with stage("png_encode"), atomic_write(save_dest) as tmp_dest:
+        im.save(tmp_dest, format="PNG")
+
+    return save_dest
+
+def render_contact_sheets(entries, save_stem:Path, columns=6, rows=5, thumb_size=256, label_fontsize=14)->list:
+    """Paste thumbnails with their file names into pages of columns x rows tiles.
+
+    Args:
+        entries (list): (label, thumbnail path) tuples in page order. Missing thumbnails are left out.
+        save_stem (Path): Pages are written to <save_stem>_001.png, <save_stem>_002.png, ...
+        columns (int, optional): Thumbnails per row. Defaults to 6.
+        rows (int, optional): Rows per page. Defaults to 5.
+        thumb_size (int, optional): Size of the thumbnails. Defaults to 256.
+        label_fontsize (int, optional): Font size of the file names. Defaults to 14.
+
+    Returns:
+        list: The paths of the written pages.
+    """
+
+    entries = [(label, path) for label, path in entries if path is not None and Path(path).exists()]
+    font = get_font(label_fontsize)
+    padding = 8
+    cell_width, cell_height = thumb_size + padding, thumb_size + label_fontsize + 2 * padding
+    per_page = columns * rows
+    n_pages = math.ceil(len(entries) / per_page)
+
+    pages = []
+    for i_page in range(n_pages):
+        page_entries = entries[i_page * per_page:(i_page + 1) * per_page]
+        page_rows = math.ceil(len(page_entries) / columns)
+        page = Image.new("L", (columns * cell_width + padding, page_rows * cell_height + padding), color=255)
+        draw = ImageDraw.Draw(page)
+        for i, (label, path) in enumerate(page_entries):
+            x, y = padding + (i % columns) * cell_width, padding + (i // columns) * cell_height
+            with Image.open(path) as thumb:
+                # center thumbnails that aren't square
+                page.paste(thumb, (x + (thumb_size - thumb.width) // 2, y + (thumb_size - thumb.height) // 2))
+            # shorten long file names from the left, the end is the informative part
+            while len(label) > 3 and draw.textlength(label, font=font) > thumb_size:
+                label = "…" + label[2:]
+            draw.text((x, y + thumb_size + padding // 2), label, font=font, fill=0)
+
+        save_dest = save_stem.with_name(f"{save_stem.name}_{i_page + 1:03d}.png")
+        with atomic_write(save_dest) as tmp_dest:
+            page.save(tmp_dest, format="PNG")
+        pages.append(save_dest)
+    print(f"Wrote {len(entries)} thumbnails to {n_pages} contact sheet(s) {save_stem.name}_*.png")
+    return pages
+
+
+
+##################################################################################################
+
+def add_arguments(parser):
+    """Add the options of `emd-convert contact-sheet` to its argparse parser."""
+    parser.description = (
+        "Build contact sheets (pages with a grid of thumbnails with scalebar and file name) for a directory of EMD files. "
+        "Thumbnails are cached and only rendered again for new or changed files."
+    )
+    parser.add_argument("emd_dir")
+    parser.add_argument("wildcard", nargs="?", default="*.emd")
+    parser.add_argument("--output", default=None, help="Path stem of the pages (default: <emd_dir>/contact_sheet)")
+    parser.add_argument("--columns", type=int, default=6)
+    parser.add_argument("--rows", type=int, default=5)
+    parser.add_argument("--thumb-size", type=int, default=256, help="Size of the longer side of a thumbnail in px (default: 256)")
+    add_batch_arguments(parser)
+
+def main(args):
+    """Run `emd-convert contact-sheet` with the options parsed by add_arguments."""
+    emd_dir = Path(args.emd_dir)
+    assert emd_dir.exists() and emd_dir.is_dir()
+    thumb_dir = emd_dir / THUMBNAIL_DIR
+    thumb_dir.mkdir(exist_ok=True)
+    emd_files = emd_files_from_args(args, emd_dir, args.wildcard)
+
+    run_batch(make_thumbnail, emd_files, jobs=args.jobs, manifest=manifest_from_args(args, emd_dir), report=report_from_args(args, emd_dir), claims=claims_from_args(args, emd_dir), memory_budget=memory_budget_from_args(args), emd_dir=emd_dir, thumb_dir=thumb_dir, thumb_size=args.thumb_size)
+
+    entries = [(str(emd_file.relative_to(emd_dir)), thumbnail_path(emd_file, emd_dir, thumb_dir)) for emd_file in emd_files]
+    render_contact_sheets(entries, Path(args.output) if args.output else emd_dir / "contact_sheet", columns=args.columns, rows=args.rows, thumb_size=args.thumb_size)
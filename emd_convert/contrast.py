@@ -0,0 +1,148 @@
+#%%
+import math
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from .emd_reader import VeloxEMD, UnsupportedLayoutError, load_emd
+
+
+#%%
+# Function definitions:
+CONTRAST_MODES = ("minmax", "percentile", "session")
+DEFAULT_PERCENTILES = (0.1, 99.9)
+MAX_SAMPLES = 1_000_000
+
+def sample_step(shape:tuple, max_samples:int=MAX_SAMPLES)->int:
+    """Stride in both directions so that a (height, width) image yields at most about max_samples pixels."""
+    height, width = shape[-2:]
+    return max(math.ceil(math.sqrt(height * width / max_samples)), 1)
+
+def subsample(img_data:np.ndarray, max_samples:int=MAX_SAMPLES)->np.ndarray:
+    """Strided view of about max_samples pixels of an image (all frames of a stack), no copy and no full array pass."""
+    step = sample_step(img_data.shape, max_samples)
+    return img_data[..., ::step, ::step]
+
+
+class IntensityHistogram:
+    """Histogram with fixed bins over a value range that can be filled with many images and merged.
+    8 and 16 bit integer data gets one bin per value (exact percentiles), other data 4096 bins over the
+    range of the first image, values outside of the range land in the first / last bin.
+    Histograms with different ranges are merged by re-binning into the combined range.
+    """
+
+    def __init__(self, value_range:tuple, bins:int=4096):
+        self.value_range = (float(value_range[0]), float(value_range[1]))
+        self.bins = bins
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    @classmethod
+    def for_values(cls, values:np.ndarray):
+        """An empty histogram suitable for the dtype (and for floats the range) of values."""
+        if values.dtype in (np.uint8, np.uint16):
+            n_values = np.iinfo(values.dtype).max + 1
+            return cls((0, n_values), bins=n_values)
+        low, high = float(values.min()), float(values.max())
+        return cls((low, high if high > low else low + 1))
+
+    def add(self, values:np.ndarray):
+        low, high = self.value_range
+        if self.bins == high - low and values.dtype in (np.uint8, np.uint16):
+            # one bin per value: bincount needs no float conversion
+            self.counts += np.bincount(values.ravel(), minlength=self.bins)[:self.bins]
+            return self
+        indices = np.subtract(values, low, dtype=np.float32)
+        indices *= self.bins / (high - low)
+        np.clip(indices, 0, self.bins - 1, out=indices)
+        self.counts += np.bincount(indices.astype(np.intp).ravel(), minlength=self.bins)
+        return self
+
+    def _rebinned(self, value_range:tuple, bins:int)->np.ndarray:
+        # counts in the new bins, assuming values are evenly spread within the old bins
+        old_edges = np.linspace(*self.value_range, self.bins + 1)
+        new_edges = np.linspace(*value_range, bins + 1)
+        cumulative = np.interp(new_edges, old_edges, np.concatenate([[0], np.cumsum(self.counts)]))
+        return np.diff(cumulative)
+
+    def merge(self, other):
+        """Add the counts of another histogram (in place)."""
+        if other.value_range == self.value_range and other.bins == self.bins:
+            self.counts += other.counts
+            return self
+        value_range = (min(self.value_range[0], other.value_range[0]), max(self.value_range[1], other.value_range[1]))
+        bins = max(self.bins, other.bins)
+        counts = self._rebinned(value_range, bins) + other._rebinned(value_range, bins)
+        self.value_range, self.bins, self.counts = value_range, bins, np.rint(counts).astype(np.int64)
+        return self
+
+    def limits(self, percentiles:tuple=DEFAULT_PERCENTILES)->tuple:
+        """The intensities at the given (low, high) percentiles (bin centers)."""
+        cumulative = np.cumsum(self.counts)
+        if cumulative[-1] == 0:
+            return self.value_range
+        low, high = self.value_range
+        bin_width = (high - low) / self.bins
+        indices = np.searchsorted(cumulative, np.asarray(percentiles) / 100 * cumulative[-1])
+        indices = np.minimum(indices, self.bins - 1)
+        return tuple(float(low + (i + 0.5) * bin_width) for i in indices)
+
+
+def contrast_limits(img_data:np.ndarray, percentiles:tuple=DEFAULT_PERCENTILES, max_samples:int=MAX_SAMPLES)->tuple:
+    """Robust (low, high) intensity limits of an image from the histogram of a strided subsample.
+    Unlike min / max, a few hot or dead pixels don't change them.
+    """
+    sample = subsample(img_data, max_samples)
+    return IntensityHistogram.for_values(sample).add(sample).limits(percentiles)
+
+def file_histogram(emd_file:Path, max_samples:int=MAX_SAMPLES)->IntensityHistogram:
+    """Histogram of a strided subsample of the first frame of an emd file. Only the sampled rows are read
+    (for uncompressed files), so this is a lightweight pass even over large sessions.
+    """
+    try:
+        with VeloxEMD(emd_file) as emd:
+            sample = emd.sample(sample_step(emd.shape, max_samples))
+    except UnsupportedLayoutError:
+        img_data, _ = load_emd(emd_file)
+        sample = subsample(img_data[0] if img_data.ndim == 3 else img_data, max_samples)
+    return IntensityHistogram.for_values(sample).add(sample)
+
+def session_limits(emd_files, percentiles:tuple=DEFAULT_PERCENTILES, jobs:int=1, max_samples:int=MAX_SAMPLES)->tuple:
+    """Intensity limits shared by all files of a session, from the merged histogram of all files.
+    Mapping every image with the same limits keeps the brightness of images of the same grid comparable.
+    Files that can't be read are left out.
+
+    Args:
+        emd_files (iterable of Path): The emd files of the session
+        percentiles (tuple, optional): (low, high) percentiles mapped to black and white. Defaults to (0.1, 99.9).
+        jobs (int, optional): Number of worker processes. Defaults to 1.
+        max_samples (int, optional): Pixels sampled per file. Defaults to 1 000 000.
+
+    Returns:
+        tuple: (low, high) intensity
+    """
+
+    emd_files = list(emd_files)
+    print(f"Computing session contrast limits from {len(emd_files)} files")
+    max_samples = [max_samples] * len(emd_files)
+    merged = None
+    # merge while the histograms come in, a 16 bit histogram has 65536 bins
+    with ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else nullcontext() as pool:
+        if pool is None:
+            histograms = map(_try_file_histogram, emd_files, max_samples)
+        else:
+            histograms = pool.map(_try_file_histogram, emd_files, max_samples, chunksize=16)
+        for histogram in histograms:
+            if histogram is not None:
+                merged = histogram if merged is None else merged.merge(histogram)
+    if merged is None:
+        raise ValueError("None of the files could be read, no session contrast limits")
+    limits = merged.limits(percentiles)
+    print(f"Session contrast limits ({percentiles[0]}% - {percentiles[1]}%): {limits[0]:.1f} - {limits[1]:.1f}")
+    return limits
+
+def _try_file_histogram(emd_file:Path, max_samples:int):
+    try:
+        return file_histogram(emd_file, max_samples)
+    except OSError as e:
+        print(f"Could not read {emd_file.name}: {e}")
+        return None
@@ -0,0 +1,168 @@
+#%%
+import hashlib
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+
+#%%
+# Function definitions:
+MANIFEST_NAME = ".emd_convert_manifest.json"
+
+def file_checksum(path:Path, chunk_size:int=1<<20)->str:
+    """sha256 hex digest of a file, read in chunks of 1 MiB."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def atomic_write(save_dest:Path):
+    """Yield a temporary path next to save_dest and rename it to save_dest once the block finished without error.
+    An interrupted conversion therefore never leaves a truncated file under the final name.
+    The temporary file keeps the suffix of save_dest, so writers that infer the format from it still work.
+    Writers may also create a directory there (e.g. a zarr store), it replaces an existing one at save_dest.
+
+    Usage:
+        with atomic_write(save_dest) as tmp_dest:
+            im.save(tmp_dest)
+    """
+
+    save_dest = Path(save_dest)
+    tmp_dest = save_dest.with_name(f".{save_dest.stem}.{os.getpid()}.part{save_dest.suffix}")
+    try:
+        yield tmp_dest
+        if tmp_dest.is_dir() and save_dest.is_dir():
+            # a directory can't replace a non-empty one
+            shutil.rmtree(save_dest)
+        os.replace(tmp_dest, save_dest)
+    finally:
+        if tmp_dest.is_dir():
+            shutil.rmtree(tmp_dest)
+        elif tmp_dest.exists():
+            tmp_dest.unlink()
+
+
+def output_size(path:Path)->int:
+    """Size of a written file in bytes, or of all files of a written directory (e.g. a zarr store)."""
+    path = Path(path)
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size
+
+
+def output_checksum(path:Path)->str:
+    """sha256 of a written file. Directories get a digest of their file names and sizes instead of their content."""
+    path = Path(path)
+    if not path.is_dir():
+        return file_checksum(path)
+    digest = hashlib.sha256()
+    for f in sorted(path.rglob("*")):
+        if f.is_file():
+            digest.update(f"{f.relative_to(path).as_posix()}:{f.stat().st_size}\n".encode())
+    return digest.hexdigest()
+
+
+def describe_outputs(outputs)->list:
+    """Manifest records (path, size and sha256) of written outputs, a path or a list of paths (None entries are skipped).
+    Hashing reads every output again, so this is called where the outputs were written (in the worker process),
+    and the records are passed on to ConversionManifest.record.
+    """
+    if isinstance(outputs, (str, Path)):
+        outputs = [outputs]
+    return [
+        {"path": str(Path(output).resolve()), "size": output_size(output), "sha256": output_checksum(output)}
+        for output in outputs if output is not None
+    ]
+
+
+class ConversionManifest:
+    """Persistent record of finished conversions, stored as json file (by default in the emd directory).
+    For every input file and converter it remembers the input size, mtime (and optionally the sha256),
+    the conversion parameters and size and checksum of the written outputs.
+    A file only needs to be converted again if one of those changed or an output went missing. The checksums
+    of inputs and outputs are only compared with use_hash, as that reads all of them again.
+    With save_path, the manifest is read from manifest_path but written to save_path (used by the nodes
+    of a distributed run, see cluster.merge_manifests).
+    """
+
+    def __init__(self, manifest_path:Path, use_hash:bool=False, save_every:int=20, save_path:Path=None):
+        self.manifest_path = Path(manifest_path)
+        self.save_path = Path(save_path) if save_path is not None else self.manifest_path
+        self.use_hash = use_hash
+        self.save_every = save_every
+        self._unsaved = 0
+        if self.manifest_path.exists():
+            with open(self.manifest_path) as f:
+                self.entries = json.load(f)
+        else:
+            self.entries = {}
+
+    @classmethod
+    def for_directory(cls, emd_dir:Path, **kwargs):
+        return cls(Path(emd_dir) / MANIFEST_NAME, **kwargs)
+
+    def _input_state(self, emd_file:Path, with_hash:bool)->dict:
+        stat = emd_file.stat()
+        state = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if with_hash:
+            state["sha256"] = file_checksum(emd_file)
+        return state
+
+    def is_up_to_date(self, emd_file:Path, converter:str, params:dict)->bool:
+        """Check whether emd_file was already converted by converter with the same params and unchanged input."""
+        entry = self.entries.get(str(emd_file.resolve()), {}).get(converter)
+        if entry is None or entry["params"] != _jsonable(params):
+            return False
+
+        recorded = entry["input"]
+        current = self._input_state(emd_file, with_hash=False)
+        if current["size"] != recorded["size"]:
+            return False
+        if current["mtime_ns"] != recorded["mtime_ns"]:
+            # e.g. re-exported or copied again: with hashing enabled unchanged content still counts as up to date
+            if not (self.use_hash and "sha256" in recorded and file_checksum(emd_file) == recorded["sha256"]):
+                return False
+            # remember the new mtime, so that the next run doesn't hash the file again
+            recorded["mtime_ns"] = current["mtime_ns"]
+            self._unsaved += 1
+
+        for output in entry["outputs"]:
+            output_path = Path(output["path"])
+            if not output_path.exists() or output_size(output_path) != output["size"]:
+                return False
+            if self.use_hash and "sha256" in output and output_checksum(output_path) != output["sha256"]:
+                return False
+        return True
+
+    def record(self, emd_file:Path, converter:str, params:dict, outputs):
+        """Remember a finished conversion. outputs is a path or a list of paths of the written files,
+        or their records from describe_outputs (computed by the worker that wrote them).
+        """
+        if isinstance(outputs, (str, Path)):
+            outputs = [outputs]
+        if not all(isinstance(output, dict) for output in outputs):
+            outputs = describe_outputs(outputs)
+        self.entries.setdefault(str(emd_file.resolve()), {})[converter] = {
+            "input": self._input_state(emd_file, with_hash=self.use_hash),
+            "params": _jsonable(params),
+            "outputs": outputs,
+        }
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    def save(self):
+        with atomic_write(self.save_path) as tmp_dest:
+            with open(tmp_dest, "w") as f:
+                json.dump(self.entries, f, indent=1)
+        self._unsaved = 0
+
+
+def _jsonable(params:dict)->dict:
+    # tuples and Paths don't survive a json round trip unchanged, so compare the json representation
+    return json.loads(json.dumps(params, sort_keys=True, default=str))
@@ -0,0 +1,186 @@
+#%%
+import numpy as np
+from pathlib import Path
+from .emd_reader import load_emd, VeloxEMD, UnsupportedLayoutError
+from .conversion_cache import atomic_write
+from .batch import run_batch, add_batch_arguments, manifest_from_args, report_from_args, emd_files_from_args, claims_from_args, memory_budget_from_args
+from .profiling import stage, record_failure
+
+
+#%%
+# Function definitions: 
+
+def mrc_voxel_size(px_size)->tuple:
+    """Convert the px size in meter (float or (height, width) tuple, see get_pixel_size) to the
+    (x, y, z) voxel size in Angstrom the mrc header expects. z gets the x size.
+    """
+
+    if isinstance(px_size, tuple):
+        y_size, x_size = px_size
+    else:
+        x_size = y_size = px_size
+    x_size, y_size = x_size * 1e10, y_size * 1e10
+    return (x_size, y_size, x_size)
+
+def convert_to_mrc(emd_file, group_frames=1):
+    """Convert velox's emd file to mrc file with 16 bit depth (The velox exporter also exports to 16 bit tif).
+    Reading via emd_reader.load_emd (falls back to the hyperspy API for unknown layouts).
+    As hyperspy can't write to mrc, I am using the mrcfile pyhton package for that.
+    Multi-frame files (movies, tilt series) are streamed in bands of rows of all frames into a memory mapped mrc stack.
+
+
+    Args:
+        emd_file (Path_object): The path of the emd file
+        group_frames (int, optional): For stacks: sum every group_frames consecutive frames into one
+            (0 sums all frames). Defaults to 1 (no summation).
+
+    Returns:
+        Path: The path of the written mrc file.
+    """
+
+
+    print(f"Converting {emd_file.name}")
+    save_dest = emd_file.parent / Path(f"{emd_file.stem}.mrc")
+    # Stream stacks without loading them:
+    try:
+        with VeloxEMD(emd_file) as emd:
+            if emd.n_frames > 1:
+                with stage("mrc_stream"):
+                    return write_mrc_stack(emd, save_dest, group_frames=group_frames)
+    except UnsupportedLayoutError:
+        pass
+    except OSError as e:
+        record_failure(f"Could not read {emd_file.name}: {e}")
+        return None
+
+    # Read image data from file:
+    try:
+        with stage("load"):
+            img_data, px_size = load_emd(emd_file)
+    except OSError as e:
+        record_failure(f"Could not read {emd_file.name}: {e}")
+        return None
+
+    return write_mrc(img_data, px_size, save_dest)
+
+def write_mrc(img_data:np.ndarray, px_size, save_dest:Path)->Path:
+    """Write an image array (or (frames, height, width) stack) with 16 bit depth to a mrc file.
+
+    Args:
+        img_data (np.ndarray): The image data as read from the emd file
+        px_size (float): The px size in meter
+        save_dest (Path): Path of the mrc file to write
+
+    Returns:
+        Path: The path of the written mrc file.
+    """
+
+    import mrcfile
+
+    # Change dtype:
+    dtype="uint16"
+    print("Changing dtype from", img_data.dtype, end=" ")
+    img:np.ndarray = img_data.astype(dtype, copy=False)
+    print("to", img.dtype)
+    # ensure that there are no negative values in the image data (otherwise converstion to uint might be problematic):
+    # assert (img >= 0).all()
+
+    # Write image data to mrcfrile:
+    print(f"Saving converted image to \"{save_dest.name}\"")
+    with stage("mrc_write"), atomic_write(save_dest) as tmp_dest:
+        with mrcfile.new(tmp_dest, overwrite=True) as f:
+            f.set_data(img)
+            if img.ndim == 3:
+                f.set_image_stack()
+            f.voxel_size = mrc_voxel_size(px_size)
+
+    return save_dest
+
+class HeaderStats:
+    """dmin, dmax, dmean and rms of the mrc header (as set by mrcfile's update_header_stats),
+    accumulated band by band while streaming a stack.
+    """
+
+    def __init__(self):
+        self.dmin, self.dmax = np.inf, -np.inf
+        self.n, self.total, self.total_sq = 0, 0.0, 0.0
+
+    def add(self, block:np.ndarray):
+        self.dmin, self.dmax = min(self.dmin, float(block.min())), max(self.dmax, float(block.max()))
+        self.n += block.size
+        # frame by frame, so that the float64 copy stays small
+        for frame in block.reshape(-1, *block.shape[-2:]):
+            values = frame.astype(np.float64).ravel()
+            self.total += values.sum()
+            self.total_sq += values @ values
+
+    def set_header(self, header):
+        mean = self.total / self.n
+        header.dmin, header.dmax = self.dmin, self.dmax
+        header.dmean = mean
+        # the standard deviation, like mrcfile
+        header.rms = np.sqrt(max(self.total_sq / self.n - mean**2, 0.0))
+
+def write_mrc_stack(emd:VeloxEMD, save_dest:Path, group_frames=1)->Path:
+    """Write the frames of a multi-frame emd file into a memory mapped mrc stack, one band of rows of all frames
+    at a time (see VeloxEMD.iter_row_blocks), so that the stack never has to fit into memory and the file is read once.
+    Single frames are written as uint16 (mode 6), summed frame groups as float32 (mode 2) as the sums
+    can overflow 16 bit.
+
+    Args:
+        emd (VeloxEMD): The opened emd file
+        save_dest (Path): Path of the mrc file to write
+        group_frames (int, optional): Sum every group_frames consecutive frames into one (0 sums all frames).
+            Defaults to 1 (no summation). Incomplete groups at the end are dropped.
+
+    Returns:
+        Path: The path of the written mrc file.
+    """
+
+    import mrcfile
+
+    n_frames = emd.n_frames
+    height, width = emd.shape[-2:]
+    if group_frames == 0:
+        group_frames = n_frames
+    n_out = n_frames // group_frames
+    if n_out == 0:
+        raise ValueError(f"Can't group {n_frames} frames in groups of {group_frames}")
+    mrc_mode, dtype = (6, np.uint16) if group_frames == 1 else (2, np.float32)
+
+    print(f"Streaming {n_frames} frames (summed in groups of {group_frames}) to \"{save_dest.name}\"")
+    with atomic_write(save_dest) as tmp_dest:
+        with mrcfile.new_mmap(tmp_dest, shape=(n_out, height, width), mrc_mode=mrc_mode, overwrite=True) as f:
+            # a frame is spread over the whole (height, width, frames) dataset, so read bands of rows of all frames instead
+            stats = HeaderStats()
+            for start, stop, block in emd.iter_row_blocks():
+                block = block[:n_out * group_frames]
+                if group_frames > 1:
+                    block = block.reshape(n_out, group_frames, stop - start, width).sum(axis=1, dtype=dtype)
+                block = block.astype(dtype, copy=False)
+                f.data[:, start:stop] = block
+                stats.add(block)
+            f.set_image_stack()
+            f.voxel_size = mrc_voxel_size(emd.pixel_size)
+            # mrcfile's update_header_stats would read the whole stack again as float32 copy
+            stats.set_header(f.header)
+
+    return save_dest
+
+##################################################################################################
+
+def add_arguments(parser):
+    """Add the options of `emd-convert mrc` to its argparse parser."""
+    parser.description = "Command line EMD to MRC converter"
+    parser.add_argument("emd_dir")
+    parser.add_argument("wildcard", nargs="?", default="*.emd")
+    parser.add_argument("--group-frames", type=int, default=1, help="For multi-frame files: sum every N consecutive frames (0 sums all frames, default: 1)")
+    add_batch_arguments(parser)
+
+def main(args):
+    """Run `emd-convert mrc` with the options parsed by add_arguments."""
+    emd_dir = Path(args.emd_dir)
+    assert emd_dir.exists() and emd_dir.is_dir()
+    wildcard = args.wildcard
+
+    run_batch(convert_to_mrc, emd_files_from_args(args, emd_dir, wildcard), jobs=args.jobs, manifest=manifest_from_args(args, emd_dir), report=report_from_args(args, emd_dir), claims=claims_from_args(args, emd_dir), memory_budget=memory_budget_from_args(args), group_frames=args.group_frames)
@@ -0,0 +1,199 @@
+#%%
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from .emd_reader import load_emd
+from .scalebar import add_scalebar
+from .preview import make_preview, PREVIEW_ORDERS, DOWNSAMPLE_MODES
+from .conversion_cache import atomic_write
+from .tiled import needs_tiling, write_png_tiled, DEFAULT_MAX_MEMORY
+from .pyramid import write_pyramid, write_pyramid_tiled, pyramid_outputs, PYRAMID_FORMATS, TILE_FORMATS
+from .denoise import DENOISE_BACKENDS
+from .power_spectrum import write_power_spectrum, read_central_crop
+from .contrast import contrast_limits, file_histogram, session_limits, CONTRAST_MODES, DEFAULT_PERCENTILES
+from .batch import run_batch, add_batch_arguments, manifest_from_args, report_from_args, emd_files_from_args, claims_from_args, memory_budget_from_args
+from .profiling import stage, record_failure
+
+
+#%%
+# Function definitions: 
+def convert_to_png(emd_file, downsample_factor=0.5, overwrite=False, preview_order="downsample-first", downsample_mode="rescale", tiled=False, max_memory=None,
+                   contrast="minmax", percentiles=DEFAULT_PERCENTILES, in_range=None, denoise="fast-median", denoise_threads=1,
+                   power_spectrum=False):
+    # contrast: "minmax" maps min and max of every preview to black and white, "percentile" the given percentiles
+    # of every image (robust against hot pixels) and "session" the limits in_range shared by all images of a batch.
+    # power_spectrum also writes <stem>_ps.png and <stem>_ps.csv (see power_spectrum.write_power_spectrum)
+    if contrast == "session" and in_range is None:
+        raise ValueError("Session contrast needs the shared in_range, see contrast.session_limits")
+
+    print(f"Converting {emd_file.name}")
+
+    save_dest = emd_file.parent / Path(f"{emd_file.stem}.png")
+    if save_dest.exists() and not overwrite:
+        print(f"{save_dest.name} already exists. Coninuing with next .emd file.")
+        return None
+
+    # Atlas and montage images would blow the memory budget, process them in bands instead:
+    if tiled or (max_memory is not None and needs_tiling(emd_file, max_memory)):
+        if contrast == "percentile":
+            with stage("contrast"):
+                in_range = file_histogram(emd_file).limits(percentiles)
+        with stage("tiled_png"):
+            written = write_png_tiled(emd_file, save_dest, downsample_factor=downsample_factor, max_memory=max_memory or DEFAULT_MAX_MEMORY, add_scalebar=add_scalebar, in_range=in_range,
+                                      denoise_backend=denoise)
+        if not power_spectrum:
+            return written
+        with stage("power_spectrum"):
+            crop, px_size = read_central_crop(emd_file)
+            return [written, *write_power_spectrum(crop, px_size, save_dest.with_suffix(""))]
+    
+    # read the emd file:
+    try:
+        with stage("load"):
+            img_data, px_size = load_emd(emd_file)
+    except OSError as e:
+        record_failure(f"Could not read {emd_file.name}: {e}")
+        return None
+
+    if contrast == "percentile":
+        with stage("contrast"):
+            in_range = contrast_limits(img_data, percentiles)
+
+    written = write_png(img_data, px_size, save_dest, downsample_factor=downsample_factor, preview_order=preview_order, downsample_mode=downsample_mode, in_range=in_range,
+                        denoise=denoise, denoise_threads=denoise_threads)
+    if not power_spectrum:
+        return written
+    with stage("power_spectrum"):
+        return [written, *write_power_spectrum(img_data, px_size, save_dest.with_suffix(""))]
+
+def write_png(img_data:np.ndarray, px_size, save_dest:Path, downsample_factor=0.5, preview_order="downsample-first", downsample_mode="rescale", in_range=None,
+              denoise="fast-median", denoise_threads=1)->Path:
+    """Denoise, downsample and convert an image array to an 8 bit png with scalebar.
+
+    Args:
+        img_data (np.ndarray): The image data as read from the emd file
+        px_size (float): The px size in meter
+        save_dest (Path or file object): Path of the png file to write, or a binary file object to encode the png into
+        downsample_factor (float, optional): Scale factor for the png. Defaults to 0.5.
+        preview_order (str, optional): Order of the processing steps, see preview.make_preview. Defaults to "downsample-first".
+        downsample_mode (str, optional): "rescale", "bin" or "fourier", see preview.downsample. Defaults to "rescale".
+        in_range (tuple, optional): (low, high) intensities mapped to black and white. Defaults to None (min and max of the preview).
+        denoise (str, optional): Denoise backend, one of denoise.DENOISE_BACKENDS. Defaults to "fast-median".
+        denoise_threads (int, optional): Threads for denoising. Defaults to 1.
+
+    Returns:
+        Path: The path of the written png file.
+    """
+
+    # denoise and downsample the image:
+    print(f"Also downsampling image by {downsample_factor} ({downsample_mode})")
+    with stage("preview"):
+        img_data, px_size = make_preview(img_data, px_size, downsample_factor=downsample_factor, order=preview_order, mode=downsample_mode, in_range=in_range,
+                                         denoise_backend=denoise, threads=denoise_threads)
+    print(f"Size of image scaled by {downsample_factor}:", img_data.shape)
+    if isinstance(px_size, tuple):
+        # the scalebar is horizontal
+        px_size = px_size[1]
+
+    # add ad scalebar and save png file:
+    im = Image.fromarray(img_data)
+    with stage("scalebar"):
+        add_scalebar(im, img_data, px_size_meter=px_size)
+    if hasattr(save_dest, "write"):
+        with stage("png_encode"):
+            im.save(save_dest, format="PNG")
+        return save_dest
+    print(f"Writing png file (down-)scaled by {downsample_factor} to {save_dest.name}")
+    with stage("png_encode"), atomic_write(save_dest) as tmp_dest:
+        im.save(tmp_dest, format="PNG")
+
+    return save_dest
+
+def convert_to_pyramid(emd_file, pyramid="dzi", tile_format="png", overwrite=False, preview_order="downsample-first", tiled=False, max_memory=None):
+    """Convert an emd file to a multi-resolution image pyramid for browsing large atlas and montage images.
+    The full resolution level is denoised like the png, every smaller level is computed from the previous one
+    and gets its own scalebar. The pyramid is written to <stem>_pyramid.dzi (tiles in <stem>_pyramid_files)
+    or <stem>_pyramid.tiff, so it doesn't replace the raw tiff of convert_emd2tiff.
+
+    Args:
+        emd_file (Path_object): The path of the emd file
+        pyramid (str, optional): "dzi" (Deep Zoom tiles for web viewers) or "tiff" (pyramidal tiled tiff). Defaults to "dzi".
+        tile_format (str, optional): Tile format of Deep Zoom images, "png" or "webp". Defaults to "png".
+        overwrite (bool, optional): Overwrite an existing pyramid. Defaults to False.
+        preview_order (str, optional): Order of the processing steps, see preview.make_preview. Defaults to "downsample-first".
+        tiled (bool, optional): Always process the image in bands of rows. Defaults to False.
+        max_memory (int, optional): Memory budget in bytes, larger images are processed tiled. Defaults to None (no limit).
+
+    Returns:
+        list: The paths of the written .dzi file and its tile directory, or of the .tiff file.
+    """
+
+    print(f"Converting {emd_file.name}")
+
+    save_dest = emd_file.parent / Path(f"{emd_file.stem}_pyramid.{pyramid}")
+    if save_dest.exists() and not overwrite:
+        print(f"{save_dest.name} already exists. Coninuing with next .emd file.")
+        return None
+
+    if tiled or (max_memory is not None and needs_tiling(emd_file, max_memory)):
+        with stage("tiled_pyramid"):
+            written = write_pyramid_tiled(emd_file, save_dest, max_memory=max_memory or DEFAULT_MAX_MEMORY, tile_format=tile_format, add_scalebar=add_scalebar)
+        return pyramid_outputs(written)
+
+    try:
+        with stage("load"):
+            img_data, px_size = load_emd(emd_file)
+    except OSError as e:
+        record_failure(f"Could not read {emd_file.name}: {e}")
+        return None
+
+    # the pyramid levels do the downsampling, so the preview is computed at full resolution:
+    with stage("preview"):
+        img_data, px_size = make_preview(img_data, px_size, downsample_factor=1, order=preview_order)
+    with stage("pyramid"):
+        written = write_pyramid(img_data, px_size, save_dest, tile_format=tile_format, add_scalebar=add_scalebar)
+    return pyramid_outputs(written)
+
+
+
+##################################################################################################
+
+def add_arguments(parser):
+    """Add the options of `emd-convert png` to its argparse parser."""
+    parser.description = "Command line EMD to PNG converter. Also adds a scalebar infering the pixel size from the emd-files metadata."
+    parser.add_argument("emd_dir")
+    parser.add_argument("wildcard", nargs="?", default="*.emd")
+    parser.add_argument("--preview-order", choices=PREVIEW_ORDERS, default="downsample-first", help="Downsample before denoising (fast, default) or the original full resolution median filter first (legacy)")
+    parser.add_argument("--downsample-mode", choices=DOWNSAMPLE_MODES, default="rescale", help="rescale: anti-aliased interpolation (default), bin: integer binning, fourier: Fourier cropping")
+    parser.add_argument("--denoise", choices=DENOISE_BACKENDS, default="fast-median", help="Denoise filter: fast-median (3x3 median, default), median (skimage, identical result, slower), gaussian, mean (3x3 box) or none")
+    parser.add_argument("--denoise-threads", type=int, default=1, help="Threads denoising bands of one image (default: 1)")
+    parser.add_argument("--power-spectrum", action="store_true", help="Also write the log power spectrum (<name>_ps.png) and its radial profile (<name>_ps.csv) of every image")
+    parser.add_argument("--tiled", action="store_true", help="Process all images in bands of rows with bounded memory (uses binning for downsampling)")
+    parser.add_argument("--max-memory", type=float, default=None, help="Memory budget per image in MiB. Images that don't fit are processed tiled.")
+    parser.add_argument("--contrast", choices=CONTRAST_MODES, default="minmax", help="minmax: min and max of every image (default), percentile: robust percentiles of every image, session: the same percentile limits for all images")
+    parser.add_argument("--percentiles", type=float, nargs=2, default=DEFAULT_PERCENTILES, metavar=("LOW", "HIGH"), help="Percentiles mapped to black and white (default: 0.1 99.9)")
+    parser.add_argument("--pyramid", choices=PYRAMID_FORMATS, default=None, help="Write a multi-resolution pyramid instead of the png: dzi (Deep Zoom tiles for web viewers) or tiff (pyramidal tiled tiff), named <name>_pyramid.dzi / .tiff")
+    parser.add_argument("--tile-format", choices=TILE_FORMATS, default="png", help="Tile format of Deep Zoom pyramids (default: png)")
+    add_batch_arguments(parser)
+
+def main(args):
+    """Run `emd-convert png` with the options parsed by add_arguments."""
+    emd_dir = Path(args.emd_dir)
+    assert emd_dir.exists() and emd_dir.is_dir()
+    wildcard = args.wildcard
+
+    # files that wouldn't fit into the memory budget on their own are processed tiled
+    max_memory = args.max_memory and int(args.max_memory * 2**20) or memory_budget_from_args(args)
+    emd_files = emd_files_from_args(args, emd_dir, wildcard)
+    in_range = None
+    if args.contrast == "session":
+        # every shard of a distributed run needs the limits of the whole session
+        session_files = emd_files if args.shard is None else emd_files_from_args(args, emd_dir, wildcard, sharded=False)
+        in_range = session_limits(session_files, tuple(args.percentiles), jobs=args.jobs)
+    # with the conversion manifest enabled, the manifest decides what is up to date instead of the existing png
+    if args.pyramid is not None:
+        run_batch(convert_to_pyramid, emd_files, jobs=args.jobs, manifest=manifest_from_args(args, emd_dir), report=report_from_args(args, emd_dir), claims=claims_from_args(args, emd_dir), memory_budget=memory_budget_from_args(args), overwrite=not args.no_cache, pyramid=args.pyramid, tile_format=args.tile_format, preview_order=args.preview_order, tiled=args.tiled, max_memory=max_memory)
+    else:
+        run_batch(convert_to_png, emd_files, jobs=args.jobs, manifest=manifest_from_args(args, emd_dir), report=report_from_args(args, emd_dir), claims=claims_from_args(args, emd_dir), memory_budget=memory_budget_from_args(args), overwrite=not args.no_cache, preview_order=args.preview_order, downsample_mode=args.downsample_mode, tiled=args.tiled, max_memory=max_memory,
+                  contrast=args.contrast, percentiles=tuple(args.percentiles), in_range=in_range,
+                  denoise=args.denoise, denoise_threads=args.denoise_threads, power_spectrum=args.power_spectrum)
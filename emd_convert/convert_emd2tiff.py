@@ -0,0 +1,159 @@
+#%%
+import importlib.util
+import numpy as np
+from pathlib import Path
+from .emd_reader import load_emd, VeloxEMD
+from .preview import map_to_16bit
+from .tiled import needs_tiling, write_tiff_tiled
+from .conversion_cache import atomic_write
+from .batch import run_batch, add_batch_arguments, manifest_from_args, report_from_args, emd_files_from_args, claims_from_args, memory_budget_from_args
+from .profiling import stage, record_failure
+
+#%%
+# Function definitions: 
+TIFF_COMPRESSIONS = {
+    "none": None,
+    "deflate": "zlib",
+    "zstd": "zstd",
+    "lzw": "lzw",
+}
+
+def _has_imagecodecs()->bool:
+    return importlib.util.find_spec("imagecodecs") is not None
+
+def tiff_options(px_size, compression="deflate", threads=None, bigtiff=False, imagej=False, dtype=None)->dict:
+    """Keyword arguments for tifffile.imwrite: lossless compression (with predictor),
+    number of compression threads and the pixel size as calibration.
+
+    Integer data gets the horizontal predictor. Float data would get the floating point predictor,
+    which needs the optional imagecodecs package, so without it float data is written without predictor.
+
+    The pixel size is stored in the XResolution / YResolution tags in pixels per cm. With imagej=True
+    the file is written in ImageJ format instead (calibration in pixels per µm with unit "um"),
+    which Fiji shows as calibrated image. ImageJ files can't be tiled.
+
+    Args:
+        px_size (float): The px size in meter (float or (height, width) tuple)
+        compression (str, optional): One of TIFF_COMPRESSIONS. zstd and lzw need the imagecodecs package. Defaults to "deflate".
+        threads (int, optional): Threads compressing tiles in parallel. Defaults to None (tifffile decides).
+        bigtiff (bool, optional): Force BigTIFF. Defaults to False (only when the image doesn't fit into 2 GiB).
+        imagej (bool, optional): Write ImageJ calibration. Defaults to False.
+        dtype (optional): dtype of the written data. Defaults to None (unknown, treated like float).
+
+    Returns:
+        dict: The keyword arguments
+    """
+
+    px_height, px_width = px_size if isinstance(px_size, tuple) else (px_size, px_size)
+    options = {"compression": TIFF_COMPRESSIONS[compression], "maxworkers": threads}
+    integer = dtype is not None and np.issubdtype(dtype, np.integer)
+    if compression != "none" and (integer or _has_imagecodecs()):
+        options["predictor"] = True
+    if bigtiff:
+        options["bigtiff"] = True
+    if imagej:
+        options.update(imagej=True, resolution=(1e-6 / px_width, 1e-6 / px_height), metadata={"unit": "um"})
+    else:
+        options.update(resolution=(1e-2 / px_width, 1e-2 / px_height), resolutionunit="CENTIMETER")
+    return options
+
+def convert_to_tiff(emd_file, tiled=False, max_memory=None, compression="deflate", tile=(256, 256), threads=None, bigtiff=False, imagej=False, map_16bit=False):
+    """Convert velox's emd file to tiff file with 16 bit depth (The velox exporter also exports to 16 bit tif).
+    Reading via emd_reader.load_emd (falls back to the hyperspy API for unknown layouts).
+
+    Atlas and Square images can be written tile by tile (tiled=True or when they exceed max_memory),
+    so they are never loaded completely.
+
+    Args:
+        emd_file (Path_object): The path of the emd file
+        tiled (bool, optional): Always write a tiled tiff reading the image in bands. Defaults to False.
+        max_memory (int, optional): Memory budget in bytes, larger images are written tiled. Defaults to None (no limit).
+        compression, tile, threads, bigtiff, imagej, map_16bit: See write_tiff
+
+    Returns:
+        Path: The path of the written tiff file.
+    """
+
+    print(f"Converting \"{emd_file.name}\"")
+    save_dest = emd_file.parent / Path(f"{emd_file.stem}.tiff")
+    if tiled or (max_memory is not None and needs_tiling(emd_file, max_memory)):
+        with VeloxEMD(emd_file) as emd:
+            px_size, dtype = emd.pixel_size, np.dtype(np.uint16) if map_16bit else emd.dtype
+        options = tiff_options(px_size, compression, threads, bigtiff, dtype=dtype)
+        with stage("tiled_tiff"):
+            return write_tiff_tiled(emd_file, save_dest, tile=tile, map_16bit=map_16bit, **options)
+
+    # Read image data from file:
+    try:
+        with stage("load"):
+            img, px_size = load_emd(emd_file)
+    except OSError as e:
+        record_failure(f"Could not read {emd_file.name}: {e}")
+        return None
+
+    return write_tiff(img, px_size, save_dest, compression=compression, tile=tile, threads=threads, bigtiff=bigtiff, imagej=imagej, map_16bit=map_16bit)
+
+def write_tiff(img:np.ndarray, px_size, save_dest:Path, compression="deflate", tile=(256, 256), threads=None, bigtiff=False, imagej=False, map_16bit=False)->Path:
+    """Write an image array to a compressed, tiled tiff file with the pixel size as calibration.
+
+    Args:
+        img (np.ndarray): The image data as read from the emd file
+        px_size (float): The px size in meter
+        save_dest (Path or file object): Path of the tiff file to write, or a binary file object to encode the tiff into
+        compression (str, optional): Lossless compression, one of TIFF_COMPRESSIONS. Defaults to "deflate".
+        tile (tuple, optional): (height, width) of the tiff tiles, None for strips. Defaults to (256, 256).
+        threads (int, optional): Threads compressing tiles in parallel. Defaults to None (tifffile decides).
+        bigtiff (bool, optional): Force BigTIFF. Defaults to False (only when the image doesn't fit into 2 GiB).
+        imagej (bool, optional): Write an ImageJ tiff with calibration in µm (not tiled). Defaults to False.
+        map_16bit (bool, optional): Stretch the intensities to the full uint16 range. Defaults to False (raw data).
+
+    Returns:
+        Path: The path of the written tiff file.
+    """
+
+    import tifffile
+
+    if map_16bit:
+        img = map_to_16bit(img)
+    options = tiff_options(px_size, compression, threads, bigtiff or img.nbytes > 2**31, imagej, dtype=img.dtype)
+    if imagej:
+        tile = None
+
+    if hasattr(save_dest, "write"):
+        with stage("tiff_encode"):
+            tifffile.imwrite(save_dest, img, tile=tile, **options)
+        return save_dest
+    print(f"Saving {img.dtype} image {img.shape} to \"{save_dest.name}\" ({compression} compression)")
+    with stage("tiff_write"), atomic_write(save_dest) as tmp_dest:
+        tifffile.imwrite(tmp_dest, img, tile=tile, **options)
+
+    return save_dest
+
+
+##################################################################################################
+
+def add_arguments(parser):
+    """Add the options of `emd-convert tiff` to its argparse parser."""
+    parser.description = "Command line EMD to TIFF converter"
+    parser.add_argument("emd_dir")
+    parser.add_argument("wildcard", nargs="?", default="*.emd")
+    parser.add_argument("--tiled", action="store_true", help="Write tiled tiffs, reading the images band by band with bounded memory")
+    parser.add_argument("--max-memory", type=float, default=None, help="Memory budget per image in MiB. Images that don't fit are written tiled.")
+    parser.add_argument("--compression", choices=TIFF_COMPRESSIONS, default="deflate", help="Lossless compression (default: deflate, zstd and lzw need imagecodecs)")
+    parser.add_argument("--tile", type=int, default=256, help="Tile size in px, a multiple of 16 (default: 256, 0 for strips)")
+    parser.add_argument("--threads", type=int, default=None, help="Threads compressing tiles in parallel (default: chosen by tifffile)")
+    parser.add_argument("--bigtiff", action="store_true", help="Always write BigTIFF (default: only for images larger than 2 GiB)")
+    parser.add_argument("--imagej", action="store_true", help="Write ImageJ tiffs with the calibration in µm (not tiled)")
+    parser.add_argument("--map-16bit", action="store_true", help="Stretch the intensities to the full 16 bit range instead of writing the raw data")
+    add_batch_arguments(parser)
+
+def main(args):
+    """Run `emd-convert tiff` with the options parsed by add_arguments."""
+    emd_dir = Path(args.emd_dir)
+    assert emd_dir.exists() and emd_dir.is_dir()
+    wildcard = args.wildcard
+
+    # files that wouldn't fit into the memory budget on their own are written tiled
+    max_memory = args.max_memory and int(args.max_memory * 2**20) or memory_budget_from_args(args)
+    run_batch(convert_to_tiff, emd_files_from_args(args, emd_dir, wildcard), jobs=args.jobs, manifest=manifest_from_args(args, emd_dir), report=report_from_args(args, emd_dir), claims=claims_from_args(args, emd_dir), memory_budget=memory_budget_from_args(args), tiled=args.tiled, max_memory=max_memory,
+              compression=args.compression, tile=(args.tile, args.tile) if args.tile else None, threads=args.threads, bigtiff=args.bigtiff, imagej=args.imagej, map_16bit=args.map_16bit)
@@ -0,0 +1,200 @@
+#%%
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import zarr
+from numcodecs import blosc, Blosc, Zlib
+from .emd_reader import load_emd, VeloxEMD, UnsupportedLayoutError
+from .preview import bin_image
+from .conversion_cache import atomic_write
+from .batch import run_batch, add_batch_arguments, manifest_from_args, report_from_args, emd_files_from_args, claims_from_args, memory_budget_from_args
+from .profiling import stage, record_failure
+
+
+#%%
+# Function definitions:
+ZARR_COMPRESSIONS = ("zstd", "lz4", "zlib", "none")
+
+def zarr_compressor(compression="zstd", level=5):
+    """numcodecs compressor for one of ZARR_COMPRESSIONS. The blosc ones shuffle the bits of the 16 bit pixels,
+    which compresses noisy detector data much better than byte shuffling.
+    """
+    if compression in ("zstd", "lz4"):
+        return Blosc(cname=compression, clevel=level, shuffle=Blosc.BITSHUFFLE)
+    if compression == "zlib":
+        return Zlib(level=level)
+    if compression == "none":
+        return None
+    raise ValueError(f"Unknown compression {compression!r}, choose from {', '.join(ZARR_COMPRESSIONS)}")
+
+def ngff_multiscales(name:str, px_size, n_levels:int, stack:bool)->list:
+    """The OME-NGFF 0.4 "multiscales" metadata: axes (t for stacks, y, x) and one scale transformation per level
+    with the pixel size in nanometer. Every level halves the size of the previous one.
+    """
+
+    px_height, px_width = px_size if isinstance(px_size, tuple) else (px_size, px_size)
+    axes = [{"name": "y", "type": "space", "unit": "nanometer"}, {"name": "x", "type": "space", "unit": "nanometer"}]
+    if stack:
+        axes.insert(0, {"name": "t", "type": "time"})
+    datasets = []
+    for level in range(n_levels):
+        scale = [px_height * 1e9 * 2**level, px_width * 1e9 * 2**level]
+        datasets.append({"path": str(level), "coordinateTransformations": [{"type": "scale", "scale": [1.0] * stack + scale}]})
+    return [{
+        "version": "0.4",
+        "name": name,
+        "axes": axes,
+        "datasets": datasets,
+        "type": "mean",
+        "metadata": {"method": "2x2 binning of the previous level"},
+    }]
+
+def halve_frame(frame:np.ndarray)->np.ndarray:
+    """Average 2x2 blocks of the last two axes, padding odd sizes by repeating the last row / column. Keeps the dtype."""
+    height, width = frame.shape[-2:]
+    if height % 2 or width % 2:
+        frame = np.pad(frame, [(0, 0)] * (frame.ndim - 2) + [(0, height % 2), (0, width % 2)], mode="edge")
+    halved = bin_image(frame, 2)
+    if np.issubdtype(frame.dtype, np.integer):
+        np.rint(halved, out=halved)
+    return halved.astype(frame.dtype, copy=False)
+
+def _write_chunk_rows(array, start:int, block:np.ndarray, pool:ThreadPoolExecutor):
+    # block holds the rows start: of the array (of all frames for stacks); start is a multiple of the chunk height.
+    # every task writes whole rows of chunks of one frame, so no chunk is touched by two threads
+    chunk_rows = array.chunks[-2]
+    frames = [(i,) for i in range(block.shape[0])] if array.ndim == 3 else [()]
+    futures = [
+        pool.submit(array.__setitem__, (*frame, slice(start + row, start + row + chunk_rows)), block[(*frame, slice(row, row + chunk_rows))])
+        for frame in frames
+        for row in range(0, block.shape[-2], chunk_rows)
+    ]
+    for future in futures:
+        future.result()
+
+def write_ngff(blocks, n_frames:int, shape:tuple, dtype, px_size, save_dest:Path, chunks=512, compression="zstd", level=5,
+               n_levels=1, threads=4)->Path:
+    """Write bands of rows into an OME-NGFF (zarr) image, compressing and writing the chunks of a band in parallel threads.
+    Multi-frame data gets a (t, y, x) array with one frame per chunk, single frames (y, x).
+
+    Args:
+        blocks (iterable): (first row, last row + 1, (frames, rows, width) array) bands of rows of all frames, in order,
+            e.g. from VeloxEMD.iter_row_blocks. All bands but the last one need a multiple of chunks * 2**(n_levels - 1) rows.
+        n_frames (int): Number of frames (1 for single images)
+        shape (tuple): (height, width) of a frame
+        dtype: dtype of the frames
+        px_size (float): The px size in meter (float or (height, width) tuple)
+        save_dest (Path): Path of the .zarr directory to write
+        chunks (int, optional): Chunk size in y and x. Defaults to 512.
+        compression (str, optional): One of ZARR_COMPRESSIONS. Defaults to "zstd".
+        level (int, optional): Compression level. Defaults to 5.
+        n_levels (int, optional): Number of resolution levels (1: full resolution only). Defaults to 1.
+        threads (int, optional): Threads compressing and writing chunks. Defaults to 4.
+
+    Returns:
+        Path: The path of the written .zarr directory.
+    """
+
+    stack = n_frames > 1
+    compressor = zarr_compressor(compression, level)
+    if threads > 1:
+        # we compress chunks in parallel already, blosc's own threads would only compete with ours
+        blosc.use_threads = False
+
+    print(f"Writing {n_frames} frame(s) with {n_levels} resolution level(s) to \"{save_dest.name}\"")
+    with atomic_write(save_dest) as tmp_dest, ThreadPoolExecutor(max_workers=threads) as pool:
+        group = zarr.open_group(str(tmp_dest), mode="w")
+        arrays = []
+        height, width = shape
+        for level in range(n_levels):
+            level_chunks = (min(chunks, height), min(chunks, width))
+            arrays.append(group.create_dataset(
+                str(level), shape=(n_frames, height, width)[not stack:], chunks=(1, *level_chunks)[not stack:],
+                dtype=dtype, compressor=compressor, dimension_separator="/",
+            ))
+            height, width = (height + 1) // 2, (width + 1) // 2
+
+        for start, _, block in blocks:
+            if not stack:
+                block = block[0]
+            for level, array in enumerate(arrays):
+                if level > 0:
+                    block = halve_frame(block)
+                _write_chunk_rows(array, start >> level, block, pool)
+
+        group.attrs["multiscales"] = ngff_multiscales(save_dest.stem, px_size, n_levels, stack)
+
+    return save_dest
+
+def write_zarr(img_data:np.ndarray, px_size, save_dest:Path, **ngff_options)->Path:
+    """Write an image array (or (frames, height, width) stack) to an OME-NGFF zarr image, see write_ngff."""
+    stack = img_data if img_data.ndim == 3 else img_data[np.newaxis]
+    blocks = [(0, stack.shape[1], stack)]
+    return write_ngff(blocks, stack.shape[0], stack.shape[1:], img_data.dtype, px_size, save_dest, **ngff_options)
+
+def convert_to_zarr(emd_file, chunks=512, compression="zstd", level=5, n_levels=1, threads=4):
+    """Convert an emd file to a chunked, compressed OME-NGFF zarr image (raw data, no processing),
+    which analysis jobs can read partially and in parallel. Velox files are streamed in bands of rows of all frames,
+    other layouts are loaded via emd_reader.load_emd like in convert_to_mrc.
+
+    Args:
+        emd_file (Path_object): The path of the emd file
+        chunks (int, optional): Chunk size in y and x. Defaults to 512.
+        compression (str, optional): One of ZARR_COMPRESSIONS. Defaults to "zstd".
+        level (int, optional): Compression level. Defaults to 5.
+        n_levels (int, optional): Number of resolution levels of the multiscale pyramid. Defaults to 1 (no pyramid).
+        threads (int, optional): Threads compressing and writing chunks. Defaults to 4.
+
+    Returns:
+        Path: The path of the written .zarr directory.
+    """
+
+    print(f"Converting {emd_file.name}")
+    save_dest = emd_file.parent / Path(f"{emd_file.stem}.zarr")
+    ngff_options = dict(chunks=chunks, compression=compression, level=level, n_levels=n_levels, threads=threads)
+    try:
+        with VeloxEMD(emd_file) as emd:
+            with stage("zarr_stream"):
+                # bands of rows of all frames are contiguous in the file, single frames are spread over all of it
+                blocks = emd.iter_row_blocks(multiple=chunks * 2**(n_levels - 1))
+                return write_ngff(blocks, emd.n_frames, emd.shape[-2:], emd.dtype, emd.pixel_size, save_dest, **ngff_options)
+    except UnsupportedLayoutError:
+        pass
+    except OSError as e:
+        record_failure(f"Could not read {emd_file.name}: {e}")
+        return None
+
+    try:
+        with stage("load"):
+            img_data, px_size = load_emd(emd_file)
+    except OSError as e:
+        record_failure(f"Could not read {emd_file.name}: {e}")
+        return None
+
+    with stage("zarr_write"):
+        return write_zarr(img_data, px_size, save_dest, **ngff_options)
+
+
+
+##################################################################################################
+
+def add_arguments(parser):
+    """Add the options of `emd-convert zarr` to its argparse parser."""
+    parser.description = "Command line EMD to OME-NGFF (zarr) converter, for analysis jobs that read regions of the images in parallel"
+    parser.add_argument("emd_dir")
+    parser.add_argument("wildcard", nargs="?", default="*.emd")
+    parser.add_argument("--chunks", type=int, default=512, help="Chunk size in y and x in px (default: 512)")
+    parser.add_argument("--compression", choices=ZARR_COMPRESSIONS, default="zstd", help="zstd (blosc, default), lz4 (blosc, faster), zlib or none")
+    parser.add_argument("--level", type=int, default=5, help="Compression level (default: 5)")
+    parser.add_argument("--levels", type=int, default=1, help="Resolution levels of the multiscale pyramid, each half the size of the previous one (default: 1, no pyramid)")
+    parser.add_argument("--threads", type=int, default=4, help="Threads compressing and writing chunks per file (default: 4)")
+    add_batch_arguments(parser)
+
+def main(args):
+    """Run `emd-convert zarr` with the options parsed by add_arguments."""
+    emd_dir = Path(args.emd_dir)
+    assert emd_dir.exists() and emd_dir.is_dir()
+    wildcard = args.wildcard
+
+    run_batch(convert_to_zarr, emd_files_from_args(args, emd_dir, wildcard), jobs=args.jobs, manifest=manifest_from_args(args, emd_dir), report=report_from_args(args, emd_dir), claims=claims_from_args(args, emd_dir), memory_budget=memory_budget_from_args(args),
+              chunks=args.chunks, compression=args.compression, level=args.level, n_levels=args.levels, threads=args.threads)
@@ -0,0 +1,143 @@
+#%%
+import io
+from pathlib import Path
+import argparse
+from .batch import run_batch, _converter_name, add_batch_arguments, manifest_from_args, report_from_args, emd_files_from_args, claims_from_args, memory_budget_from_args
+from .pipeline import run_pipeline
+from .conversion_cache import atomic_write
+from .profiling import stage, record_failure
+from .emd_reader import load_emd
+from .convert_emd2png_add_scalebar import write_png
+from .preview import PREVIEW_ORDERS, DOWNSAMPLE_MODES
+from .denoise import DENOISE_BACKENDS
+from .convert_emd2mrc import write_mrc
+from .convert_emd2tiff import write_tiff
+
+
+#%%
+# Function definitions:
+WRITERS = {
+    "tiff": write_tiff,
+    "mrc": write_mrc,
+    "png": write_png,
+}
+
+def convert_to_formats(emd_file, formats=("png", "mrc", "tiff"), **png_options):
+    """Read an emd file once and write it to all requested formats.
+    The raw formats (tiff, mrc) are written before the png, whose processing creates new arrays anyway.
+
+    Args:
+        emd_file (Path_object): The path of the emd file
+        formats (iterable of str, optional): Any combination of "png", "mrc" and "tiff". Defaults to all three.
+        **png_options: Keyword arguments for write_png (downsample_factor, preview_order, downsample_mode, ...)
+
+    Returns:
+        list: The paths of the written files.
+    """
+
+    print(f"Converting {emd_file.name} to {', '.join(formats)}")
+    try:
+        with stage("load"):
+            img_data, px_size = load_emd(emd_file)
+    except OSError as e:
+        record_failure(f"Could not read {emd_file.name}: {e}")
+        return None
+
+    written = []
+    for fmt, writer in WRITERS.items():
+        if fmt not in formats:
+            continue
+        save_dest = emd_file.parent / Path(f"{emd_file.stem}.{fmt}")
+        if fmt == "png":
+            written.append(writer(img_data, px_size, save_dest, **png_options))
+        else:
+            written.append(writer(img_data, px_size, save_dest))
+
+    return written
+
+
+def encode_formats(emd_file, loaded, formats=("png", "mrc", "tiff"), **png_options)->dict:
+    """Compute stage of the pipelined converter: encode the png and tiff in memory, so that the writer stage
+    only has to put bytes on disk. mrcfile can only write to real files, so the worker writes the mrc itself
+    instead of sending the raw array back to the writer.
+
+    Args:
+        emd_file (Path_object): The path of the emd file
+        loaded (tuple): (image data, px size) as returned by load_emd
+        formats (iterable of str, optional): Any combination of "png", "mrc" and "tiff". Defaults to all three.
+        **png_options: Keyword arguments for write_png
+
+    Returns:
+        dict: save destination -> encoded bytes, or None for the mrc written already
+    """
+
+    img_data, px_size = loaded
+    outputs = {}
+    for fmt, writer in WRITERS.items():
+        if fmt not in formats:
+            continue
+        save_dest = emd_file.parent / Path(f"{emd_file.stem}.{fmt}")
+        if fmt == "mrc":
+            writer(img_data, px_size, save_dest)
+            outputs[save_dest] = None
+            continue
+        buffer = io.BytesIO()
+        if fmt == "png":
+            writer(img_data, px_size, buffer, **png_options)
+        else:
+            writer(img_data, px_size, buffer)
+        outputs[save_dest] = buffer.getvalue()
+    return outputs
+
+def write_outputs(emd_file, outputs:dict)->list:
+    """Write stage of the pipelined converter, see encode_formats."""
+    for save_dest, output in outputs.items():
+        if output is not None:
+            with atomic_write(save_dest) as tmp_dest:
+                tmp_dest.write_bytes(output)
+    return list(outputs)
+
+def parse_formats(formats:str)->tuple:
+    """Parse a comma separated format list like "png,mrc" for argparse."""
+    formats = tuple(fmt.strip().lower() for fmt in formats.split(",") if fmt.strip())
+    unknown = set(formats) - set(WRITERS)
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(f"Unknown format(s) {', '.join(sorted(unknown))}. Choose from {', '.join(WRITERS)}")
+    return formats
+
+
+
+##################################################################################################
+
+def add_arguments(parser):
+    """Add the options of `emd-convert multi` to its argparse parser."""
+    parser.description = "Command line EMD converter reading every file once and writing any combination of PNG (with scalebar), MRC and TIFF."
+    parser.add_argument("emd_dir")
+    parser.add_argument("wildcard", nargs="?", default="*.emd")
+    parser.add_argument("--formats", type=parse_formats, default=("png", "mrc", "tiff"), help="Comma separated list of output formats (default: png,mrc,tiff)")
+    parser.add_argument("--downsample-factor", type=float, default=0.5, help="Scale factor for the png (default: 0.5)")
+    parser.add_argument("--preview-order", choices=PREVIEW_ORDERS, default="downsample-first", help="Downsample before denoising (fast, default) or the original full resolution median filter first (legacy)")
+    parser.add_argument("--downsample-mode", choices=DOWNSAMPLE_MODES, default="rescale", help="rescale: anti-aliased interpolation (default), bin: integer binning, fourier: Fourier cropping")
+    parser.add_argument("--denoise", choices=DENOISE_BACKENDS, default="fast-median", help="Denoise filter for the png (default: fast-median, the same 3x3 median as the slower skimage median)")
+    parser.add_argument("--denoise-threads", type=int, default=1, help="Threads denoising bands of one image (default: 1)")
+    parser.add_argument("--pipeline", action="store_true", help="Overlap reading, processing (-j worker processes) and writing of consecutive files")
+    parser.add_argument("--readers", type=int, default=2, help="Reader threads prefetching files in pipeline mode (default: 2)")
+    parser.add_argument("--writers", type=int, default=1, help="Writer threads in pipeline mode (default: 1)")
+    parser.add_argument("--queue-depth", type=int, default=2, help="Files allowed to wait between two pipeline stages, bounds the memory use (default: 2)")
+    add_batch_arguments(parser)
+
+def main(args):
+    """Run `emd-convert multi` with the options parsed by add_arguments."""
+    emd_dir = Path(args.emd_dir)
+    assert emd_dir.exists() and emd_dir.is_dir()
+    wildcard = args.wildcard
+
+    emd_files = emd_files_from_args(args, emd_dir, wildcard)
+    options = dict(formats=args.formats, downsample_factor=args.downsample_factor, preview_order=args.preview_order, downsample_mode=args.downsample_mode,
+                   denoise=args.denoise, denoise_threads=args.denoise_threads)
+    if args.pipeline:
+        run_pipeline(emd_files, load_emd, encode_formats, write_outputs, readers=args.readers, jobs=args.jobs, writers=args.writers, queue_depth=args.queue_depth,
+                     converter=_converter_name(convert_to_formats), manifest=manifest_from_args(args, emd_dir), report=report_from_args(args, emd_dir), claims=claims_from_args(args, emd_dir), **options)
+    else:
+        run_batch(convert_to_formats, emd_files, jobs=args.jobs, manifest=manifest_from_args(args, emd_dir), report=report_from_args(args, emd_dir), claims=claims_from_args(args, emd_dir),
+                  memory_budget=memory_budget_from_args(args), **options)
@@ -0,0 +1,145 @@
+#%%
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from scipy import ndimage
+from skimage import filters
+
+
+#%%
+# Function definitions:
+DENOISE_BACKENDS = ("median", "fast-median", "gaussian", "mean", "none")
+# Rows of neighbours a backend needs on each side, for processing an image in bands
+DENOISE_HALO = {"median": 1, "fast-median": 1, "gaussian": 4, "mean": 1, "none": 0}
+
+def _median3(a:np.ndarray, b:np.ndarray, c:np.ndarray)->np.ndarray:
+    return np.maximum(np.minimum(a, b), np.minimum(np.maximum(a, b), c))
+
+def median3x3(img_data:np.ndarray)->np.ndarray:
+    """3x3 median filter with the same result as skimage.filters.median (full 3x3 footprint, "nearest" border),
+    built from element-wise min / max: every vertical triple is sorted once, the median of the 3x3 neighbourhood
+    is then the median of the largest low, the median middle and the smallest high value of three neighbouring
+    columns. Stays in the input dtype (no float conversion for uint16 data) and needs about 20 array operations.
+
+    Args:
+        img_data (np.ndarray): 2D image
+
+    Returns:
+        np.ndarray: The filtered image
+    """
+
+    padded = np.pad(img_data, 1, mode="edge")
+    # sort every vertical triple into low <= mid <= high
+    top, center, bottom = padded[:-2], padded[1:-1], padded[2:]
+    low, high = np.minimum(top, center), np.maximum(top, center)
+    mid, high = np.minimum(high, bottom), np.maximum(high, bottom)
+    low, mid = np.minimum(low, mid), np.maximum(low, mid)
+    # combine three neighbouring columns
+    max_low = np.maximum(np.maximum(low[:, :-2], low[:, 1:-1]), low[:, 2:])
+    min_high = np.minimum(np.minimum(high[:, :-2], high[:, 1:-1]), high[:, 2:])
+    med_mid = _median3(mid[:, :-2], mid[:, 1:-1], mid[:, 2:])
+    return _median3(max_low, med_mid, min_high)
+
+def _denoise_2d(img_data:np.ndarray, backend:str)->np.ndarray:
+    if backend == "median":
+        return filters.median(img_data)
+    if backend == "fast-median":
+        return median3x3(img_data)
+    if backend == "gaussian":
+        # separable, one 1D pass per axis
+        return ndimage.gaussian_filter(img_data, sigma=1, truncate=DENOISE_HALO["gaussian"], output=np.float32)
+    if backend == "mean":
+        return ndimage.uniform_filter(img_data, size=3, output=np.float32)
+    if backend == "none":
+        return img_data
+    raise ValueError(f"Unknown denoise backend {backend!r}, choose from {DENOISE_BACKENDS}")
+
+def denoise(img_data:np.ndarray, backend:str="median", threads:int=1)->np.ndarray:
+    """Reduce the noise of an image with one of the DENOISE_BACKENDS.
+
+    Backends:
+        "median": skimage.filters.median with a 3x3 footprint, the reference
+        "fast-median": the same 3x3 median from min / max operations, see median3x3
+        "gaussian": separable gaussian blur with sigma 1 px (float32 result)
+        "mean": 3x3 box average, the averaging of 3x3 binning without reducing the size (float32 result)
+        "none": no denoising
+
+    Args:
+        img_data (np.ndarray): 2D image (stacks are denoised frame by frame, except by the reference median)
+        backend (str, optional): One of DENOISE_BACKENDS. Defaults to "median".
+        threads (int, optional): Number of threads, each filtering a band of rows (with a halo of neighbouring rows,
+            so the result doesn't depend on the number of threads). Defaults to 1.
+
+    Returns:
+        np.ndarray: The denoised image
+    """
+
+    if backend == "none":
+        return img_data
+    if img_data.ndim == 3 and backend != "median":
+        return np.stack([denoise(frame, backend, threads) for frame in img_data])
+    height = img_data.shape[0]
+    if threads <= 1 or img_data.ndim != 2 or height < 64 * threads:
+        return _denoise_2d(img_data, backend)
+
+    halo = DENOISE_HALO[backend]
+    rows = -(-height // threads)
+
+    def denoise_band(start):
+        stop = min(start + rows, height)
+        read_start, read_stop = max(start - halo, 0), min(stop + halo, height)
+        band = _denoise_2d(img_data[read_start:read_stop], backend)
+        return band[start - read_start:start - read_start + stop - start]
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return np.concatenate(list(pool.map(denoise_band, range(0, height, rows))))
+
+def compare_backends(img_data:np.ndarray, threads:int=1, repeats:int=3)->dict:
+    """Time every backend on an image and compare it to the reference median.
+
+    Returns:
+        dict: backend -> {"time": best wall time in s, "max_diff": largest absolute difference to the reference median}
+    """
+
+    reference = filters.median(img_data)
+    results = {}
+    for backend in DENOISE_BACKENDS:
+        best = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            denoised = denoise(img_data, backend, threads)
+            best = min(best, time.perf_counter() - start)
+        max_diff = np.abs(denoised.astype(np.float64) - reference).max()
+        results[backend] = {"time": best, "max_diff": float(max_diff)}
+    return results
+
+
+
+##################################################################################################
+
+def add_arguments(parser):
+    """Add the options of `emd-convert compare-denoise` to its argparse parser."""
+    parser.description = "Time the denoise backends on EMD files (or a synthetic frame) and check them against the skimage median."
+    parser.add_argument("emd_files", nargs="*")
+    parser.add_argument("--size", type=int, default=4096, help="Size of the synthetic frame if no files are given (default: 4096)")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+
+def main(args):
+    """Run `emd-convert compare-denoise` with the options parsed by add_arguments."""
+    if args.emd_files:
+        from .emd_reader import load_emd
+        images = [(Path(emd_file).name, load_emd(emd_file)[0]) for emd_file in args.emd_files]
+    else:
+        from .synthetic_emd import synthetic_frame
+        images = [(f"synthetic {args.size}x{args.size}", synthetic_frame(np.random.default_rng(0), args.size, args.size))]
+
+    equivalent = True
+    for name, img_data in images:
+        print(name)
+        results = compare_backends(img_data, args.threads, args.repeats)
+        for backend, res in results.items():
+            print(f"    {backend:12s} {res['time']:8.3f} s   max difference to median: {res['max_diff']:g}")
+        equivalent = equivalent and results["fast-median"]["max_diff"] == 0
+    print("fast-median is identical to the skimage median" if equivalent else "fast-median DIFFERS from the skimage median")
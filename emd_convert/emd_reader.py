@@ -0,0 +1,228 @@
+#%%
+import json
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+
+#%%
+# Function definitions:
+# Default size of the bands of rows of all frames read at once from stacks (VeloxEMD.iter_row_blocks)
+ROW_BLOCK_BYTES = 256 * 2**20
+
+class UnsupportedLayoutError(Exception):
+    """Raised when an .emd file doesn't have the Velox image layout this reader understands."""
+
+
+class VeloxEMD:
+    """Minimal reader for the HDF5 layout of Velox .emd image files.
+    Only the header and the (small) metadata dataset are read on opening, the image data stays on disk
+    until `data` or `frame()` is accessed.
+
+    Velox layout:
+        /Data/Image/<uuid>/Data       image stack with shape (height, width, frames)
+        /Data/Image/<uuid>/Metadata   uint8 array (length, frames) holding one zero padded json string per frame
+
+    Use as context manager:
+        with VeloxEMD(emd_file) as emd:
+            px_size = emd.pixel_size
+            img = emd.data
+    """
+
+    def __init__(self, emd_file):
+        self.emd_file = Path(emd_file)
+        self._h5 = h5py.File(self.emd_file, "r")
+        try:
+            image_groups = self._h5["Data/Image"]
+            group = image_groups[next(iter(image_groups))]
+            self._dataset = group["Data"]
+            self._metadata_dataset = group["Metadata"]
+        except (KeyError, StopIteration):
+            self.close()
+            raise UnsupportedLayoutError(f"{self.emd_file.name} has no Velox image dataset")
+        if self._dataset.ndim != 3:
+            self.close()
+            raise UnsupportedLayoutError(f"Unexpected image dataset shape {self._dataset.shape} in {self.emd_file.name}")
+        self._metadata = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._h5.close()
+
+    @property
+    def metadata(self)->dict:
+        """The metadata tree of the first frame as (nested) dict. All values are strings, like in Velox."""
+        if self._metadata is None:
+            raw = np.asarray(self._metadata_dataset[:, 0])
+            self._metadata = json.loads(raw[raw > 0].tobytes().decode("utf-8"))
+        return self._metadata
+
+    @property
+    def pixel_size(self):
+        """Pixel size in meter. A (height, width) tuple for anisotropic pixels, like get_pixel_size."""
+        try:
+            px_size = self.metadata["BinaryResult"]["PixelSize"]
+            px_height = float(px_size["height"])
+            px_width = float(px_size["width"])
+        except KeyError:
+            raise UnsupportedLayoutError(f"No BinaryResult.PixelSize in the metadata of {self.emd_file.name}")
+
+        if px_height == px_width:
+            return px_height
+        return (px_height, px_width)
+
+    @property
+    def n_frames(self)->int:
+        return self._dataset.shape[2]
+
+    @property
+    def shape(self)->tuple:
+        """Shape of the image data as returned by `data`: (height, width) or (frames, height, width)"""
+        height, width, n_frames = self._dataset.shape
+        if n_frames == 1:
+            return (height, width)
+        return (n_frames, height, width)
+
+    @property
+    def dtype(self)->np.dtype:
+        return self._dataset.dtype
+
+    def memmap(self):
+        """Memory map the raw (height, width, frames) dataset. Only possible for contiguous, uncompressed datasets,
+        returns None otherwise.
+        """
+        if self._dataset.chunks is not None or self._dataset.compression is not None:
+            return None
+        offset = self._dataset.id.get_offset()
+        if offset is None:
+            return None
+        return np.memmap(self.emd_file, mode="r", dtype=self._dataset.dtype, offset=offset, shape=self._dataset.shape)
+
+    def frame(self, index:int=0)->np.ndarray:
+        """Read a single (height, width) frame."""
+        raw = self.memmap()
+        if raw is None:
+            raw = self._dataset
+        return np.ascontiguousarray(raw[:, :, index])
+
+    def read_rows(self, start:int, stop:int, index:int=0)->np.ndarray:
+        """Read only the rows start:stop of a single frame, for processing large images in bands."""
+        raw = self.memmap()
+        if raw is None:
+            raw = self._dataset
+        return np.ascontiguousarray(raw[start:stop, :, index])
+
+    def read_row_block(self, start:int, stop:int)->np.ndarray:
+        """Read the rows start:stop of all frames at once as (frames, rows, width) array. In the (height, width, frames)
+        layout these rows are one contiguous part of the file, while a single frame is spread over all of it.
+        """
+        raw = self.memmap()
+        if raw is None:
+            raw = self._dataset
+        return np.ascontiguousarray(np.moveaxis(raw[start:stop], 2, 0))
+
+    def iter_row_blocks(self, max_bytes:int=ROW_BLOCK_BYTES, multiple:int=1):
+        """Read all frames in bands of rows (see read_row_block) of about max_bytes each.
+        The number of rows per band is a multiple of `multiple`, e.g. the chunk height of the output.
+
+        Yields:
+            tuple: (first row, last row + 1, (frames, rows, width) block)
+        """
+        height, width, n_frames = self._dataset.shape
+        rows = max(max_bytes // (width * n_frames * self.dtype.itemsize) // multiple, 1) * multiple
+        for start in range(0, height, rows):
+            stop = min(start + rows, height)
+            yield start, stop, self.read_row_block(start, stop)
+
+    def sample(self, step:int, index:int=0)->np.ndarray:
+        """Every step-th pixel of every step-th row of a frame, read without loading the whole frame."""
+        raw = self.memmap()
+        if raw is None:
+            raw = self._dataset
+        return np.ascontiguousarray(raw[::step, ::step, index])
+
+    @property
+    def data(self)->np.ndarray:
+        """The image data in the same orientation hyperspy uses: (height, width) for single frames,
+        (frames, height, width) for stacks.
+        """
+        if self.n_frames == 1:
+            return self.frame(0)
+        # band by band, reading the whole dataset and reordering it would hold two copies of the stack
+        data = np.empty(self.shape, dtype=self.dtype)
+        for start, stop, block in self.iter_row_blocks(ROW_BLOCK_BYTES):
+            data[:, start:stop] = block
+        return data
+
+
+def get_pixel_size(emd_obj)->float:
+    """Convenience function for getting the pixel size form the MASSIVE metadata tree from hyperspys signal objects.
+    Careful: In the metadata tree all values are save as string. Therefore converting to float.
+
+    Args:
+        emd_obj (hyperspy signal datatype): The data loaded form an .emd file via hyperspy
+
+    Returns:
+        float: the px size in meter
+    """
+
+    px_height = float(emd_obj.original_metadata.BinaryResult.PixelSize.height)
+    px_width = float(emd_obj.original_metadata.BinaryResult.PixelSize.width)
+
+    if px_height == px_width:
+        px_size = px_height
+    else:
+        px_size = (px_height, px_width)
+
+
+    return px_size
+
+
+def read_pixel_size(emd_file):
+    """Read only the pixel size (in meter) from an .emd file, without touching the image data.
+
+    Args:
+        emd_file (Path): The path of the emd file
+
+    Returns:
+        float or tuple: the px size in meter
+    """
+
+    try:
+        with VeloxEMD(emd_file) as emd:
+            return emd.pixel_size
+    except UnsupportedLayoutError:
+        return get_pixel_size(_hyperspy_load(emd_file, lazy=True))
+
+
+def load_emd(emd_file):
+    """Load image data and pixel size from an .emd file. Uses the native Velox reader and
+    only falls back to hyperspy for layouts the native reader doesn't understand.
+
+    Args:
+        emd_file (Path): The path of the emd file
+
+    Returns:
+        tuple: (image data as np.ndarray, px size in meter)
+    """
+
+    try:
+        with VeloxEMD(emd_file) as emd:
+            return emd.data, emd.pixel_size
+    except UnsupportedLayoutError as e:
+        print(f"{e}, falling back to hyperspy")
+        emd_obj = _hyperspy_load(emd_file)
+        return emd_obj.data, get_pixel_size(emd_obj)
+
+
+def _hyperspy_load(emd_file, lazy=False):
+    # hyperspy is slow to import, so only do it when it's actually needed
+    import hyperspy.api as hs
+
+    return hs.load(emd_file, lazy=lazy)
@@ -0,0 +1,141 @@
+#%%
+import itertools
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .batch import _converter_name
+from .conversion_cache import describe_outputs
+from .profiling import FileProfile, RunReport
+
+
+#%%
+# Function definitions:
+def _timed_call(func, *args, cpu_clock=time.process_time, **kwargs):
+    """Run one stage and catch its exception. Module level, so it can be sent to worker processes.
+
+    Returns:
+        tuple: (result, error message or None, wall time, cpu time)
+    """
+    wall, cpu = time.perf_counter(), cpu_clock()
+    try:
+        result, error = func(*args, **kwargs), None
+    except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+    return result, error, time.perf_counter() - wall, cpu_clock() - cpu
+
+def run_pipeline(emd_files, read, compute, write, readers:int=2, jobs:int=1, writers:int=1, queue_depth:int=2,
+                 converter:str=None, manifest=None, report=None, claims=None, **kwargs)->list:
+    """Convert emd files in three overlapping stages instead of one file after another:
+
+        read(emd_file) -> item                      in `readers` threads (prefetching from slow shares)
+        compute(emd_file, item, **kwargs) -> out    in `jobs` worker processes (CPU bound, has to be picklable)
+        write(emd_file, out) -> written path(s)     in `writers` threads (blocking file writes)
+
+    Between the stages at most `queue_depth` finished items wait for the next stage, so at most
+    readers + jobs + writers + 3 * queue_depth files are held in memory at any time.
+
+    Args:
+        emd_files (iterable of Path): The emd files to convert
+        read (callable): Read stage
+        compute (callable): Compute stage, a module level function
+        write (callable): Write stage
+        readers (int, optional): Reader threads. Defaults to 2.
+        jobs (int, optional): Compute worker processes. Defaults to 1.
+        writers (int, optional): Writer threads. Defaults to 1.
+        queue_depth (int, optional): Finished items allowed to wait between two stages. Defaults to 2.
+        converter (str, optional): Name of the conversion in the manifest and the claims. Pass the name of the
+            converter run_batch uses for the same outputs, so that both modes skip each other's files. Defaults to the name of compute.
+        manifest (ConversionManifest, optional): Skip up to date files and record finished ones, like in run_batch. Defaults to None.
+        report (RunReport, optional): Collects the timings of the read / compute / write stages. Defaults to a RunReport
+            that only prints the summary table.
+        claims (ClaimQueue, optional): Shared work queue of a distributed run, like in run_batch. Defaults to None.
+        **kwargs: Passed on to compute
+
+    Returns:
+        list: (emd_file, error message) tuples for every failed conversion
+    """
+
+    emd_files = list(emd_files)
+    converter = converter or _converter_name(compute)
+    if manifest is not None:
+        n_found = len(emd_files)
+        emd_files = [emd_file for emd_file in emd_files if not manifest.is_up_to_date(emd_file, converter, kwargs)]
+        print(f"{n_found - len(emd_files)} of {n_found} files are up to date")
+    if report is None:
+        report = RunReport()
+    n_files = len(emd_files)
+    failures = []
+    profiles = {}
+    reads, computes, writes = {}, {}, {}    # future -> emd_file
+    read_done, compute_done = deque(), deque()
+    thread_clock = {"cpu_clock": time.thread_time}
+    counter = itertools.count(1)
+    described = {}  # emd_file -> manifest records of its outputs
+
+    def write_stage(emd_file, out):
+        written = write(emd_file, out)
+        if manifest is not None and written:
+            # hash the outputs in the writer thread, not one after another in the main loop
+            described[emd_file] = describe_outputs(written)
+        return written
+
+    def finished(emd_file, result, error):
+        if claims is not None:
+            claims.release(emd_file, ok=error is None)
+        profile = profiles.pop(emd_file)
+        profile.failure = error
+        record = profile.finish(result)
+        # the main process is mostly idle, the cpu time of the file is the sum of its stages
+        record["cpu"] = sum(stage["cpu"] for stage in record["stages"].values())
+        report.add(record)
+        i = next(counter)
+        if error is None:
+            if manifest is not None and result:
+                manifest.record(emd_file, converter, kwargs, described.pop(emd_file))
+            print(f"[{i}/{n_files}] Done: {emd_file.name}")
+        else:
+            print(f"[{i}/{n_files}] FAILED: {emd_file.name}\n{error}")
+            failures.append((emd_file, error))
+
+    emd_files_left = deque(emd_files)
+    print(f"Converting {n_files} files with {readers} reader(s), {jobs} worker process(es) and {writers} writer(s)")
+    try:
+        with ThreadPoolExecutor(readers) as read_pool, ProcessPoolExecutor(jobs) as compute_pool, ThreadPoolExecutor(writers) as write_pool:
+            while emd_files_left or reads or computes or writes or read_done or compute_done:
+                # start as many stages as the queue depth allows, from the back of the pipeline to the front
+                while compute_done and len(writes) < writers + queue_depth:
+                    emd_file, out = compute_done.popleft()
+                    writes[write_pool.submit(_timed_call, write_stage, emd_file, out, **thread_clock)] = emd_file
+                while read_done and len(computes) + len(compute_done) < jobs + queue_depth:
+                    emd_file, item = read_done.popleft()
+                    computes[compute_pool.submit(_timed_call, compute, emd_file, item, **kwargs)] = emd_file
+                while emd_files_left and len(reads) + len(read_done) < readers + queue_depth:
+                    emd_file = emd_files_left.popleft()
+                    if claims is not None and not claims.claim(emd_file, converter, kwargs):
+                        continue
+                    profiles[emd_file] = FileProfile(emd_file)
+                    reads[read_pool.submit(_timed_call, read, emd_file, **thread_clock)] = emd_file
+
+                done, _ = wait([*reads, *computes, *writes], return_when=FIRST_COMPLETED)
+                for future in done:
+                    for name, running, next_queue in (("read", reads, read_done), ("compute", computes, compute_done), ("write", writes, None)):
+                        if future not in running:
+                            continue
+                        emd_file = running.pop(future)
+                        result, error, wall, cpu = future.result()
+                        profiles[emd_file].add(name, wall, cpu)
+                        if error is not None or next_queue is None:
+                            finished(emd_file, result, error)
+                        else:
+                            next_queue.append((emd_file, result))
+    finally:
+        if claims is not None:
+            claims.close()
+
+    if manifest is not None:
+        manifest.save()
+
+    report.summary()
+
+    return failures
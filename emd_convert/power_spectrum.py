@@ -0,0 +1,152 @@
+#%%
+import csv
+from pathlib import Path
+import numpy as np
+from scipy import fft
+from PIL import Image
+from .emd_reader import VeloxEMD
+from .preview import bin_image, map_to_8bit
+from .contrast import contrast_limits
+from .conversion_cache import atomic_write
+
+
+#%%
+# Function definitions:
+PS_SIZE = 512
+PS_BIN = 2
+MAX_PATCHES = 16
+BATCH_PATCHES = 64
+
+def _px_tuple(px_size)->tuple:
+    return px_size if isinstance(px_size, tuple) else (px_size, px_size)
+
+def patch_grid(shape:tuple, size:int=PS_SIZE, max_patches:int=MAX_PATCHES)->tuple:
+    """Patch size and the central crop (row slice, column slice, rows of patches, columns of patches)
+    for at most max_patches square patches of a (height, width) image. Images smaller than size get
+    one patch of the largest power of two that fits.
+    """
+    height, width = shape
+    size = min(size, 2**int(np.log2(max(min(height, width), 1))))
+    n_rows, n_cols = height // size, width // size
+    side = max(int(np.sqrt(max_patches)), 1)
+    n_rows, n_cols = min(n_rows, side), min(n_cols, max(max_patches // min(n_rows, side), 1))
+    top, left = (height - n_rows * size) // 2, (width - n_cols * size) // 2
+    return size, (slice(top, top + n_rows * size), slice(left, left + n_cols * size), n_rows, n_cols)
+
+def extract_patches(frames:np.ndarray, size:int, crop:tuple)->np.ndarray:
+    """Cut the central crop of a (frames, height, width) stack into (n, size, size) patches."""
+    rows, cols, n_rows, n_cols = crop
+    cropped = frames[:, rows, cols]
+    patches = cropped.reshape(frames.shape[0], n_rows, size, n_cols, size).swapaxes(2, 3)
+    return patches.reshape(-1, size, size)
+
+def batched_power(patches:np.ndarray)->np.ndarray:
+    """Sum of the power spectra of (n, size, size) patches, all transformed in one rfft2 call.
+    Every patch is mean subtracted and multiplied with a 2D Hann window against the cross of the patch edges.
+
+    Returns:
+        np.ndarray: (size, size // 2 + 1) float64 half plane power spectrum
+    """
+    size = patches.shape[-1]
+    window = np.hanning(size).astype(np.float32)
+    patches = patches.astype(np.float32)
+    patches -= patches.mean(axis=(-2, -1), keepdims=True)
+    patches *= window[:, None] * window[None, :]
+    spectrum = fft.rfft2(patches, workers=-1)
+    return (spectrum.real**2 + spectrum.imag**2).sum(axis=0, dtype=np.float64)
+
+def power_spectrum(img_data:np.ndarray, px_size, size:int=PS_SIZE, bin_factor:int=PS_BIN, max_patches:int=MAX_PATCHES):
+    """Averaged power spectrum of an image or stack (Welch's method): the frames are binned, and up to
+    max_patches size x size patches of the central crop of every frame are transformed in batches of
+    BATCH_PATCHES patches per rfft2 call and averaged.
+
+    Args:
+        img_data (np.ndarray): 2D image or (frames, height, width) stack
+        px_size (float): The px size in meter (float or (height, width) tuple)
+        size (int, optional): Patch size in binned px, a power of two. Defaults to 512.
+        bin_factor (int, optional): Bin factor before the transform. Defaults to 2.
+        max_patches (int, optional): Patches per frame. Defaults to 16.
+
+    Returns:
+        tuple: ((size, size // 2 + 1) mean half plane power spectrum, (y, x) px size of the binned image in meter)
+    """
+
+    frames = img_data if img_data.ndim == 3 else img_data[np.newaxis]
+    height, width = frames.shape[-2:]
+    size, crop = patch_grid((height // bin_factor, width // bin_factor), size, max_patches)
+    frames_per_batch = max(BATCH_PATCHES // (crop[2] * crop[3]), 1)
+    total, n_patches = 0, 0
+    for start in range(0, frames.shape[0], frames_per_batch):
+        batch = frames[start:start + frames_per_batch]
+        if bin_factor > 1:
+            batch = bin_image(batch, bin_factor)
+        patches = extract_patches(batch, size, crop)
+        total = total + batched_power(patches)
+        n_patches += patches.shape[0]
+    px_height, px_width = _px_tuple(px_size)
+    return total / n_patches, (px_height * bin_factor, px_width * bin_factor)
+
+def full_spectrum(power:np.ndarray)->np.ndarray:
+    """Complete a half plane power spectrum from rfft2 to the full plane (P(ky, -kx) = P(-ky, kx)) with the zero frequency in the center."""
+    size = power.shape[0]
+    negative = power[(-np.arange(size)) % size, 1:size - power.shape[1] + 1][:, ::-1]
+    return fft.fftshift(np.concatenate([power, negative], axis=1))
+
+def radial_profile(power:np.ndarray, px_size)->tuple:
+    """Rotational average of a half plane power spectrum, in frequency bins of 1 / (size * px size).
+
+    Returns:
+        tuple: (spatial frequencies in 1/nm, mean power)
+    """
+    size = power.shape[0]
+    px_height, px_width = _px_tuple(px_size)
+    frequency = np.hypot(fft.fftfreq(size, d=px_height)[:, None], fft.rfftfreq(size, d=px_width)[None, :])
+    step = 1 / (size * max(px_height, px_width))
+    n_bins = size // 2 + 1
+    indices = np.rint(frequency / step).astype(np.intp)
+    inside = indices < n_bins
+    counts = np.bincount(indices[inside], minlength=n_bins)
+    sums = np.bincount(indices[inside], weights=power[inside], minlength=n_bins)
+    return np.arange(n_bins) * step * 1e-9, sums / np.maximum(counts, 1)
+
+def read_central_crop(emd_file:Path, size:int=PS_SIZE, bin_factor:int=PS_BIN, max_patches:int=MAX_PATCHES)->tuple:
+    """Read only the central rows and columns of the first frame that power_spectrum uses, for images too large to load.
+
+    Returns:
+        tuple: (cropped image, px size in meter)
+    """
+    with VeloxEMD(emd_file) as emd:
+        height, width = emd.shape[-2:]
+        _, (rows, cols, _, _) = patch_grid((height // bin_factor, width // bin_factor), size, max_patches)
+        crop = emd.read_rows(rows.start * bin_factor, rows.stop * bin_factor)
+        return crop[:, cols.start * bin_factor:cols.stop * bin_factor], emd.pixel_size
+
+def write_power_spectrum(img_data:np.ndarray, px_size, save_stem:Path, size:int=PS_SIZE, bin_factor:int=PS_BIN)->list:
+    """Write the log power spectrum of an image as <save_stem>_ps.png and its radial profile as <save_stem>_ps.csv,
+    e.g. for checking drift, astigmatism (elliptic Thon rings) and ice thickness without opening Velox.
+
+    Args:
+        img_data (np.ndarray): 2D image or (frames, height, width) stack
+        px_size (float): The px size in meter (float or (height, width) tuple)
+        save_stem (Path): Path of the outputs without the _ps suffix
+        size (int, optional): Size of the spectrum image in px. Defaults to 512.
+        bin_factor (int, optional): Bin factor before the transform, halves the maximum frequency. Defaults to 2.
+
+    Returns:
+        list: The paths of the written png and csv file
+    """
+
+    power, binned_px_size = power_spectrum(img_data, px_size, size=size, bin_factor=bin_factor)
+    log_power = np.log1p(full_spectrum(power)).astype(np.float32)
+    png_dest = save_stem.with_name(f"{save_stem.name}_ps.png")
+    with atomic_write(png_dest) as tmp_dest:
+        Image.fromarray(map_to_8bit(log_power, in_range=contrast_limits(log_power, (1, 99.9)))).save(tmp_dest, format="PNG")
+
+    frequencies, profile = radial_profile(power, binned_px_size)
+    csv_dest = save_stem.with_name(f"{save_stem.name}_ps.csv")
+    with atomic_write(csv_dest) as tmp_dest, open(tmp_dest, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["frequency_1_per_nm", "resolution_nm", "mean_power"])
+        for frequency, mean_power in zip(frequencies, profile):
+            writer.writerow([f"{frequency:.6g}", f"{1 / frequency:.6g}" if frequency > 0 else "", f"{mean_power:.6g}"])
+    return [png_dest, csv_dest]
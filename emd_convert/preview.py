@@ -0,0 +1,211 @@
+#%%
+import numpy as np
+from scipy import fft
+from skimage import exposure, transform, img_as_ubyte
+from .denoise import denoise
+
+
+#%%
+# Function definitions:
+PREVIEW_ORDERS = ("downsample-first", "legacy")
+DOWNSAMPLE_MODES = ("rescale", "bin", "fourier")
+
+def convert_to_8bit(img_array:np.ndarray)->np.ndarray:
+    """Convert image array to 8 bit for export to png
+
+    Args:
+        img_array (np.ndarray): _description_
+
+    Returns:
+        np.ndarray: _description_
+    """
+
+    return img_as_ubyte(exposure.rescale_intensity(img_array))
+
+def map_to_8bit(img_array:np.ndarray, in_range=None)->np.ndarray:
+    """Linearly map an image to the full uint8 range in a single vectorized pass (in float32).
+    Gives the same result as convert_to_8bit, but without the intermediate float64 copies.
+
+    Args:
+        img_array (np.ndarray): The image data
+        in_range (tuple, optional): (low, high) intensities mapped to 0 and 255. Defaults to the image min and max.
+
+    Returns:
+        np.ndarray: The uint8 image
+    """
+
+    return _map_to_dtype(img_array, np.uint8, in_range)
+
+def map_to_16bit(img_array:np.ndarray, in_range=None)->np.ndarray:
+    """Linearly map an image to the full uint16 range in a single vectorized pass, like map_to_8bit.
+
+    Args:
+        img_array (np.ndarray): The image data
+        in_range (tuple, optional): (low, high) intensities mapped to 0 and 65535. Defaults to the image min and max.
+
+    Returns:
+        np.ndarray: The uint16 image
+    """
+
+    return _map_to_dtype(img_array, np.uint16, in_range)
+
+def _map_to_dtype(img_array:np.ndarray, dtype, in_range=None)->np.ndarray:
+    if in_range is None:
+        low, high = img_array.min(), img_array.max()
+    else:
+        low, high = in_range
+    low, high = float(low), float(high)
+    max_value = np.iinfo(dtype).max
+    scale = max_value / (high - low) if high > low else 0.0
+
+    img_mapped = np.subtract(img_array, low, dtype=np.float32)
+    img_mapped *= scale
+    np.rint(img_mapped, out=img_mapped)
+    np.clip(img_mapped, 0, max_value, out=img_mapped)
+    return img_mapped.astype(dtype)
+
+def bin_factor(downsample_factor:float)->int:
+    """The integer bin factor for a downsample factor like 0.5 or 0.25. Raises ValueError if there is none."""
+    factor = round(1 / downsample_factor)
+    if factor < 1 or abs(1 / downsample_factor - factor) > 1e-6:
+        raise ValueError(f"Binning needs 1/downsample_factor to be an integer, got downsample_factor={downsample_factor}")
+    return factor
+
+def bin_image(img_data:np.ndarray, factor:int)->np.ndarray:
+    """Downsample by averaging factor x factor blocks (no interpolation). Rows and columns that don't fill
+    a complete block at the bottom / right edge are dropped.
+
+    Args:
+        img_data (np.ndarray): Image (..., height, width)
+        factor (int): The bin factor
+
+    Returns:
+        np.ndarray: The binned float32 image (..., height // factor, width // factor)
+    """
+
+    height, width = img_data.shape[-2:]
+    new_height, new_width = height // factor, width // factor
+    img_data = img_data[..., :new_height * factor, :new_width * factor]
+    # sum the rows, then the columns of every block into a float32 accumulator and scale once:
+    # adding strided slices runs close to memory bandwidth, a mean over both block axes at once is several times slower
+    rows = img_data[..., 0::factor, :].astype(np.float32)
+    for i in range(1, factor):
+        rows += img_data[..., i::factor, :]
+    binned = rows[..., 0::factor].copy()
+    for j in range(1, factor):
+        binned += rows[..., j::factor]
+    binned /= factor * factor
+    return binned
+
+def fourier_crop(img_data:np.ndarray, downsample_factor:float)->np.ndarray:
+    """Downsample by cropping the Fourier transform, keeping all frequencies up to the new Nyquist frequency
+    (like the Fourier binning of cryo-EM processing software).
+
+    Args:
+        img_data (np.ndarray): 2D image
+        downsample_factor (float): Scale factor (< 1)
+
+    Returns:
+        np.ndarray: The downsampled float32 image
+    """
+
+    height, width = img_data.shape
+    new_height, new_width = max(1, round(height * downsample_factor)), max(1, round(width * downsample_factor))
+    spectrum = fft.rfft2(img_data.astype(np.float32, copy=False), workers=-1)
+    # low frequencies sit in the first and last rows and in the first columns of the rfft
+    rows = np.r_[0:(new_height + 1) // 2, height - new_height // 2:height]
+    cropped = spectrum[rows, :new_width // 2 + 1]
+    img_data = fft.irfft2(cropped, s=(new_height, new_width), workers=-1)
+    img_data *= (new_height * new_width) / (height * width)
+    return img_data.astype(np.float32, copy=False)
+
+def downsample(img_data:np.ndarray, downsample_factor:float, mode:str="rescale"):
+    """Downsample a 2D image with one of the DOWNSAMPLE_MODES.
+
+    Modes:
+        "rescale": skimage.transform.rescale with gaussian anti-aliasing (any scale factor)
+        "bin": average of integer sized blocks, fastest (1/downsample_factor has to be an integer)
+        "fourier": Fourier cropping, keeps the full frequency content up to the new Nyquist frequency
+
+    Args:
+        img_data (np.ndarray): 2D image
+        downsample_factor (float): Scale factor
+        mode (str, optional): One of DOWNSAMPLE_MODES. Defaults to "rescale".
+
+    Returns:
+        tuple: (downsampled image, (y, x) factor by which the pixel size grew)
+    """
+
+    if downsample_factor == 1:
+        return img_data, (1.0, 1.0)
+
+    if mode == "bin":
+        factor = bin_factor(downsample_factor)
+        # the dropped edge pixels don't change the size of a binned pixel
+        return bin_image(img_data, factor), (float(factor), float(factor))
+    if mode == "fourier":
+        small = fourier_crop(img_data, downsample_factor)
+    elif mode == "rescale":
+        small = transform.rescale(img_data, scale=downsample_factor, anti_aliasing=True)
+    else:
+        raise ValueError(f"Unknown downsample mode {mode!r}, choose from {DOWNSAMPLE_MODES}")
+    # the output shape is rounded, so use the real size ratio instead of 1 / downsample_factor
+    return small, (img_data.shape[0] / small.shape[0], img_data.shape[1] / small.shape[1])
+
+def scale_px_size(px_size, px_scale:tuple):
+    """Apply the (y, x) pixel size factors from downsample to a pixel size (float or (height, width) tuple)."""
+    if isinstance(px_size, tuple):
+        return (px_size[0] * px_scale[0], px_size[1] * px_scale[1])
+    if px_scale[0] == px_scale[1]:
+        return px_size * px_scale[0]
+    return (px_size * px_scale[0], px_size * px_scale[1])
+
+def make_preview(img_data:np.ndarray, px_size, downsample_factor=0.5, order="downsample-first", mode="rescale", in_range=None,
+                 denoise_backend="fast-median", threads=1):
+    """Turn raw image data into a denoised, downsampled 8 bit preview image.
+
+    Orders:
+        "downsample-first": downsample (float32) -> median filter on the small image -> one mapping to uint8.
+            Only a fraction of the pixels go through the median filter and there is just one intensity mapping.
+        "legacy": median filter on the full image -> uint8 -> downsample -> uint8 again.
+            The original pipeline, kept for comparison.
+
+    Args:
+        img_data (np.ndarray): The image data as read from the emd file
+        px_size (float): The px size in meter (float or (height, width) tuple)
+        downsample_factor (float, optional): Scale factor of the preview. Defaults to 0.5.
+        order (str, optional): One of PREVIEW_ORDERS. Defaults to "downsample-first".
+        mode (str, optional): Downsampling method, one of DOWNSAMPLE_MODES. Defaults to "rescale".
+        in_range (tuple, optional): (low, high) intensities mapped to black and white, e.g. from contrast.contrast_limits.
+            Defaults to None (min and max of the preview).
+        denoise_backend (str, optional): One of denoise.DENOISE_BACKENDS. Defaults to "fast-median" (the 3x3 median).
+        threads (int, optional): Threads for denoising. Defaults to 1.
+
+    Returns:
+        tuple: (the uint8 preview image, px size of the preview in meter)
+    """
+
+    if order == "legacy":
+        # reduce noise via median filter:
+        img_data = denoise(img_data, denoise_backend, threads)
+        if in_range is not None:
+            # map with the given limits once and keep them: the 8 bit image is downsampled as float32 (so rescale
+            # doesn't normalize it to [0, 1]) and mapped back with the full 8 bit range instead of its min and max
+            img_data = map_to_8bit(img_data, in_range=in_range).astype(np.float32)
+            img_data, px_scale = downsample(img_data, downsample_factor, mode)
+            return map_to_8bit(img_data, in_range=(0, 255)), scale_px_size(px_size, px_scale)
+        img_data = convert_to_8bit(img_data)
+        # downsample the image:
+        img_data, px_scale = downsample(img_data, downsample_factor, mode)
+        return convert_to_8bit(img_data), scale_px_size(px_size, px_scale)    # This is neccessary to get an 8bit image after conversion
+
+    if order != "downsample-first":
+        raise ValueError(f"Unknown preview order {order!r}, choose from {PREVIEW_ORDERS}")
+
+    if mode == "rescale":
+        # rescale keeps float32, but would promote integer data to float64
+        img_data = img_data.astype(np.float32, copy=False)
+    img_data, px_scale = downsample(img_data, downsample_factor, mode)
+    # reduce noise via median filter:
+    img_data = denoise(img_data, denoise_backend, threads)
+    return map_to_8bit(img_data, in_range=in_range), scale_px_size(px_size, px_scale)
@@ -0,0 +1,255 @@
+#%%
+import html
+import io
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+from .emd_reader import load_emd
+from .convert_emd2png_add_scalebar import write_png
+from .contrast import contrast_limits, DEFAULT_PERCENTILES
+from .denoise import DENOISE_BACKENDS
+
+
+#%%
+# Function definitions:
+DEFAULT_CACHE_SIZE = 512 * 2**20
+SERVER_CONTRAST_MODES = ("minmax", "percentile")   # session limits need the whole session, not one request
+
+def render_png(emd_file:Path, downsample_factor=0.25, contrast="minmax", percentiles=DEFAULT_PERCENTILES, denoise="fast-median")->bytes:
+    """Render the png preview with scalebar of an emd file into memory (runs in the worker processes of the server).
+
+    Args:
+        emd_file (Path): The path of the emd file
+        downsample_factor (float, optional): Scale factor for the png. Defaults to 0.25.
+        contrast (str, optional): "minmax" or "percentile". Defaults to "minmax".
+        percentiles (tuple, optional): (low, high) percentiles for "percentile" contrast. Defaults to (0.1, 99.9).
+        denoise (str, optional): One of denoise.DENOISE_BACKENDS. Defaults to "fast-median".
+
+    Returns:
+        bytes: The encoded png
+    """
+
+    img_data, px_size = load_emd(emd_file)
+    in_range = contrast_limits(img_data, percentiles) if contrast == "percentile" else None
+    buffer = io.BytesIO()
+    write_png(img_data, px_size, buffer, downsample_factor=downsample_factor, in_range=in_range, denoise=denoise)
+    return buffer.getvalue()
+
+
+class PngCache:
+    """Thread safe LRU cache of encoded pngs with a limit on the total size in bytes.
+    Items larger than the whole cache are not stored.
+    """
+
+    def __init__(self, max_bytes:int=DEFAULT_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data:bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.n_bytes -= len(old)
+            self._entries[key] = data
+            self.n_bytes += len(data)
+            while self.n_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.n_bytes -= len(evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PreviewRenderer:
+    """Render previews on demand in a pool of worker processes, with a PngCache in front.
+    The cache key contains the mtime and size of the file, so previews of re-exported files are rendered again.
+    Concurrent requests for the same preview share one rendering.
+    """
+
+    def __init__(self, emd_dir:Path, wildcard="*.emd", jobs=1, cache_size=DEFAULT_CACHE_SIZE):
+        self.emd_dir = Path(emd_dir).resolve()
+        self.wildcard = wildcard
+        self.cache = PngCache(cache_size)
+        self._pool = ProcessPoolExecutor(max_workers=jobs)
+        self._rendering = {}    # cache key -> future
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._pool.shutdown(cancel_futures=True)
+
+    def files(self)->list:
+        return sorted(self.emd_dir.rglob(self.wildcard))
+
+    def resolve(self, relative:str)->Path:
+        """The emd file for a path relative to emd_dir, None for paths outside of it or missing files."""
+        emd_file = (self.emd_dir / relative).resolve()
+        if not emd_file.is_relative_to(self.emd_dir) or not emd_file.is_file() or not emd_file.match(self.wildcard):
+            return None
+        return emd_file
+
+    def render(self, emd_file:Path, **options)->tuple:
+        """The png of an emd file, from the cache or rendered by a worker.
+
+        Returns:
+            tuple: (png bytes, True if it came from the cache)
+        """
+
+        stat = emd_file.stat()
+        key = (str(emd_file), stat.st_mtime_ns, stat.st_size, tuple(sorted(options.items())))
+        data = self.cache.get(key)
+        if data is not None:
+            return data, True
+
+        with self._lock:
+            future = self._rendering.get(key)
+            owner = future is None
+            if owner:
+                future = self._pool.submit(render_png, emd_file, **options)
+                self._rendering[key] = future
+        try:
+            data = future.result()
+        finally:
+            if owner:
+                with self._lock:
+                    self._rendering.pop(key, None)
+        if owner:
+            self.cache.put(key, data)
+        return data, False
+
+
+def parse_options(query:str)->dict:
+    """Rendering options from the query string of a preview url, e.g. "factor=0.5&contrast=percentile&low=1&high=99".
+    Raises ValueError for invalid values.
+    """
+
+    params = {name: values[-1] for name, values in parse_qs(query).items()}
+    downsample_factor = float(params.get("factor", 0.25))
+    if not 0 < downsample_factor <= 1:
+        raise ValueError(f"factor has to be in (0, 1], got {downsample_factor}")
+    contrast = params.get("contrast", "minmax")
+    if contrast not in SERVER_CONTRAST_MODES:
+        raise ValueError(f"contrast has to be one of {', '.join(SERVER_CONTRAST_MODES)}")
+    denoise = params.get("denoise", "fast-median")
+    if denoise not in DENOISE_BACKENDS:
+        raise ValueError(f"denoise has to be one of {', '.join(DENOISE_BACKENDS)}")
+    percentiles = (float(params.get("low", DEFAULT_PERCENTILES[0])), float(params.get("high", DEFAULT_PERCENTILES[1])))
+    options = dict(downsample_factor=downsample_factor, contrast=contrast, denoise=denoise)
+    if contrast == "percentile":
+        # only part of the cache key when they are used
+        options["percentiles"] = percentiles
+    return options
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    """GET /                 html list of the emd files, linking to their previews
+       GET /png/<path>?...   png preview of an emd file, see parse_options for the query parameters
+    """
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        renderer = self.server.renderer
+        if url.path == "/":
+            return self.send_listing(renderer, url.query)
+        if not url.path.startswith("/png/"):
+            return self.send_error(HTTPStatus.NOT_FOUND)
+
+        emd_file = renderer.resolve(unquote(url.path[len("/png/"):]))
+        if emd_file is None:
+            return self.send_error(HTTPStatus.NOT_FOUND)
+        try:
+            options = parse_options(url.query)
+        except ValueError as e:
+            return self.send_error(HTTPStatus.BAD_REQUEST, str(e))
+        start = time.perf_counter()
+        try:
+            data, cached = renderer.render(emd_file, **options)
+        except Exception as e:
+            return self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR, f"Could not render {emd_file.name}: {type(e).__name__}: {e}")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Cache", "hit" if cached else "miss")
+        self.send_header("X-Render-Time", f"{time.perf_counter() - start:.3f}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_listing(self, renderer:PreviewRenderer, query:str):
+        items = []
+        for emd_file in renderer.files():
+            relative = emd_file.relative_to(renderer.emd_dir).as_posix()
+            link = f"/png/{quote(relative)}" + (f"?{query}" if query else "")
+            items.append(f'<li><a href="{html.escape(link)}">{html.escape(relative)}</a></li>')
+        cache = renderer.cache
+        body = (
+            f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>{html.escape(renderer.emd_dir.name)}</title></head><body>"
+            f"<h1>{html.escape(str(renderer.emd_dir))}</h1>"
+            f"<p>{len(items)} files. Cache: {len(cache)} previews, {cache.n_bytes / 2**20:.1f} of {cache.max_bytes / 2**20:.0f} MiB, "
+            f"{cache.hits} hits, {cache.misses} misses. Append e.g. ?factor=0.5&amp;contrast=percentile to this page's url to change the previews.</p>"
+            f"<ul>{''.join(items)}</ul></body></html>"
+        ).encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(emd_dir:Path, wildcard="*.emd", host="127.0.0.1", port=8000, jobs=1, cache_size=DEFAULT_CACHE_SIZE):
+    """Serve png previews of the emd files below emd_dir until interrupted, see PreviewHandler."""
+    renderer = PreviewRenderer(emd_dir, wildcard, jobs=jobs, cache_size=cache_size)
+    server = ThreadingHTTPServer((host, port), PreviewHandler)
+    server.daemon_threads = True
+    server.renderer = renderer
+    print(f"Serving previews of {renderer.emd_dir} on http://{host}:{server.server_port}/ with {jobs} worker process(es)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping preview server")
+    finally:
+        server.server_close()
+        renderer.close()
+
+
+
+##################################################################################################
+
+def add_arguments(parser):
+    """Add the options of `emd-convert serve` to its argparse parser."""
+    parser.description = (
+        "Local HTTP server listing EMD files and rendering png previews with scalebar on demand, "
+        "without writing anything to disk. Rendered previews are kept in an in-memory LRU cache."
+    )
+    parser.add_argument("emd_dir")
+    parser.add_argument("wildcard", nargs="?", default="*.emd")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1, use 0.0.0.0 for the lab network)")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes rendering previews (default: 1)")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_CACHE_SIZE / 2**20, help="Size limit of the preview cache in MiB (default: 512)")
+
+def main(args):
+    """Run `emd-convert serve` with the options parsed by add_arguments."""
+    emd_dir = Path(args.emd_dir)
+    assert emd_dir.exists() and emd_dir.is_dir()
+
+    serve(emd_dir, args.wildcard, host=args.host, port=args.port, jobs=args.jobs, cache_size=int(args.cache_size * 2**20))
@@ -0,0 +1,141 @@
+#%%
+import json
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from .conversion_cache import output_size
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+#%%
+# Function definitions:
+_current = None
+
+def peak_rss_mb()->float:
+    """Peak resident memory of this (worker) process over its lifetime in MiB, None where it isn't available (Windows)."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 1024
+
+class FileProfile:
+    """Wall and CPU time per stage, bytes read / written, peak RSS and the failure reason of one conversion.
+    Only two clock reads per stage, cheap enough to always stay on.
+    """
+
+    def __init__(self, emd_file:Path):
+        self.emd_file = Path(emd_file)
+        self.stages = {}
+        self.failure = None
+        self.bytes_written = 0
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def add(self, name:str, wall:float, cpu:float):
+        stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0})
+        stage["wall"] += wall
+        stage["cpu"] += cpu
+
+    def finish(self, outputs=None)->dict:
+        """Close the profile and return it as json serializable record."""
+        if isinstance(outputs, (str, Path)):
+            outputs = [outputs]
+        for output in outputs or []:
+            if output is not None and Path(output).exists():
+                self.bytes_written += output_size(output)
+        return {
+            "file": str(self.emd_file),
+            "ok": self.failure is None,
+            "failure": self.failure,
+            "wall": time.perf_counter() - self._start,
+            "end": time.time(),
+            "cpu": time.process_time() - self._cpu_start,
+            "stages": self.stages,
+            "bytes_read": self.emd_file.stat().st_size if self.emd_file.exists() else 0,
+            "bytes_written": self.bytes_written,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+@contextmanager
+def profile_file(emd_file:Path):
+    """Make a new FileProfile the current one for the duration of a conversion."""
+    global _current
+    previous, _current = _current, FileProfile(emd_file)
+    try:
+        yield _current
+    finally:
+        _current = previous
+
+@contextmanager
+def stage(name:str):
+    """Time a processing stage of the current conversion. Does nothing outside of profile_file."""
+    if _current is None:
+        yield
+        return
+    profile = _current
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+def record_failure(reason:str):
+    """Remember why the current conversion failed (for converters that report errors by returning None)."""
+    print(reason)
+    if _current is not None:
+        _current.failure = reason
+
+
+class RunReport:
+    """Collects the FileProfile records of a batch run, appends them to a JSON Lines file
+    and prints a summary table at the end.
+    """
+
+    def __init__(self, report_path:Path=None):
+        self.report_path = Path(report_path) if report_path is not None else None
+        self.records = []
+        self._start = time.perf_counter()
+
+    def add(self, record:dict):
+        self.records.append(record)
+        if self.report_path is not None:
+            with open(self.report_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def summary(self, wall:float=None):
+        """Print totals per stage, throughput and the failures of the run.
+        wall is the duration of the run, by default the time since the report was created."""
+        if not self.records:
+            return
+        n_ok = sum(record["ok"] for record in self.records)
+        stage_totals = {}
+        for record in self.records:
+            for name, times in record["stages"].items():
+                total = stage_totals.setdefault(name, {"wall": 0.0, "cpu": 0.0, "n": 0})
+                total["wall"] += times["wall"]
+                total["cpu"] += times["cpu"]
+                total["n"] += 1
+        wall = wall or time.perf_counter() - self._start
+        converter_wall = sum(record["wall"] for record in self.records)
+
+        print(f"\n{'stage':16s} {'files':>6s} {'wall [s]':>10s} {'cpu [s]':>10s} {'mean [s]':>9s} {'share':>6s}")
+        for name, total in sorted(stage_totals.items(), key=lambda item: -item[1]["wall"]):
+            share = total["wall"] / converter_wall if converter_wall else 0
+            print(f"{name:16s} {total['n']:6d} {total['wall']:10.2f} {total['cpu']:10.2f} {total['wall'] / total['n']:9.3f} {share:6.1%}")
+        mb_read = sum(record["bytes_read"] for record in self.records) / 2**20
+        mb_written = sum(record["bytes_written"] for record in self.records) / 2**20
+        peaks = [record["peak_rss_mb"] for record in self.records if record.get("peak_rss_mb") is not None]
+        peak_rss = f", peak RSS {max(peaks):.0f} MiB" if peaks else ""
+        print(f"{n_ok}/{len(self.records)} files ok in {wall:.1f} s, read {mb_read:.0f} MiB ({mb_read / wall:.1f} MiB/s), "
+              f"wrote {mb_written:.0f} MiB{peak_rss}")
+        for record in self.records:
+            if not record["ok"]:
+                print(f"    failed: {record['file']}: {record['failure'].splitlines()[0]}")
+        if self.report_path is not None:
+            print(f"Report written to {self.report_path}")
@@ -0,0 +1,208 @@
+#%%
+import math
+import os
+import shutil
+import tempfile
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from .emd_reader import VeloxEMD
+from .preview import bin_image, map_to_8bit, scale_px_size
+from .tiled import tiled_preview, scalebar_band_start, draw_scalebar_band, DEFAULT_MAX_MEMORY
+from .conversion_cache import atomic_write
+
+
+#%%
+# Function definitions:
+PYRAMID_FORMATS = ("dzi", "tiff")
+TILE_FORMATS = {
+    "png": {"format": "PNG"},
+    "webp": {"format": "WEBP", "quality": 90},
+}
+# Levels narrower than this get no scalebar, the label would be unreadable
+SCALEBAR_MIN_WIDTH = 256
+DZI_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{tile_format}" Overlap="{overlap}" TileSize="{tile_size}">
+  <Size Width="{width}" Height="{height}"/>
+</Image>
+"""
+
+def halve(level:np.ndarray, band_rows:int=2048)->np.ndarray:
+    """Average 2x2 blocks of a uint8 image, band by band so that memory mapped levels stay on disk.
+    Odd sizes are padded by repeating the last row / column, so the result has ceil(size / 2) pixels
+    like the levels of a Deep Zoom image.
+
+    Args:
+        level (np.ndarray): uint8 image (can be a memmap)
+        band_rows (int, optional): Rows processed at once. Defaults to 2048.
+
+    Returns:
+        np.ndarray: The uint8 image of half the size
+    """
+
+    height, width = level.shape
+    halved = np.empty(((height + 1) // 2, (width + 1) // 2), dtype=np.uint8)
+    band_rows -= band_rows % 2
+    for start in range(0, height, band_rows):
+        band = np.asarray(level[start:start + band_rows])
+        if band.shape[0] % 2 or width % 2:
+            band = np.pad(band, ((0, band.shape[0] % 2), (0, width % 2)), mode="edge")
+        halved[start // 2:(start + band.shape[0]) // 2] = np.rint(bin_image(band, 2))
+    return halved
+
+def n_levels(height:int, width:int)->int:
+    """Number of Deep Zoom levels of an image, from 1x1 up to the full size."""
+    return math.ceil(math.log2(max(height, width, 1))) + 1
+
+def pyramid_levels(base:np.ndarray, px_size, min_size:int=1, add_scalebar=None):
+    """Yield the levels of an image pyramid from the full size base image down to the first level whose
+    longer side is at most min_size. Every level is computed from the previous one before the scalebar is
+    drawn onto it, so each level gets its own scalebar with a length and label matching its pixel size.
+    The scalebar is drawn into base in place.
+
+    Args:
+        base (np.ndarray): uint8 image (can be a writable memmap)
+        px_size (float): The px size of base in meter (float or (height, width) tuple)
+        min_size (int, optional): Size of the smallest level. Defaults to 1 (Deep Zoom goes down to 1x1).
+        add_scalebar (callable, optional): add_scalebar from scalebar.py. Defaults to None (no scalebar).
+
+    Yields:
+        tuple: (level image, px size of the level)
+    """
+
+    base_height, base_width = base.shape
+    level = base
+    while True:
+        height, width = level.shape
+        next_level = halve(level) if max(height, width) > min_size else None
+        level_px_size = scale_px_size(px_size, (base_height / height, base_width / width))
+        if add_scalebar is not None and width >= SCALEBAR_MIN_WIDTH:
+            start = scalebar_band_start(height)
+            level[start:] = draw_scalebar_band(np.array(level[start:]), (height, width), level_px_size, start, add_scalebar)
+        yield level, level_px_size
+        if next_level is None:
+            return
+        level = next_level
+
+def deepzoom_tiles_dir(save_dest:Path)->Path:
+    """The tile directory <stem>_files next to the .dzi file save_dest."""
+    return save_dest.with_name(f"{save_dest.stem}_files")
+
+def pyramid_outputs(save_dest:Path)->list:
+    """All paths written for the pyramid save_dest (.dzi descriptor and tile directory, or the tiff)."""
+    if save_dest.suffix == ".dzi":
+        return [save_dest, deepzoom_tiles_dir(save_dest)]
+    return [save_dest]
+
+def write_deepzoom(base:np.ndarray, px_size, save_dest:Path, tile_size:int=254, overlap:int=1, tile_format="png", add_scalebar=None)->Path:
+    """Write a Deep Zoom image (as read by OpenSeadragon and most web slide viewers): the .dzi descriptor
+    save_dest and the tiles of every level in <stem>_files/<level>/<column>_<row>.<tile_format>.
+    The tiles are written to a temporary directory that replaces an existing tile directory when all levels are done.
+
+    Args:
+        base (np.ndarray): uint8 image of the full resolution level, the scalebar is drawn into it in place
+        px_size (float): The px size of base in meter
+        save_dest (Path): Path of the .dzi file to write
+        tile_size (int, optional): Tile size without overlap. Defaults to 254.
+        overlap (int, optional): Pixels every tile shares with its neighbours. Defaults to 1.
+        tile_format (str, optional): One of TILE_FORMATS. Defaults to "png".
+        add_scalebar (callable, optional): add_scalebar from scalebar.py. Defaults to None (no scalebar).
+
+    Returns:
+        Path: The path of the written .dzi file.
+    """
+
+    height, width = base.shape
+    top_level = n_levels(height, width) - 1
+    tiles_dir = deepzoom_tiles_dir(save_dest)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f".{save_dest.stem}_files.", dir=save_dest.parent))
+    print(f"Writing Deep Zoom pyramid with {top_level + 1} levels ({tile_format} tiles) to {save_dest.name}")
+    try:
+        for i, (level, _) in enumerate(pyramid_levels(base, px_size, add_scalebar=add_scalebar)):
+            level_dir = tmp_dir / str(top_level - i)
+            level_dir.mkdir()
+            level_height, level_width = level.shape
+            for row, y in enumerate(range(0, level_height, tile_size)):
+                band = np.asarray(level[max(y - overlap, 0):min(y + tile_size + overlap, level_height)])
+                for col, x in enumerate(range(0, level_width, tile_size)):
+                    tile = band[:, max(x - overlap, 0):min(x + tile_size + overlap, level_width)]
+                    Image.fromarray(tile).save(level_dir / f"{col}_{row}.{tile_format}", **TILE_FORMATS[tile_format])
+        if tiles_dir.exists():
+            shutil.rmtree(tiles_dir)
+        os.replace(tmp_dir, tiles_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    with atomic_write(save_dest) as tmp_dest:
+        tmp_dest.write_text(DZI_TEMPLATE.format(tile_format=tile_format, overlap=overlap, tile_size=tile_size, width=width, height=height))
+
+    return save_dest
+
+def write_pyramid_tiff(base:np.ndarray, px_size, save_dest:Path, tile=(256, 256), add_scalebar=None)->Path:
+    """Write a pyramidal tiled tiff: the full resolution level with the downsampled levels as SubIFDs,
+    down to the first level that fits into a single tile.
+
+    Args:
+        base (np.ndarray): uint8 image of the full resolution level, the scalebar is drawn into it in place
+        px_size (float): The px size of base in meter
+        save_dest (Path): Path of the tiff file to write
+        tile (tuple, optional): (height, width) of the tiff tiles. Defaults to (256, 256).
+        add_scalebar (callable, optional): add_scalebar from scalebar.py. Defaults to None (no scalebar).
+
+    Returns:
+        Path: The path of the written tiff file.
+    """
+
+    import tifffile
+
+    height, width = base.shape
+    n_sub, level_height, level_width = 0, height, width
+    while max(level_height, level_width) > max(tile):
+        level_height, level_width = (level_height + 1) // 2, (level_width + 1) // 2
+        n_sub += 1
+
+    print(f"Writing pyramidal tiff with {n_sub + 1} levels to {save_dest.name}")
+    with atomic_write(save_dest) as tmp_dest:
+        with tifffile.TiffWriter(tmp_dest, bigtiff=height * width > 2**31) as tif:
+            for i, (level, _) in enumerate(pyramid_levels(base, px_size, min_size=max(tile), add_scalebar=add_scalebar)):
+                if i == 0:
+                    tif.write(level, tile=tile, subifds=n_sub)
+                else:
+                    # subfiletype 1: reduced resolution version of the main image
+                    tif.write(level, tile=tile, subfiletype=1)
+
+    return save_dest
+
+def write_pyramid(base:np.ndarray, px_size, save_dest:Path, tile_format="png", add_scalebar=None)->Path:
+    """Write a Deep Zoom image or a pyramidal tiff, depending on the suffix of save_dest (.dzi or .tiff)."""
+    if save_dest.suffix == ".dzi":
+        return write_deepzoom(base, px_size, save_dest, tile_format=tile_format, add_scalebar=add_scalebar)
+    return write_pyramid_tiff(base, px_size, save_dest, add_scalebar=add_scalebar)
+
+def write_pyramid_tiled(emd_file:Path, save_dest:Path, max_memory=DEFAULT_MAX_MEMORY, tile_format="png", add_scalebar=None)->Path:
+    """Bounded memory version of write_pyramid for atlas / montage sized images: the full resolution level
+    is median filtered band by band (see tiled.tiled_preview) and mapped to uint8 in a temporary memmap,
+    the smaller levels are computed from it band by band.
+
+    Args:
+        emd_file (Path): The path of the emd file
+        save_dest (Path): Path of the .dzi or .tiff file to write
+        max_memory (int, optional): Memory budget in bytes for the bands. Defaults to 512 MiB.
+        tile_format (str, optional): Tile format of Deep Zoom images, one of TILE_FORMATS. Defaults to "png".
+        add_scalebar (callable, optional): add_scalebar from scalebar.py. Defaults to None (no scalebar).
+
+    Returns:
+        Path: The path of the written .dzi or .tiff file.
+    """
+
+    with VeloxEMD(emd_file) as emd, tempfile.TemporaryFile(dir=save_dest.parent) as tmp, \
+            tempfile.TemporaryFile(dir=save_dest.parent) as tmp_8bit:
+        processed, in_range, px_size, rows = tiled_preview(emd, tmp, 1, max_memory)
+        base = np.memmap(tmp_8bit, dtype=np.uint8, mode="w+", shape=processed.shape)
+        for start in range(0, base.shape[0], rows):
+            base[start:start + rows] = map_to_8bit(processed[start:start + rows], in_range=in_range)
+        del processed
+        write_pyramid(base, px_size, save_dest, tile_format=tile_format, add_scalebar=add_scalebar)
+        del base
+
+    return save_dest
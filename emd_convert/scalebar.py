@@ -0,0 +1,113 @@
+#%%
+import io
+from functools import lru_cache
+from importlib import resources
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+
+#%%
+# Function definitions:
+FONT_RESOURCE = resources.files(__package__) / "arial.ttf"
+# A list of allowed lengths for the scalebar (in whatever value unit has)
+SCALEBAR_LENGTHS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+UNITS = np.array(["m", "mm", "µm", "nm", "pm"])
+SCALES = np.array([1e0, 1e-3, 1e-6, 1e-9, 1e-12])
+
+def converted_px_size_and_unit(px_size_meter, img_data):
+    """Convert pixel size in meter to meter, mm, µm, nm, or, pm and also return the corresponding length unit.
+
+    Args:
+        px_size_meter (float): The px size in meter
+        img_data (np.ndarray): The image (only the shape is used)
+
+    Returns:
+        tuple: (px size in the returned unit, unit)
+    """
+
+    im_size_x = img_data.shape[1]
+    fov_x = im_size_x * px_size_meter
+
+    frac = fov_x / SCALES
+
+    greater_one = frac >= 1
+    smaller_1000 = frac < 1e3
+
+    scale_indicator = np.logical_and(greater_one, smaller_1000)
+    assert scale_indicator.any()
+
+    unit = UNITS[scale_indicator][0]
+
+    scale = SCALES[scale_indicator][0]
+
+    px_size_val = px_size_meter / scale
+
+    return px_size_val, unit
+
+@lru_cache(maxsize=None)
+def get_font(fontsize:int):
+    """Load the bundled arial.ttf once per font size (falls back to Helvetica and PILs default font).
+    Read as package resource, so the font is also found when the package is installed as zip or wheel.
+    """
+    try:
+        return ImageFont.truetype(io.BytesIO(FONT_RESOURCE.read_bytes()), fontsize)
+    except OSError:
+        try:
+            return ImageFont.truetype("Helvetica.ttc", fontsize)
+        except OSError:
+            return ImageFont.load_default()
+
+@lru_cache(maxsize=256)
+def scalebar_stamp(text:str, fontsize:int, outline_width:int, sb_len_px:int, sb_width:int):
+    """Pre-render the scalebar (white bar with black outline) and its label (white text with black outline
+    via stroke_width) into one grayscale stamp with alpha mask. Cached, so a batch of images with the same size
+    and px size renders it only once.
+
+    Returns:
+        tuple: (grayscale stamp, alpha mask), both PIL images. The bar starts at (outline_width, 0) of the stamp.
+    """
+
+    font = get_font(fontsize)
+    left, top, right, bottom = font.getbbox(text, stroke_width=outline_width)
+    stamp_width = outline_width + max(sb_len_px + 1, right) + outline_width
+    stamp_height = sb_width + bottom + outline_width
+    stamp = Image.new("RGBA", (stamp_width, stamp_height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(stamp)
+    draw.rectangle((outline_width, 0, outline_width + sb_len_px, sb_width), fill="white", outline="black", width=outline_width)
+    draw.text((outline_width, sb_width), text, font=font, fill="white", stroke_width=outline_width, stroke_fill="black")
+    return stamp.convert("L"), stamp.getchannel("A")
+
+def add_scalebar(im, img_data:np.ndarray, px_size_meter:float, y_offset:int=0, fontsize_fraction:float=1/30):
+    """
+    Add scalebar manually without using matplotlib artists
+
+    The bar and its label are pasted in one go from a cached stamp, see scalebar_stamp.
+    Only the shape of img_data is used. For images written in row bands (tiled mode), im can be just the
+    bottom band of the image starting at row y_offset.
+
+    Args:
+        im (PIL.Image): The image to draw on
+        img_data (np.ndarray): The image data (only the shape is used)
+        px_size_meter (float): The px size in meter
+        y_offset (int, optional): First row of the full image contained in im. Defaults to 0.
+        fontsize_fraction (float, optional): Font size relative to the image width. Defaults to 1/30.
+    """
+
+    im_size_y, im_size_x = img_data.shape[:2]
+
+    # convert px size from meter to e.g. nm:
+    px_size_conv, unit = converted_px_size_and_unit(px_size_meter, img_data)
+    fov_x = im_size_x * px_size_conv
+
+    # Find a good integer length for the scalebar
+    sb_len_float = fov_x / 6 #Scalebar length is about 1/6 of FOV
+    # Find the closest value in the list
+    sb_len = min(SCALEBAR_LENGTHS, key=lambda a: abs(a - sb_len_float))
+    sb_len_px = round(sb_len / px_size_conv)
+    sb_start_x, sb_start_y = (round(im_size_x / 24), round(im_size_y *11 / 12)) #Bottom left corner from 1/12 of FOV
+    sb_width = round(im_size_y / 100)
+    outline_width = max(round(im_size_y/500), 1)
+    fontsize = int(im_size_x * fontsize_fraction)
+
+    stamp, mask = scalebar_stamp(f"{sb_len} {unit}", fontsize, outline_width, sb_len_px, sb_width)
+    im.paste(stamp, (sb_start_x - outline_width, sb_start_y - y_offset), mask)
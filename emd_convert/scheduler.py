@@ -0,0 +1,95 @@
+#%%
+from pathlib import Path
+import numpy as np
+from .emd_reader import VeloxEMD, UnsupportedLayoutError, ROW_BLOCK_BYTES
+from .tiled import full_frame_bytes, DEFAULT_MAX_MEMORY
+
+
+#%%
+# Function definitions:
+# Bytes per pixel of one full resolution frame that the png preview allocates on top of the raw data
+PREVIEW_BYTES_PER_PX = {
+    ("downsample-first", "rescale"): 20,    # float32 copy, float64 input and output of the anti-aliasing filter
+    ("downsample-first", "bin"): 4,         # float32 copy, the binned image is small
+    ("downsample-first", "fourier"): 12,    # float32 copy and complex64 half spectrum
+    ("legacy", "rescale"): 34,              # median output, float64 intensity rescaling, uint8, float64 rescale
+    ("legacy", "bin"): 14,
+    ("legacy", "fourier"): 22,
+}
+# Interpreter, numpy, skimage, ... of a worker process
+PROCESS_OVERHEAD = 150 * 2**20
+
+def header_shape(emd_file:Path)->tuple:
+    """(frames, height, width) and dtype of an emd file from the HDF5 header, without reading the image data.
+    Layouts the native reader doesn't understand are guessed from the file size as a single uint16 frame.
+    """
+    try:
+        with VeloxEMD(emd_file) as emd:
+            return (emd.n_frames, *emd.shape[-2:]), emd.dtype
+    except UnsupportedLayoutError:
+        n_px = Path(emd_file).stat().st_size // 2
+        return (1, n_px, 1), np.dtype(np.uint16)
+
+def working_set(shape:tuple, dtype, preview_order="downsample-first", downsample_mode="rescale", formats=("png",),
+                tiled=False, max_memory=None, **_)->int:
+    """Estimate the peak memory of converting one file, from its (frames, height, width) shape and dtype
+    and the converter options (other options are ignored).
+
+    The whole stack is loaded (stacks band by band, which holds one band of ROW_BLOCK_BYTES twice),
+    the png preview adds the copies of one full resolution frame listed in PREVIEW_BYTES_PER_PX. Files that are converted tiled (tiled option, or larger than max_memory) need
+    about max_memory instead.
+
+    Returns:
+        int: Estimated peak working set in bytes
+    """
+
+    frames, height, width = shape
+    if tiled or (max_memory is not None and full_frame_bytes((height, width), dtype) > max_memory):
+        return (max_memory or DEFAULT_MAX_MEMORY) + PROCESS_OVERHEAD
+    n_bytes = frames * height * width * np.dtype(dtype).itemsize
+    if frames > 1:
+        n_bytes += min(n_bytes, ROW_BLOCK_BYTES)
+    if "png" in formats:
+        n_bytes += height * width * PREVIEW_BYTES_PER_PX[(preview_order, downsample_mode)]
+    return n_bytes + PROCESS_OVERHEAD
+
+def estimate_working_set(emd_file:Path, converter:str="", **kwargs)->int:
+    """working_set of an emd file for a converter (name as in the manifest) and its keyword arguments kwargs."""
+    if "formats" not in kwargs:
+        # the single format converters only compute a preview for png, thumbnails and pyramids
+        kwargs["formats"] = ("png",) if any(name in converter for name in ("png", "thumbnail", "pyramid")) else ()
+    shape, dtype = header_shape(emd_file)
+    return working_set(shape, dtype, **kwargs)
+
+
+class MemoryBudget:
+    """Admission control for parallel conversions: a file is only started if the estimated working sets
+    of all running conversions plus its own fit into the budget. A file that doesn't fit even on its own
+    is started once nothing else runs, so it is converted alone instead of not at all.
+
+    Usage:
+        budget = MemoryBudget(16 * 2**30, lambda emd_file: estimate_working_set(emd_file, converter, **kwargs))
+        if budget.admit(emd_file):
+            ...
+        budget.release(emd_file)
+    """
+
+    def __init__(self, budget:int, estimate=estimate_working_set):
+        self.budget = budget
+        self.estimate = estimate
+        self.in_use = 0
+        self._estimates = {}    # emd_file -> bytes, for admitted and waiting files
+
+    def admit(self, emd_file:Path)->bool:
+        if emd_file not in self._estimates:
+            self._estimates[emd_file] = self.estimate(emd_file)
+        n_bytes = self._estimates[emd_file]
+        if self.in_use > 0 and self.in_use + n_bytes > self.budget:
+            return False
+        if n_bytes > self.budget:
+            print(f"{emd_file.name} needs about {n_bytes / 2**20:.0f} MiB, more than the budget of {self.budget / 2**20:.0f} MiB, converting it alone")
+        self.in_use += n_bytes
+        return True
+
+    def release(self, emd_file:Path):
+        self.in_use -= self._estimates.pop(emd_file)
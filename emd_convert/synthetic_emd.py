@@ -0,0 +1,111 @@
+#%%
+import json
+import uuid
+from pathlib import Path
+import h5py
+import numpy as np
+
+
+#%%
+# Function definitions:
+SIZES = {"1k": 1024, "4k": 4096, "16k": 16384}
+
+def velox_metadata(px_size=(1e-9, 1e-9), magnification=92000, acquisition_time=1665999360, detector="BM-Ceta")->dict:
+    """A minimal Velox metadata tree with the entries the converters and the catalogue read.
+    Like in real files, all values are strings.
+    """
+
+    return {
+        "BinaryResult": {
+            "PixelSize": {"height": str(px_size[0]), "width": str(px_size[1])},
+            "PixelUnitX": "m",
+            "PixelUnitY": "m",
+            "Detector": detector,
+        },
+        "Optics": {"NominalMagnification": str(magnification)},
+        "Acquisition": {"AcquisitionStartDatetime": {"DateTime": str(acquisition_time)}},
+        "Core": {"MetadataDefinitionVersion": "7.9", "MetadataSchemaVersion": "v1/2013/07"},
+    }
+
+def synthetic_frame(rng:np.random.Generator, height:int, width:int, dtype="uint16", row_offset=0)->np.ndarray:
+    """Noisy micrograph-like test image: smooth background, some dark particles, Poisson noise and a few hot pixels."""
+
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    background = 2000 + 300 * np.sin(x / 500) * np.cos((y + row_offset) / 700)
+    particles = np.zeros_like(background)
+    for cy, cx in rng.uniform(0, 1, size=(20, 2)) * (height, width):
+        particles -= 800 * np.exp(-((y - cy)**2 + (x - cx)**2) / (2 * 30**2))
+    img = rng.poisson(np.clip(background + particles, 0, None)).astype(np.float32)
+    hot = rng.integers(0, height * width, size=max(height * width // 1_000_000, 1))
+    img.flat[hot] = 60000
+    return img.astype(dtype)
+
+def write_velox_emd(save_dest:Path, height:int, width:int, n_frames:int=1, dtype="uint16", px_size=(1e-9, 1e-9),
+                    band_rows:int=1024, seed:int=0, **metadata_kwargs)->Path:
+    """Write a synthetic .emd file with the Velox HDF5 layout:
+    /Data/Image/<uuid>/Data (height, width, frames) and /Data/Image/<uuid>/Metadata (json as uint8, frames).
+    The data is generated and written in bands of rows, so even 16k frames need little memory.
+
+    Args:
+        save_dest (Path): Path of the .emd file to write
+        height (int): Image height
+        width (int): Image width
+        n_frames (int, optional): Number of frames (> 1 for stacks). Defaults to 1.
+        dtype (str, optional): Data type of the image dataset. Defaults to "uint16".
+        px_size (tuple, optional): (height, width) px size in meter. Defaults to (1e-9, 1e-9).
+        band_rows (int, optional): Rows generated at once. Defaults to 1024.
+        seed (int, optional): Random seed. Defaults to 0.
+        **metadata_kwargs: Passed on to velox_metadata
+
+    Returns:
+        Path: save_dest
+    """
+
+    rng = np.random.default_rng(seed)
+    metadata = np.frombuffer(json.dumps(velox_metadata(px_size, **metadata_kwargs)).encode("utf-8"), dtype=np.uint8)
+    with h5py.File(save_dest, "w") as f:
+        f.create_group("Version").attrs["version"] = json.dumps({"format": "Velox", "version": 2})
+        group = f.create_group(f"Data/Image/{uuid.uuid4().hex}")
+        dataset = group.create_dataset("Data", shape=(height, width, n_frames), dtype=dtype)
+        for i_frame in range(n_frames):
+            for start in range(0, height, band_rows):
+                stop = min(start + band_rows, height)
+                dataset[start:stop, :, i_frame] = synthetic_frame(rng, stop - start, width, dtype, row_offset=start)
+        # padded like in real files
+        group.create_dataset("Metadata", data=np.tile(np.pad(metadata, (0, 64))[:, None], (1, n_frames)))
+    return save_dest
+
+def make_fixture_set(fixture_dir:Path, sizes=("1k", "4k"), stack_frames:int=8)->list:
+    """Create single frame fixtures for the given sizes and one stack of the smallest size (reusing existing files)."""
+
+    fixture_dir = Path(fixture_dir)
+    fixture_dir.mkdir(parents=True, exist_ok=True)
+    fixtures = []
+    for size in sizes:
+        emd_file = fixture_dir / f"synthetic_{size}.emd"
+        if not emd_file.exists():
+            print(f"Writing {emd_file}")
+            write_velox_emd(emd_file, SIZES[size], SIZES[size])
+        fixtures.append(emd_file)
+    if stack_frames > 1:
+        emd_file = fixture_dir / f"synthetic_{sizes[0]}_stack{stack_frames}.emd"
+        if not emd_file.exists():
+            print(f"Writing {emd_file}")
+            write_velox_emd(emd_file, SIZES[sizes[0]], SIZES[sizes[0]], n_frames=stack_frames)
+        fixtures.append(emd_file)
+    return fixtures
+
+
+
+##################################################################################################
+
+def add_arguments(parser):
+    """Add the options of `emd-convert fixtures` to its argparse parser."""
+    parser.description = "Generate synthetic Velox EMD files for benchmarks and tests (no microscope data needed)."
+    parser.add_argument("fixture_dir")
+    parser.add_argument("--sizes", nargs="+", choices=SIZES, default=["1k", "4k"])
+    parser.add_argument("--stack-frames", type=int, default=8, help="Frames of the additional stack fixture (default: 8, 0 for none)")
+
+def main(args):
+    """Run `emd-convert fixtures` with the options parsed by add_arguments."""
+    make_fixture_set(Path(args.fixture_dir), args.sizes, args.stack_frames)
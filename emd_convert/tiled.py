@@ -0,0 +1,215 @@
+#%%
+import struct
+import tempfile
+import zlib
+from pathlib import Path
+import numpy as np
+from .emd_reader import VeloxEMD, UnsupportedLayoutError
+from .denoise import denoise, DENOISE_HALO
+from .preview import bin_factor, bin_image, map_to_8bit, map_to_16bit, scale_px_size
+from .conversion_cache import atomic_write
+
+
+#%%
+# Function definitions:
+DEFAULT_MAX_MEMORY = 512 * 2**20
+
+def full_frame_bytes(shape:tuple, dtype)->int:
+    """Rough working set of the in-memory png pipeline: the raw frame plus a float32 copy of it."""
+    height, width = shape[-2:]
+    return height * width * (np.dtype(dtype).itemsize + 4)
+
+def needs_tiling(emd_file:Path, max_memory:int)->bool:
+    """Check (from the header only) whether the in-memory pipeline would exceed max_memory bytes.
+    Files the native reader doesn't understand can't be tiled and always return False.
+    """
+    try:
+        with VeloxEMD(emd_file) as emd:
+            return full_frame_bytes(emd.shape, emd.dtype) > max_memory
+    except UnsupportedLayoutError:
+        return False
+
+def band_rows(width:int, dtype, max_memory:int, multiple:int=1)->int:
+    """Number of raw rows per band so that a band and its float32 copies fit into max_memory bytes."""
+    bytes_per_row = width * (np.dtype(dtype).itemsize + 8)
+    rows = max(max_memory // bytes_per_row, 4 * multiple)
+    return int(rows - rows % multiple)
+
+def iter_bands(emd:VeloxEMD, rows:int, halo:int=0, index:int=0):
+    """Yield bands of rows of a frame, each extended by up to `halo` rows on both sides
+    (less at the image border).
+
+    Yields:
+        tuple: (first row, last row + 1, band including halo, number of halo rows on top)
+    """
+    height = emd.shape[-2]
+    for start in range(0, height, rows):
+        stop = min(start + rows, height)
+        read_start, read_stop = max(start - halo, 0), min(stop + halo, height)
+        yield start, stop, emd.read_rows(read_start, read_stop, index), start - read_start
+
+def _png_chunk(f, chunk_type:bytes, data:bytes):
+    f.write(struct.pack(">I", len(data)))
+    f.write(chunk_type)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff))
+
+def write_png_rows(save_dest:Path, width:int, height:int, row_blocks):
+    """Write an 8 bit grayscale png from an iterable of (rows, width) uint8 blocks, without ever
+    holding the whole image in memory. PIL can only save complete images.
+    """
+    compressor = zlib.compressobj(6)
+    with open(save_dest, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        _png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+        for block in row_blocks:
+            # every png row starts with its filter type, 0 = no filter
+            filtered = np.zeros((block.shape[0], width + 1), dtype=np.uint8)
+            filtered[:, 1:] = block
+            data = compressor.compress(filtered.tobytes())
+            if data:
+                _png_chunk(f, b"IDAT", data)
+        _png_chunk(f, b"IDAT", compressor.flush())
+        _png_chunk(f, b"IEND", b"")
+
+def scalebar_band_start(height:int)->int:
+    """First row of the bottom band of an image that holds everything add_scalebar draws."""
+    return max(int(height * 11 / 12) - height // 50, 0)
+
+def draw_scalebar_band(band:np.ndarray, shape:tuple, px_size, y_offset:int, add_scalebar)->np.ndarray:
+    """Draw the scalebar of an image with the given (height, width) shape onto its bottom band of rows
+    starting at y_offset, so the full image never has to be converted to a PIL image.
+
+    Returns:
+        np.ndarray: The uint8 band with the scalebar
+    """
+
+    from PIL import Image
+
+    im = Image.fromarray(band)
+    # only the shape of the full image is needed, a zero strided view doesn't allocate it
+    shape_only = np.broadcast_to(np.uint8(0), shape)
+    add_scalebar(im, shape_only, px_size_meter=px_size if not isinstance(px_size, tuple) else px_size[1], y_offset=y_offset)
+    return np.asarray(im)
+
+def tiled_preview(emd:VeloxEMD, tmp, factor:int, max_memory=DEFAULT_MAX_MEMORY, denoise_backend="fast-median"):
+    """First pass of the tiled pipeline: read the frame in bands of rows, bin and denoise them
+    (with a halo of neighbouring rows, so the result matches filtering the whole image) and store them
+    as float32 in a memory map on the temporary file tmp.
+
+    Returns:
+        tuple: (float32 memmap, (min, max) intensity, px size of the binned image, raw rows per band)
+    """
+
+    height, width = emd.shape[-2:]
+    px_size = scale_px_size(emd.pixel_size, (factor, factor))
+    out_height, out_width = height // factor, width // factor
+    rows = band_rows(width, emd.dtype, max_memory, multiple=factor)
+    print(f"Tiled processing of {emd.emd_file.name} ({height}x{width}) in bands of {rows} rows")
+
+    low, high = np.inf, -np.inf
+    processed = np.memmap(tmp, dtype=np.float32, mode="w+", shape=(out_height, out_width))
+    # the halo is counted in binned rows
+    for start, stop, band, top in iter_bands(emd, rows, halo=factor * DENOISE_HALO[denoise_backend]):
+        out_start, out_stop = start // factor, min(stop // factor, out_height)
+        if out_stop <= out_start:
+            # the last band holds fewer rows than a bin, they are dropped like in bin_image
+            continue
+        binned = denoise(bin_image(band, factor), denoise_backend)
+        binned = binned[top // factor:top // factor + out_stop - out_start]
+        processed[out_start:out_stop] = binned
+        low, high = min(low, binned.min()), max(high, binned.max())
+    return processed, (low, high), px_size, rows
+
+def write_png_tiled(emd_file:Path, save_dest:Path, downsample_factor=0.5, max_memory=DEFAULT_MAX_MEMORY, add_scalebar=None, in_range=None,
+                    denoise_backend="fast-median")->Path:
+    """Bounded memory version of the png pipeline for atlas / montage sized images.
+    The frame is binned and denoised band by band into a temporary file on disk (see tiled_preview).
+    A second pass maps the bands to uint8 with the global intensity range and streams them into the png.
+    Only integer binning is supported for downsampling, as it needs no halo and keeps band borders aligned.
+
+    Args:
+        emd_file (Path): The path of the emd file
+        save_dest (Path): Path of the png file to write
+        downsample_factor (float, optional): Scale factor, 1/downsample_factor has to be an integer. Defaults to 0.5.
+        max_memory (int, optional): Memory budget in bytes for the bands. Defaults to 512 MiB.
+        add_scalebar (callable, optional): add_scalebar(im, img_data, px_size_meter, y_offset) from
+            scalebar.py, drawn onto the bottom band. Defaults to None (no scalebar).
+        in_range (tuple, optional): (low, high) intensities mapped to black and white. Defaults to None
+            (min and max of the binned and filtered image).
+        denoise_backend (str, optional): One of denoise.DENOISE_BACKENDS. Defaults to "fast-median".
+
+    Returns:
+        Path: The path of the written png file.
+    """
+
+    factor = bin_factor(downsample_factor)
+    with VeloxEMD(emd_file) as emd, tempfile.TemporaryFile(dir=save_dest.parent) as tmp:
+        processed, min_max, px_size, rows = tiled_preview(emd, tmp, factor, max_memory, denoise_backend)
+        in_range = in_range or min_max
+        out_height, out_width = processed.shape
+
+        # pass 2: map to 8 bit and stream the rows into the png, drawing the scalebar on the bottom band
+        overlay_start = scalebar_band_start(out_height)
+        out_rows = max(rows // factor, 1)
+
+        def row_blocks(processed):
+            for start in range(0, overlay_start, out_rows):
+                yield map_to_8bit(processed[start:min(start + out_rows, overlay_start)], in_range=in_range)
+            bottom = map_to_8bit(processed[overlay_start:], in_range=in_range)
+            if add_scalebar is not None:
+                bottom = draw_scalebar_band(bottom, (out_height, out_width), px_size, overlay_start, add_scalebar)
+            yield bottom
+
+        print(f"Writing tiled png file binned by {factor} to {save_dest.name}")
+        with atomic_write(save_dest) as tmp_dest:
+            write_png_rows(tmp_dest, out_width, out_height, row_blocks(processed))
+        # release the memmap before its temporary file is closed
+        del processed
+
+    return save_dest
+
+def write_tiff_tiled(emd_file:Path, save_dest:Path, tile=(256, 256), map_16bit=False, **tiff_options)->Path:
+    """Write the raw frame of an .emd file to a tiled tiff, reading only one row of tiles at a time.
+
+    Args:
+        emd_file (Path): The path of the emd file
+        save_dest (Path): Path of the tiff file to write
+        tile (tuple, optional): (height, width) of the tiff tiles. Defaults to (256, 256).
+        map_16bit (bool, optional): Stretch the intensities to the full uint16 range. Needs an extra pass
+            over the bands for the global min and max. Defaults to False (raw data).
+        **tiff_options: Passed on to tifffile.imwrite (compression, predictor, resolution, maxworkers, ...),
+            see convert_emd2tiff.tiff_options
+
+    Returns:
+        Path: The path of the written tiff file.
+    """
+
+    import tifffile
+
+    with VeloxEMD(emd_file) as emd:
+        height, width = emd.shape[-2:]
+        dtype = emd.dtype
+        in_range = None
+        if map_16bit:
+            low, high = np.inf, -np.inf
+            for _, _, band, _ in iter_bands(emd, band_rows(width, emd.dtype, DEFAULT_MAX_MEMORY)):
+                low, high = min(low, band.min()), max(high, band.max())
+            in_range, dtype = (low, high), np.dtype(np.uint16)
+
+        def tiles():
+            for _, _, band, _ in iter_bands(emd, tile[0]):
+                if in_range is not None:
+                    band = map_to_16bit(band, in_range=in_range)
+                # the last row / column of tiles is padded to the full tile size
+                padded = np.zeros((tile[0], -(-width // tile[1]) * tile[1]), dtype=band.dtype)
+                padded[:band.shape[0], :width] = band
+                for x in range(0, width, tile[1]):
+                    yield padded[:, x:x + tile[1]]
+
+        tiff_options.setdefault("bigtiff", height * width * dtype.itemsize > 2**31)
+        print(f"Writing tiled tiff file to {save_dest.name}")
+        with atomic_write(save_dest) as tmp_dest:
+            tifffile.imwrite(tmp_dest, tiles(), shape=(height, width), dtype=dtype, tile=tile, **tiff_options)
+
+    return save_dest
@@ -0,0 +1,224 @@
+#%%
+import fnmatch
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from .batch import _convert_one, _converter_name, manifest_from_args, report_from_args
+from .profiling import RunReport
+from .convert_emd_multi import convert_to_formats, parse_formats
+from .preview import PREVIEW_ORDERS, DOWNSAMPLE_MODES
+
+
+#%%
+# Function definitions:
+class DirectoryPoller:
+    """Polling fallback for systems without inotify (e.g. network shares).
+    Directories are only listed again when their mtime changed (a file or sub directory was added or replaced),
+    so a poll of an unchanged tree costs one stat per directory instead of a full rglob.
+    on_file is called for files that are new or whose size / mtime changed since the last listing.
+    """
+
+    def __init__(self, root:Path, on_file):
+        self.root = Path(root)
+        self.on_file = on_file
+        self._dir_mtimes = {}
+        self._file_states = {}
+
+    def poll(self):
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime = directory.stat().st_mtime_ns
+            except FileNotFoundError:
+                self._dir_mtimes.pop(directory, None)
+                continue
+            changed = self._dir_mtimes.get(directory) != mtime
+            self._dir_mtimes[directory] = mtime
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                    elif changed:
+                        stat = entry.stat()
+                        state = (stat.st_size, stat.st_mtime_ns)
+                        if self._file_states.get(entry.path) != state:
+                            self._file_states[entry.path] = state
+                            self.on_file(Path(entry.path))
+
+
+class EmdWatcher:
+    """Watch a directory tree for new .emd files and convert each one once it stopped growing.
+
+    New files are noticed via inotify (watchdog package) or, if that is not available, by polling.
+    A file counts as complete when its size and mtime didn't change for `settle_time` seconds.
+    Complete files go to a pool of `jobs` worker processes, at most `max_queued` at a time,
+    the remaining ones wait in the pending list.
+    """
+
+    def __init__(self, watch_dir:Path, wildcard="*.emd", jobs=1, settle_time=5.0, poll_interval=1.0,
+                 max_queued=None, manifest=None, report=None, use_polling=False, **convert_kwargs):
+        self.watch_dir = Path(watch_dir)
+        self.wildcard = wildcard
+        self.jobs = jobs
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.max_queued = max_queued or 2 * jobs
+        self.manifest = manifest
+        self.report = report if report is not None else RunReport()
+        self.use_polling = use_polling
+        self.convert_kwargs = convert_kwargs
+        self._converter = _converter_name(convert_to_formats)
+        self._lock = threading.Lock()
+        self._pending = {}      # path -> (size, mtime_ns, time of the last change)
+        self._running = {}      # future -> path
+
+    def notice(self, path:Path):
+        """Register a new or modified file (called from the inotify thread or the poller)."""
+        if path.suffix.lower() != ".emd" or not fnmatch.fnmatch(path.name, self.wildcard):
+            return
+        with self._lock:
+            self._pending.setdefault(path, (-1, -1, time.monotonic()))
+
+    def _settled_files(self)->list:
+        now = time.monotonic()
+        settled = []
+        with self._lock:
+            for path, (size, mtime, last_change) in list(self._pending.items()):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    del self._pending[path]
+                    continue
+                if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                    self._pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+                elif now - last_change >= self.settle_time:
+                    settled.append(path)
+        return settled
+
+    def _start_observer(self):
+        """Start a watchdog observer (inotify on Linux). Returns None if watchdog isn't installed."""
+        if self.use_polling:
+            return None
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            print("watchdog is not installed, falling back to polling")
+            return None
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory:
+                    watcher.notice(Path(event.src_path))
+
+            def on_modified(self, event):
+                self.on_created(event)
+
+            def on_moved(self, event):
+                if not event.is_directory:
+                    watcher.notice(Path(event.dest_path))
+
+        observer = Observer()
+        observer.schedule(Handler(), str(self.watch_dir), recursive=True)
+        observer.start()
+        return observer
+
+    def _collect_finished(self):
+        for future in [future for future in self._running if future.done()]:
+            emd_file = self._running.pop(future)
+            result, error, record = future.result()
+            self.report.add(record)
+            if error is None:
+                if self.manifest is not None and result:
+                    self.manifest.record(emd_file, self._converter, self.convert_kwargs, result)
+                    self.manifest.save()
+                print(f"Done: {emd_file}")
+            else:
+                print(f"FAILED: {emd_file}\n{error}")
+
+    def run(self, initial_scan=False):
+        """Watch until interrupted with Ctrl+C.
+
+        Args:
+            initial_scan (bool, optional): Also convert files that already exist (and aren't up to date
+                according to the manifest). Defaults to False, only new files are converted.
+        """
+
+        poller = DirectoryPoller(self.watch_dir, self.notice)
+        if initial_scan:
+            poller.poll()
+        else:
+            # remember the current state of the tree without converting anything
+            poller.on_file = lambda path: None
+            poller.poll()
+            poller.on_file = self.notice
+
+        observer = self._start_observer()
+        print(f"Watching {self.watch_dir} for {self.wildcard} ({'inotify' if observer else 'polling'}), Ctrl+C to stop")
+        try:
+            with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+                while True:
+                    if observer is None:
+                        poller.poll()
+                    self._collect_finished()
+                    for emd_file in self._settled_files():
+                        if len(self._running) >= self.max_queued:
+                            break
+                        with self._lock:
+                            del self._pending[emd_file]
+                        if self.manifest is not None and self.manifest.is_up_to_date(emd_file, self._converter, self.convert_kwargs):
+                            continue
+                        print(f"Queueing {emd_file}")
+                        future = pool.submit(_convert_one, convert_to_formats, emd_file, self.convert_kwargs, self.manifest is not None)
+                        self._running[future] = emd_file
+                    time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print("Stopping watcher")
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            if self.manifest is not None:
+                self.manifest.save()
+            self.report.summary()
+
+
+
+##################################################################################################
+
+def add_arguments(parser):
+    """Add the options of `emd-convert watch` to its argparse parser."""
+    parser.description = "Watch a directory tree and convert new EMD files as soon as the microscope finished writing them."
+    parser.add_argument("emd_dir")
+    parser.add_argument("wildcard", nargs="?", default="*.emd")
+    parser.add_argument("--formats", type=parse_formats, default=("png",), help="Comma separated list of output formats (default: png)")
+    parser.add_argument("--downsample-factor", type=float, default=0.5, help="Scale factor for the png (default: 0.5)")
+    parser.add_argument("--preview-order", choices=PREVIEW_ORDERS, default="downsample-first")
+    parser.add_argument("--downsample-mode", choices=DOWNSAMPLE_MODES, default="rescale")
+    parser.add_argument("--settle-time", type=float, default=5.0, help="Seconds a file must not grow before it is converted (default: 5)")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between checks (default: 1)")
+    parser.add_argument("--initial", action="store_true", help="Also convert the files that already exist")
+    parser.add_argument("--polling", action="store_true", help="Don't use inotify, e.g. for network shares")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes (default: 1)")
+    parser.add_argument("--no-cache", action="store_true", help="Don't use the conversion manifest")
+    parser.add_argument("--hash", action="store_true", help="Compare sha256 checksums of the .emd files and the outputs in the manifest")
+    parser.add_argument("--report", default=None, help="JSON Lines file for the per file timing report (default: conversion_report.jsonl in emd_dir)")
+    parser.add_argument("--no-report", action="store_true", help="Don't write the timing report")
+
+def main(args):
+    """Run `emd-convert watch` with the options parsed by add_arguments."""
+    emd_dir = Path(args.emd_dir)
+    assert emd_dir.exists() and emd_dir.is_dir()
+
+    watcher = EmdWatcher(
+        emd_dir, args.wildcard, jobs=args.jobs, settle_time=args.settle_time, poll_interval=args.poll_interval,
+        manifest=manifest_from_args(args, emd_dir), report=report_from_args(args, emd_dir), use_polling=args.polling,
+        formats=args.formats, downsample_factor=args.downsample_factor,
+        preview_order=args.preview_order, downsample_mode=args.downsample_mode,
+    )
+    watcher.run(initial_scan=args.initial)
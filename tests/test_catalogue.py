@@ -0,0 +1,46 @@
+import os
+import pytest
+from emd_convert.catalogue import Catalogue, select_files
+from emd_convert.synthetic_emd import write_velox_emd
+
+
+@pytest.fixture
+def session(tmp_path):
+    (tmp_path / "grid").mkdir()
+    write_velox_emd(tmp_path / "low_mag.emd", 32, 48, px_size=(2e-9, 2e-9), magnification=5000, detector="HAADF")
+    write_velox_emd(tmp_path / "grid" / "high_mag.emd", 32, 48, px_size=(1e-10, 1e-10), magnification=92000)
+    write_velox_emd(tmp_path / "grid" / "movie.emd", 32, 48, n_frames=4, px_size=(1e-10, 2e-10), magnification=92000)
+    (tmp_path / "broken.emd").write_bytes(b"not hdf5")
+    return tmp_path
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_header_entries(session, jobs):
+    catalogue = Catalogue.for_directory(session)
+    assert catalogue.update(sorted(session.rglob("*.emd")), jobs=jobs) == 4
+    rows = {os.path.basename(row["path"]): row for row in catalogue.rows()}
+    assert rows["low_mag.emd"]["magnification"] == 5000 and rows["low_mag.emd"]["detector"] == "HAADF"
+    movie = rows["movie.emd"]
+    assert (movie["height"], movie["width"], movie["frames"], movie["dtype"]) == (32, 48, 4, "uint16")
+    assert (movie["pixel_size"], movie["pixel_size_y"]) == (2e-10, 1e-10)
+    assert rows["broken.emd"]["error"].startswith("OSError") and rows["broken.emd"]["pixel_size"] is None
+    catalogue.close()
+
+def test_select_files_by_metadata(session):
+    assert select_files(session, "*.emd", "pixel_size < 1e-9 AND frames = 1") == [session / "grid" / "high_mag.emd"]
+    assert select_files(session, "*.emd", "magnification = 92000") == [session / "grid" / "high_mag.emd", session / "grid" / "movie.emd"]
+    assert select_files(session, "*.emd", "error IS NOT NULL") == [session / "broken.emd"]
+    # the wildcard still applies
+    assert select_files(session, "movie*.emd", "magnification = 92000") == [session / "grid" / "movie.emd"]
+
+def test_update_is_incremental_and_prunes(session):
+    catalogue = Catalogue.for_directory(session)
+    emd_files = sorted(session.rglob("*.emd"))
+    assert catalogue.update(emd_files) == 4
+    assert catalogue.update(emd_files) == 0
+    write_velox_emd(session / "low_mag.emd", 32, 48, magnification=57000)
+    assert catalogue.update(emd_files) == 1
+    assert catalogue.query("magnification = 57000") == [(session / "low_mag.emd").resolve()]
+    (session / "grid" / "movie.emd").unlink()
+    catalogue.update(sorted(session.rglob("*.emd")), prune_dir=session)
+    assert len(catalogue.query()) == 3
+    catalogue.close()
@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import time
+import pytest
+from emd_convert import cluster
+from emd_convert.cluster import ClaimQueue, parse_shard, shard_files, merge_manifests
+from emd_convert.conversion_cache import MANIFEST_NAME
+
+
+@pytest.fixture
+def emd_dir(tmp_path):
+    (tmp_path / "grid").mkdir()
+    for name in ["a.emd", "b.emd", "grid/c.emd"]:
+        (tmp_path / name).write_bytes(name.encode())
+    return tmp_path
+
+def test_parse_shard():
+    assert parse_shard("2/3") == (2, 3)
+    for shard in ["0/3", "4/3", "1-3", "x/3"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(shard)
+
+def test_shards_partition_the_files(tmp_path):
+    emd_files = [tmp_path / f"{i:03d}.emd" for i in range(60)]
+    shards = [shard_files(emd_files, tmp_path, (i, 3)) for i in (1, 2, 3)]
+    assert sorted(sum(shards, [])) == emd_files
+    assert all(shards)
+    # the assignment doesn't depend on the order or the mount point of the directory
+    assert shard_files(emd_files[::-1], tmp_path, (2, 3)) == shards[1][::-1]
+    moved = [tmp_path / "mnt" / f.name for f in emd_files]
+    assert [f.name for f in shard_files(moved, tmp_path / "mnt", (2, 3))] == [f.name for f in shards[1]]
+
+def test_only_one_node_gets_a_claim(emd_dir):
+    node_1, node_2 = ClaimQueue.for_directory(emd_dir), ClaimQueue.for_directory(emd_dir)
+    a, b = emd_dir / "a.emd", emd_dir / "b.emd"
+    assert node_1.claim(a, "mrc", {})
+    assert not node_2.claim(a, "mrc", {})
+    assert node_2.claim(b, "mrc", {})
+    assert node_1.status() == {"claim": 2, "done": 0, "failed": 0}
+
+    node_1.release(a)
+    node_2.release(b, ok=False)
+    assert node_1.status() == {"claim": 0, "done": 1, "failed": 1}
+    # finished files are skipped, also if the conversion failed
+    assert not node_2.claim(a, "mrc", {})
+    assert not node_1.claim(b, "mrc", {})
+    node_1.close()
+    node_2.close()
+
+def test_changed_files_and_parameters_are_claimed_again(emd_dir):
+    queue = ClaimQueue.for_directory(emd_dir)
+    a = emd_dir / "a.emd"
+    assert queue.claim(a, "mrc", {"binning": 1})
+    queue.release(a)
+    assert not queue.claim(a, "mrc", {"binning": 1})
+    assert queue.claim(a, "mrc", {"binning": 2})
+    assert queue.claim(a, "tiff", {"binning": 1})
+    queue.close()
+    a.write_bytes(b"re-exported")
+    assert queue.claim(a, "mrc", {"binning": 1})
+    queue.close()
+
+def test_stale_claims_are_taken_over(emd_dir, monkeypatch):
+    crashed, node = ClaimQueue.for_directory(emd_dir, stale_after=60), ClaimQueue.for_directory(emd_dir, stale_after=60)
+    a = emd_dir / "a.emd"
+    monkeypatch.setattr(cluster, "NODE_NAME", "crashed.1")
+    assert crashed.claim(a, "mrc", {})
+    monkeypatch.setattr(cluster, "NODE_NAME", "node.2")
+    assert not node.claim(a, "mrc", {})
+
+    claim_path, = (emd_dir / cluster.QUEUE_DIR).glob("*.claim")
+    old = time.time() - 120
+    os.utime(claim_path, (old, old))
+    assert node.claim(a, "mrc", {})
+    with open(claim_path) as f:
+        assert json.load(f)["node"] == "node.2"
+    assert sorted(p.name for p in claim_path.parent.iterdir()) == [claim_path.name]
+
+    # the crashed node finds its claim gone when it comes back
+    crashed.release(a)
+    node.release(a)
+    assert node.status() == {"claim": 0, "done": 1, "failed": 0}
+
+def test_close_gives_up_unfinished_claims(emd_dir):
+    node_1, node_2 = ClaimQueue.for_directory(emd_dir), ClaimQueue.for_directory(emd_dir)
+    a = emd_dir / "a.emd"
+    assert node_1.claim(a, "mrc", {})
+    node_1.close()
+    assert node_1.status() == {"claim": 0, "done": 0, "failed": 0}
+    assert node_2.claim(a, "mrc", {})
+    node_2.close()
+
+def test_merge_manifests(emd_dir):
+    stem = os.path.splitext(MANIFEST_NAME)[0]
+    with open(emd_dir / MANIFEST_NAME, "w") as f:
+        json.dump({"a.emd": {"mrc": {"earlier": True}}}, f)
+    with open(emd_dir / f"{stem}.node1.1.json", "w") as f:
+        json.dump({"a.emd": {"tiff": {"node": 1}}}, f)
+    with open(emd_dir / f"{stem}.node2.7.json", "w") as f:
+        json.dump({"b.emd": {"mrc": {"node": 2}}}, f)
+
+    merge_manifests(emd_dir)
+    with open(emd_dir / MANIFEST_NAME) as f:
+        entries = json.load(f)
+    assert entries == {"a.emd": {"mrc": {"earlier": True}, "tiff": {"node": 1}}, "b.emd": {"mrc": {"node": 2}}}
+    assert sorted(p.name for p in emd_dir.glob("*.json")) == [MANIFEST_NAME]
@@ -0,0 +1,36 @@
+import os
+import numpy as np
+from PIL import Image
+from emd_convert.cli import main
+from emd_convert.synthetic_emd import write_velox_emd
+from emd_convert.contact_sheet import THUMBNAIL_DIR, thumbnail_path
+
+
+def test_contact_sheet_pages_and_thumbnail_cache(tmp_path):
+    (tmp_path / "grid").mkdir()
+    emd_files = [write_velox_emd(tmp_path / "a.emd", 600, 300, seed=0),
+                 write_velox_emd(tmp_path / "b.emd", 512, 512, seed=1),
+                 write_velox_emd(tmp_path / "grid" / "a.emd", 512, 512, n_frames=3, seed=2)]
+    args = ["contact-sheet", str(tmp_path), "--columns", "2", "--rows", "1", "--thumb-size", "128", "--no-report"]
+    main(args)
+
+    thumb_dir = tmp_path / THUMBNAIL_DIR
+    thumbnails = [thumbnail_path(emd_file, tmp_path, thumb_dir) for emd_file in emd_files]
+    # equally named files in sub directories get their own thumbnail
+    assert len(set(thumbnails)) == 3 and all(thumbnail.exists() for thumbnail in thumbnails)
+    assert Image.open(thumbnails[0]).size == (64, 128)
+    # 3 thumbnails on pages of 2
+    pages = sorted(tmp_path.glob("contact_sheet_*.png"))
+    assert [page.name for page in pages] == ["contact_sheet_001.png", "contact_sheet_002.png"]
+    # 2 cells of thumbnail, label and padding
+    assert Image.open(pages[0]).size == (2 * (128 + 8) + 8, 128 + 14 + 2 * 8 + 8)
+    # the thumbnail of a.emd (64 px wide) is centered in its cell
+    first_page = np.asarray(Image.open(pages[0]))
+    assert (first_page[8:136, 8:40] == 255).all() and (first_page[8:136, 40:104] < 255).any()
+
+    # cached thumbnails are only rendered again for changed files
+    mtimes = [thumbnail.stat().st_mtime_ns for thumbnail in thumbnails]
+    stat = emd_files[1].stat()
+    os.utime(emd_files[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    main(args)
+    assert [thumbnail.stat().st_mtime_ns == mtime for thumbnail, mtime in zip(thumbnails, mtimes)] == [True, False, True]
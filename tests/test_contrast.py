@@ -0,0 +1,56 @@
+import h5py
+import numpy as np
+import pytest
+from PIL import Image
+from emd_convert.emd_reader import load_emd
+from emd_convert.synthetic_emd import synthetic_frame, write_velox_emd
+from emd_convert.contrast import IntensityHistogram, contrast_limits, session_limits
+from emd_convert.convert_emd2png_add_scalebar import convert_to_png
+
+
+def scale_emd(emd_file, factor):
+    # scale the intensities of a synthetic file in place
+    with h5py.File(emd_file, "r+") as f:
+        dataset = f["Data/Image"][next(iter(f["Data/Image"]))]["Data"]
+        dataset[()] = (dataset[()] * factor).astype(dataset.dtype)
+    return emd_file
+
+def test_uint16_limits_are_exact_percentiles():
+    img = synthetic_frame(np.random.default_rng(0), 300, 200)
+    low, high = contrast_limits(img, (1, 99))
+    # one bin per value, limits are bin centers
+    assert low == np.percentile(img, 1, method="inverted_cdf") + 0.5
+    assert high == np.percentile(img, 99, method="inverted_cdf") + 0.5
+
+def test_merged_float_histograms_match_the_combined_data():
+    rng = np.random.default_rng(0)
+    a, b = rng.normal(100, 10, 100_000).astype(np.float32), rng.normal(200, 10, 100_000).astype(np.float32)
+    merged = IntensityHistogram.for_values(a).add(a).merge(IntensityHistogram.for_values(b).add(b))
+    expected = np.percentile(np.concatenate([a, b]), (5, 95))
+    np.testing.assert_allclose(merged.limits((5, 95)), expected, atol=0.2)
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_session_limits_cover_all_files(tmp_path, jobs):
+    emd_files = [write_velox_emd(tmp_path / "bright.emd", 200, 150, seed=0),
+                 scale_emd(write_velox_emd(tmp_path / "dark.emd", 200, 150, seed=1), 0.25)]
+    (tmp_path / "broken.emd").write_bytes(b"not hdf5")
+    limits = session_limits([*emd_files, tmp_path / "broken.emd"], (1, 99), jobs=jobs)
+    combined = np.concatenate([load_emd(emd_file)[0].ravel() for emd_file in emd_files])
+    assert limits == tuple(np.percentile(combined, (1, 99), method="inverted_cdf") + 0.5)
+    with pytest.raises(ValueError):
+        session_limits([tmp_path / "broken.emd"])
+
+def test_session_contrast_keeps_relative_brightness(tmp_path):
+    bright = write_velox_emd(tmp_path / "bright.emd", 512, 512, seed=0)
+    dark = scale_emd(write_velox_emd(tmp_path / "dark.emd", 512, 512, seed=0), 0.5)
+    means = {}
+    for contrast in ["minmax", "session"]:
+        in_range = session_limits([bright, dark]) if contrast == "session" else None
+        for emd_file in [bright, dark]:
+            png = convert_to_png(emd_file, overwrite=True, contrast=contrast, in_range=in_range)
+            means[contrast, emd_file.stem] = np.asarray(Image.open(png), dtype=np.float64).mean()
+    # stretched to their own min and max, both previews look alike; with the session limits the dark one stays dark
+    assert means["minmax", "dark"] == pytest.approx(means["minmax", "bright"], rel=0.05)
+    assert means["session", "dark"] < 0.7 * means["session", "bright"]
+    with pytest.raises(ValueError):
+        convert_to_png(bright, overwrite=True, contrast="session")
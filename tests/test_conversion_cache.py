@@ -0,0 +1,68 @@
+import os
+import pytest
+from emd_convert.batch import run_batch, _converter_name
+from emd_convert.conversion_cache import ConversionManifest, atomic_write, file_checksum
+from emd_convert.synthetic_emd import write_velox_emd
+from emd_convert.convert_emd2mrc import convert_to_mrc
+
+
+CONVERTER = _converter_name(convert_to_mrc)
+
+@pytest.fixture
+def converted(tmp_path):
+    emd_file = write_velox_emd(tmp_path / "x.emd", 64, 48)
+    manifest = ConversionManifest.for_directory(tmp_path, use_hash=True)
+    assert run_batch(convert_to_mrc, [emd_file], manifest=manifest) == []
+    return emd_file, manifest
+
+def test_outputs_are_recorded_with_checksum(converted):
+    emd_file, manifest = converted
+    entry = ConversionManifest.for_directory(emd_file.parent).entries[str(emd_file.resolve())][CONVERTER]
+    mrc = emd_file.with_suffix(".mrc")
+    assert entry["outputs"] == [{"path": str(mrc.resolve()), "size": mrc.stat().st_size, "sha256": file_checksum(mrc)}]
+    assert entry["input"]["sha256"] == file_checksum(emd_file)
+
+def test_up_to_date_files_are_skipped(converted):
+    emd_file, manifest = converted
+    mrc = emd_file.with_suffix(".mrc")
+    mtime = mrc.stat().st_mtime_ns
+    assert run_batch(convert_to_mrc, [emd_file], manifest=manifest) == []
+    assert mrc.stat().st_mtime_ns == mtime
+    # other parameters need a new conversion
+    assert not manifest.is_up_to_date(emd_file, CONVERTER, {"group_frames": 2})
+
+def test_touched_input_is_hashed_once(converted, monkeypatch):
+    emd_file, manifest = converted
+    stat = emd_file.stat()
+    os.utime(emd_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert manifest.is_up_to_date(emd_file, CONVERTER, {})
+    # the new mtime was recorded, so the next check doesn't hash the input again
+    hashed = []
+    checksum = file_checksum
+    monkeypatch.setattr("emd_convert.conversion_cache.file_checksum", lambda path: hashed.append(path) or checksum(path))
+    assert manifest.is_up_to_date(emd_file, CONVERTER, {})
+    assert emd_file not in hashed
+    # without hashing, a new mtime means a new conversion
+    assert not ConversionManifest.for_directory(emd_file.parent).is_up_to_date(emd_file, CONVERTER, {})
+
+def test_changed_input_and_outputs_invalidate(converted):
+    emd_file, manifest = converted
+    mrc = emd_file.with_suffix(".mrc")
+    # same size, other content: only the checksum notices
+    data = bytearray(mrc.read_bytes())
+    data[-1] ^= 0xFF
+    mrc.write_bytes(bytes(data))
+    assert not manifest.is_up_to_date(emd_file, CONVERTER, {})
+    mrc.unlink()
+    assert not manifest.is_up_to_date(emd_file, CONVERTER, {})
+    with open(emd_file, "ab") as f:
+        f.write(b"\0")
+    assert not manifest.is_up_to_date(emd_file, CONVERTER, {})
+
+def test_atomic_write_leaves_nothing_on_error(tmp_path):
+    save_dest = tmp_path / "x.png"
+    with pytest.raises(RuntimeError):
+        with atomic_write(save_dest) as tmp_dest:
+            tmp_dest.write_bytes(b"half")
+            raise RuntimeError
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+from skimage import filters
+from emd_convert.synthetic_emd import synthetic_frame
+from emd_convert.denoise import denoise, median3x3
+
+
+@pytest.mark.parametrize("dtype", ["uint16", "float32"])
+@pytest.mark.parametrize("shape", [(300, 257), (3, 3), (1, 5)])
+def test_median3x3_matches_skimage(dtype, shape):
+    img = synthetic_frame(np.random.default_rng(0), *shape, dtype=dtype)
+    filtered = median3x3(img)
+    assert filtered.dtype == img.dtype
+    np.testing.assert_array_equal(filtered, filters.median(img))
+
+@pytest.mark.parametrize("backend", ["median", "fast-median", "gaussian", "mean"])
+def test_denoise_threads_match_single_thread(backend):
+    img = synthetic_frame(np.random.default_rng(1), 300, 257)
+    np.testing.assert_array_equal(denoise(img, backend, threads=4), denoise(img, backend))
@@ -0,0 +1,37 @@
+import mrcfile
+import numpy as np
+import pytest
+from emd_convert.emd_reader import VeloxEMD, load_emd
+from emd_convert.synthetic_emd import write_velox_emd
+from emd_convert.convert_emd2mrc import convert_to_mrc
+
+
+def test_row_blocks_cover_all_frames(tmp_path):
+    emd_file = write_velox_emd(tmp_path / "stack.emd", 101, 64, n_frames=5)
+    stack, _ = load_emd(emd_file)
+    with VeloxEMD(emd_file) as emd:
+        blocks = list(emd.iter_row_blocks(max_bytes=64 * 5 * 2 * 12, multiple=4))
+    assert [stop - start for start, stop, _ in blocks[:-1]] == [12] * 8
+    np.testing.assert_array_equal(np.concatenate([block for _, _, block in blocks], axis=1), stack)
+
+@pytest.mark.parametrize("group_frames", [1, 3, 0])
+def test_mrc_stack_matches_frames(tmp_path, group_frames):
+    emd_file = write_velox_emd(tmp_path / "stack.emd", 101, 64, n_frames=7)
+    stack, _ = load_emd(emd_file)
+    with mrcfile.open(convert_to_mrc(emd_file, group_frames=group_frames)) as f:
+        data = f.data.copy()
+    group = group_frames or 7
+    n_out = 7 // group
+    expected = stack[:n_out * group].reshape(n_out, group, 101, 64).sum(axis=1, dtype=np.float32)
+    # mrcfile returns a single summed frame as 2D image
+    np.testing.assert_array_equal(data.reshape(expected.shape), expected.astype(data.dtype))
+
+@pytest.mark.parametrize("group_frames", [1, 2])
+def test_mrc_stack_header_stats(tmp_path, group_frames):
+    emd_file = write_velox_emd(tmp_path / "stack.emd", 101, 64, n_frames=6)
+    mrc = convert_to_mrc(emd_file, group_frames=group_frames)
+    with mrcfile.open(mrc) as f:
+        data, header = f.data.astype(np.float64), f.header
+        assert header.dmin == data.min() and header.dmax == data.max()
+        assert header.dmean == pytest.approx(data.mean(), rel=1e-6)
+        assert header.rms == pytest.approx(data.std(), rel=1e-5)
@@ -0,0 +1,24 @@
+import mrcfile
+import numpy as np
+from emd_convert.batch import _converter_name
+from emd_convert.conversion_cache import ConversionManifest
+from emd_convert.emd_reader import load_emd
+from emd_convert.synthetic_emd import write_velox_emd
+from emd_convert.convert_emd_multi import convert_to_formats, encode_formats, write_outputs
+from emd_convert.pipeline import run_pipeline
+
+
+def test_pipeline_shares_manifest_entries_with_batch(tmp_path):
+    emd_files = [write_velox_emd(tmp_path / f"{i}.emd", 512, 512) for i in range(2)]
+    options = dict(formats=("png", "mrc", "tiff"), downsample_factor=0.5)
+    manifest = ConversionManifest.for_directory(tmp_path)
+    failures = run_pipeline(emd_files, load_emd, encode_formats, write_outputs, readers=1, jobs=1,
+                            converter=_converter_name(convert_to_formats), manifest=manifest, **options)
+    assert failures == []
+    for emd_file in emd_files:
+        assert manifest.is_up_to_date(emd_file, _converter_name(convert_to_formats), options)
+        # the mrc is written by the worker process
+        img_data, _ = load_emd(emd_file)
+        with mrcfile.open(emd_file.with_suffix(".mrc")) as f:
+            np.testing.assert_array_equal(f.data, img_data)
+        assert emd_file.with_suffix(".png").exists() and emd_file.with_suffix(".tiff").exists()
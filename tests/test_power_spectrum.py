@@ -0,0 +1,66 @@
+import csv
+import numpy as np
+import pytest
+from PIL import Image
+from scipy import fft
+from emd_convert.emd_reader import VeloxEMD
+from emd_convert.power_spectrum import (batched_power, full_spectrum, power_spectrum, radial_profile,
+                                        read_central_crop, write_power_spectrum)
+from emd_convert.synthetic_emd import synthetic_frame, write_velox_emd
+
+
+def lattice(height, width, period_y, period_x):
+    y, x = np.mgrid[:height, :width].astype(np.float32)
+    return 1000 + 200 * np.cos(2 * np.pi * y / period_y) * np.cos(2 * np.pi * x / period_x)
+
+@pytest.mark.parametrize("px_size, periods, expected", [
+    (1e-10, (16, 8), np.hypot(1 / 1.6, 1 / 0.8)),
+    # the profile ends at the Nyquist frequency of the longer px side
+    ((2e-10, 1e-10), (32, 16), np.hypot(1 / 6.4, 1 / 1.6)),
+])
+def test_lattice_peak_in_radial_profile(px_size, periods, expected):
+    img = lattice(1024, 1024, *periods)
+    power, binned_px_size = power_spectrum(img, px_size)
+    assert power.shape == (512, 257)
+    assert binned_px_size == pytest.approx((2 * px_size, 2 * px_size) if np.isscalar(px_size) else tuple(2 * p for p in px_size))
+    frequencies, profile = radial_profile(power, binned_px_size)
+    step = frequencies[1]
+    assert frequencies[np.argmax(profile)] == pytest.approx(expected, abs=step)
+
+def test_half_plane_completes_to_the_full_spectrum():
+    patch = synthetic_frame(np.random.default_rng(1), 64, 64).astype(np.float32)
+    window = np.hanning(64)
+    expected = np.abs(fft.fft2((patch - patch.mean()) * window[:, None] * window[None, :]))**2
+    full = full_spectrum(batched_power(patch[np.newaxis]))
+    assert full.shape == (64, 64)
+    np.testing.assert_allclose(full, fft.fftshift(expected), rtol=1e-3, atol=1e-3 * expected.max())
+
+def test_stack_averages_the_frames_over_batches():
+    # 70 frames of one patch each need two rfft2 batches
+    rng = np.random.default_rng(2)
+    stack = np.stack([synthetic_frame(rng, 128, 128) for _ in range(70)])
+    power, _ = power_spectrum(stack, 1e-10, size=64)
+    frame_powers = [power_spectrum(frame, 1e-10, size=64)[0] for frame in stack]
+    np.testing.assert_allclose(power, np.mean(frame_powers, axis=0), rtol=1e-4)
+
+def test_central_crop_gives_the_spectrum_of_the_whole_image(tmp_path):
+    emd_file = tmp_path / "large.emd"
+    write_velox_emd(emd_file, 1200, 1500, px_size=(1e-10, 1e-10), seed=3)
+    with VeloxEMD(emd_file) as emd:
+        img = emd.data
+    crop, px_size = read_central_crop(emd_file, size=128, max_patches=4)
+    assert crop.shape == (512, 512) and px_size == 1e-10
+    np.testing.assert_allclose(power_spectrum(crop, px_size, size=128, max_patches=4)[0],
+                               power_spectrum(img, px_size, size=128, max_patches=4)[0], rtol=1e-5)
+
+def test_write_power_spectrum(tmp_path):
+    written = write_power_spectrum(lattice(512, 512, 8, 8), 1e-10, tmp_path / "lattice", size=128)
+    assert written == [tmp_path / "lattice_ps.png", tmp_path / "lattice_ps.csv"]
+    with Image.open(written[0]) as png:
+        assert (png.size, png.mode) == ((128, 128), "L")
+    with open(written[1], newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 65 and rows[0]["resolution_nm"] == ""
+    peak = max(rows, key=lambda row: float(row["mean_power"]))
+    # period of 8 px in both directions: 0.8 nm / sqrt(2)
+    assert float(peak["resolution_nm"]) == pytest.approx(0.8 / np.sqrt(2), rel=0.05)
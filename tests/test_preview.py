@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from emd_convert.synthetic_emd import synthetic_frame
+from emd_convert.preview import bin_image, downsample, make_preview, scale_px_size
+
+
+@pytest.mark.parametrize("mode", ["rescale", "bin", "fourier"])
+def test_legacy_order_uses_in_range(mode):
+    # smooth and periodic, so that Fourier cropping doesn't ring at the edges
+    img = np.tile(500 + 500 * np.sin(np.linspace(0, 2 * np.pi, 96, endpoint=False, dtype=np.float32)), (128, 1))
+    stretched, _ = make_preview(img, 1e-9, order="legacy", mode=mode)
+    assert stretched.max() == 255
+    # limits twice as wide as the intensities keep the preview at about half brightness instead of stretching it again
+    preview, _ = make_preview(img, 1e-9, order="legacy", mode=mode, in_range=(0, 2000))
+    assert 120 <= preview.max() <= 135
+    # limits up to the mean intensity clip the brighter half
+    clipped, _ = make_preview(img, 1e-9, order="legacy", mode=mode, in_range=(0, 500))
+    assert 0.4 < (clipped == 255).mean() < 0.6
+
+@pytest.mark.parametrize("factor", [2, 3, 4])
+def test_bin_keeps_mean_and_scales_px_size(factor):
+    img = synthetic_frame(np.random.default_rng(0), 301, 258)
+    small, px_scale = downsample(img, 1 / factor, "bin")
+    assert small.shape == (301 // factor, 258 // factor)
+    # the incomplete blocks at the bottom / right edge are dropped
+    cropped = img[:small.shape[0] * factor, :small.shape[1] * factor]
+    assert small.mean(dtype=np.float64) == pytest.approx(cropped.mean(dtype=np.float64), rel=1e-5)
+    assert scale_px_size(1e-9, px_scale) == pytest.approx(factor * 1e-9)
+    assert scale_px_size((1e-9, 2e-9), px_scale) == pytest.approx((factor * 1e-9, factor * 2e-9))
+
+@pytest.mark.parametrize("downsample_factor", [0.5, 0.3])
+def test_fourier_crop_keeps_mean_and_scales_px_size(downsample_factor):
+    img = synthetic_frame(np.random.default_rng(0), 301, 258)
+    small, px_scale = downsample(img, downsample_factor, "fourier")
+    assert small.shape == (round(301 * downsample_factor), round(258 * downsample_factor))
+    # the zero frequency is kept, so is the mean
+    assert small.mean(dtype=np.float64) == pytest.approx(img.mean(dtype=np.float64), rel=1e-4)
+    assert scale_px_size((1e-9, 1e-9), px_scale) == pytest.approx((1e-9 * 301 / small.shape[0], 1e-9 * 258 / small.shape[1]))
+
+@pytest.mark.parametrize("factor", [1, 2, 3, 8])
+def test_bin_image_matches_block_mean(factor):
+    stack = np.stack([synthetic_frame(np.random.default_rng(i), 131, 70) for i in range(2)])
+    height, width = 131 // factor * factor, 70 // factor * factor
+    blocks = stack[:, :height, :width].reshape(2, height // factor, factor, width // factor, factor)
+    binned = bin_image(stack, factor)
+    assert binned.dtype == np.float32
+    np.testing.assert_array_equal(binned, blocks.mean(axis=(-3, -1), dtype=np.float32))
@@ -0,0 +1,69 @@
+import io
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+import pytest
+from PIL import Image
+from emd_convert.synthetic_emd import write_velox_emd
+from emd_convert.preview_server import PngCache, PreviewHandler, PreviewRenderer, render_png
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / "session").mkdir()
+    write_velox_emd(tmp_path / "session" / "grid 1.emd", 512, 512)
+    write_velox_emd(tmp_path / "outside.emd", 64, 64)
+    renderer = PreviewRenderer(tmp_path / "session")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PreviewHandler)
+    server.renderer = renderer
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", tmp_path / "session"
+    server.shutdown()
+    server.server_close()
+    renderer.close()
+
+def get(url):
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return response.status, response.headers, response.read()
+
+def test_previews_are_rendered_once_and_cached(server):
+    url, session = server
+    status, headers, body = get(url + "/")
+    assert status == 200 and b'href="/png/grid%201.emd"' in body
+    status, headers, png = get(url + "/png/grid%201.emd?factor=0.5")
+    assert status == 200 and headers["Content-Type"] == "image/png" and headers["X-Cache"] == "miss"
+    assert Image.open(io.BytesIO(png)).size == (256, 256)
+    assert png == render_png(session / "grid 1.emd", downsample_factor=0.5)
+    assert get(url + "/png/grid%201.emd?factor=0.5")[1]["X-Cache"] == "hit"
+    # other options are another preview
+    assert get(url + "/png/grid%201.emd?factor=0.5&contrast=percentile")[1]["X-Cache"] == "miss"
+    # a re-exported file is rendered again
+    write_velox_emd(session / "grid 1.emd", 512, 512, seed=1)
+    assert get(url + "/png/grid%201.emd?factor=0.5")[1]["X-Cache"] == "miss"
+
+@pytest.mark.parametrize("path, status", [
+    ("/png/missing.emd", 404),
+    ("/png/../outside.emd", 404),
+    ("/png/grid%201.emd?factor=2", 400),
+    ("/png/grid%201.emd?contrast=session", 400),
+    ("/other", 404),
+])
+def test_bad_requests(server, path, status):
+    url, _ = server
+    with pytest.raises(urllib.error.HTTPError) as error:
+        get(url + path)
+    assert error.value.code == status
+
+def test_cache_evicts_least_recently_used():
+    cache = PngCache(max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"
+    cache.put("c", b"1234")
+    # b was used least recently
+    assert cache.get("b") is None and len(cache) == 2 and cache.n_bytes == 8
+    cache.put("huge", b"x" * 11)
+    assert cache.get("huge") is None
+    assert (cache.hits, cache.misses) == (1, 2)
@@ -0,0 +1,23 @@
+import subprocess
+import sys
+from pathlib import Path
+from emd_convert import profiling
+
+
+def test_batch_imports_without_resource():
+    # Windows has no resource module
+    code = "import sys; sys.modules['resource'] = None; import emd_convert.batch; assert emd_convert.profiling.peak_rss_mb() is None"
+    subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parents[1], check=True)
+
+def test_summary_without_peak_rss(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(profiling, "resource", None)
+    emd_file = tmp_path / "a.emd"
+    emd_file.write_bytes(b"x" * 100)
+    report = profiling.RunReport()
+    with profiling.profile_file(emd_file) as profile:
+        with profiling.stage("load"):
+            pass
+        report.add(profile.finish())
+    report.summary()
+    out = capsys.readouterr().out
+    assert "1/1 files ok" in out and "peak RSS" not in out
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+import tifffile
+from PIL import Image
+from emd_convert.batch import run_batch, _converter_name
+from emd_convert.conversion_cache import ConversionManifest
+from emd_convert.emd_reader import load_emd
+from emd_convert.synthetic_emd import write_velox_emd
+from emd_convert.convert_emd2tiff import convert_to_tiff
+from emd_convert.convert_emd2png_add_scalebar import convert_to_pyramid
+from emd_convert.pyramid import halve, n_levels
+
+
+@pytest.mark.parametrize("tiled", [False, True])
+def test_pyramid_tiff_keeps_the_raw_tiff(tmp_path, tiled):
+    emd_file = write_velox_emd(tmp_path / "grid.emd", 600, 520)
+    img_data, _ = load_emd(emd_file)
+    archive = convert_to_tiff(emd_file)
+    written = convert_to_pyramid(emd_file, pyramid="tiff", tiled=tiled)
+    assert written == [tmp_path / "grid_pyramid.tiff"]
+    np.testing.assert_array_equal(tifffile.imread(archive), img_data)
+    with tifffile.TiffFile(written[0]) as tif:
+        assert tif.pages[0].shape == (600, 520) and tif.pages[0].dtype == np.uint8
+
+def test_deepzoom_outputs_are_recorded(tmp_path):
+    emd_file = write_velox_emd(tmp_path / "grid.emd", 600, 520)
+    manifest = ConversionManifest.for_directory(tmp_path)
+    options = dict(pyramid="dzi", tile_format="png", overwrite=True)
+    assert run_batch(convert_to_pyramid, [emd_file], manifest=manifest, **options) == []
+    dzi, tiles_dir = tmp_path / "grid_pyramid.dzi", tmp_path / "grid_pyramid_files"
+    outputs = manifest.entries[str(emd_file.resolve())][_converter_name(convert_to_pyramid)]["outputs"]
+    assert [output["path"] for output in outputs] == [str(dzi.resolve()), str(tiles_dir.resolve())]
+    # one tile directory per level, the top level tiles cover the full image
+    assert sorted(int(level.name) for level in tiles_dir.iterdir()) == list(range(n_levels(600, 520)))
+    assert Image.open(tiles_dir / "10" / "0_0.png").size == (255, 255)
+    assert manifest.is_up_to_date(emd_file, _converter_name(convert_to_pyramid), options)
+    # a missing tile directory invalidates the entry
+    for tile in (tiles_dir / "0").iterdir():
+        tile.unlink()
+    assert not manifest.is_up_to_date(emd_file, _converter_name(convert_to_pyramid), options)
+
+def test_halve_pads_odd_sizes():
+    level = np.arange(15, dtype=np.uint8).reshape(3, 5)
+    halved = halve(level, band_rows=2)
+    assert halved.shape == (2, 3)
+    np.testing.assert_array_equal(halved[-1], np.rint([(10 + 11) / 2, (12 + 13) / 2, 14]))
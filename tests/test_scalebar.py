@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from PIL import Image
+from emd_convert.scalebar import add_scalebar, converted_px_size_and_unit, scalebar_stamp
+
+
+@pytest.mark.parametrize("px_size, width, expected", [
+    (1e-9, 1000, (1e-3, "µm")),
+    (1e-9, 999, (1, "nm")),
+    (2e-12, 400, (2, "pm")),
+])
+def test_px_size_unit_follows_the_field_of_view(px_size, width, expected):
+    px_size_conv, unit = converted_px_size_and_unit(px_size, np.zeros((10, width)))
+    assert unit == expected[1]
+    assert px_size_conv == pytest.approx(expected[0])
+
+def test_scalebar_length_and_position():
+    img_data = np.zeros((600, 600), dtype=np.uint8)
+    im = Image.fromarray(img_data)
+    # 600 nm field of view: a 100 nm bar of 100 px, starting at x = 600 / 24 and y = 600 * 11 / 12
+    add_scalebar(im, img_data, px_size_meter=1e-9)
+    drawn = np.asarray(im)
+    bar_row = drawn[553]
+    white = np.flatnonzero(bar_row == 255)
+    assert white[0] == 26 and white[-1] == 124
+    # black outline around the white bar, white label below it
+    assert drawn[550, 25:126].max() == 0
+    assert (drawn[557:] == 255).sum() > 100
+    assert drawn[:540].max() == 0
+
+def test_scalebar_on_bottom_band_matches_full_image():
+    img_data = np.zeros((600, 600), dtype=np.uint8)
+    full = Image.fromarray(img_data)
+    add_scalebar(full, img_data, px_size_meter=1e-9)
+    band = Image.fromarray(img_data[500:])
+    add_scalebar(band, img_data, px_size_meter=1e-9, y_offset=500)
+    np.testing.assert_array_equal(np.asarray(band), np.asarray(full)[500:])
+
+def test_stamp_is_rendered_once_per_size():
+    img_data = np.zeros((300, 300), dtype=np.uint8)
+    scalebar_stamp.cache_clear()
+    for _ in range(3):
+        add_scalebar(Image.fromarray(img_data), img_data, px_size_meter=1e-9)
+    info = scalebar_stamp.cache_info()
+    assert (info.misses, info.hits) == (1, 2)
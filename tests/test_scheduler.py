@@ -0,0 +1,47 @@
+import tracemalloc
+from pathlib import Path
+import numpy as np
+from emd_convert import emd_reader
+from emd_convert.emd_reader import VeloxEMD
+from emd_convert.synthetic_emd import write_velox_emd
+from emd_convert.scheduler import MemoryBudget, estimate_working_set, header_shape, PROCESS_OVERHEAD
+
+
+def test_stack_is_loaded_band_by_band(tmp_path, monkeypatch):
+    emd_file = write_velox_emd(tmp_path / "stack.emd", 256, 128, n_frames=8)
+    stack_bytes = 8 * 256 * 128 * 2
+    monkeypatch.setattr(emd_reader, "ROW_BLOCK_BYTES", stack_bytes // 8)
+    with VeloxEMD(emd_file) as emd:
+        expected = np.stack([emd.frame(i) for i in range(8)])
+        tracemalloc.start()
+        data = emd.data
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    np.testing.assert_array_equal(data, expected)
+    # the stack and one band (read and reordered), not two copies of the stack
+    assert peak < stack_bytes * 1.4
+
+def test_working_set_of_stacks(tmp_path):
+    single = write_velox_emd(tmp_path / "single.emd", 256, 128)
+    stack = write_velox_emd(tmp_path / "stack.emd", 256, 128, n_frames=8)
+    assert header_shape(stack) == ((8, 256, 128), np.dtype(np.uint16))
+    assert estimate_working_set(single, "convert_emd2mrc.convert_to_mrc") == 256 * 128 * 2 + PROCESS_OVERHEAD
+    # a small stack fits into one band, which is held twice while loading
+    assert estimate_working_set(stack, "convert_emd2mrc.convert_to_mrc") == 2 * 8 * 256 * 128 * 2 + PROCESS_OVERHEAD
+    # the png preview adds its full resolution copies
+    assert estimate_working_set(single, "convert_emd2png_add_scalebar.convert_to_png") > estimate_working_set(single, "convert_emd2mrc.convert_to_mrc")
+
+def test_memory_budget_admission():
+    sizes = {"a": 60, "b": 50, "c": 30, "huge": 500}
+    budget = MemoryBudget(100, lambda emd_file: sizes[emd_file.stem])
+    assert budget.admit(Path("a.emd"))
+    assert not budget.admit(Path("b.emd"))
+    assert budget.admit(Path("c.emd"))
+    budget.release(Path("a.emd"))
+    assert budget.admit(Path("b.emd"))
+    assert not budget.admit(Path("huge.emd"))
+    budget.release(Path("b.emd"))
+    budget.release(Path("c.emd"))
+    # too large for the budget, but admitted once nothing else runs
+    assert budget.admit(Path("huge.emd"))
+    assert budget.in_use == 500
@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+import tifffile
+from emd_convert.emd_reader import load_emd
+from emd_convert.synthetic_emd import write_velox_emd
+from emd_convert.convert_emd2tiff import convert_to_tiff
+
+
+@pytest.mark.parametrize("dtype", ["uint16", "int32", "float32"])
+@pytest.mark.parametrize("tiled", [False, True])
+def test_tiff_round_trip(tmp_path, dtype, tiled):
+    # float data must not need imagecodecs with the default deflate compression
+    emd_file = write_velox_emd(tmp_path / f"{dtype}.emd", 300, 260, dtype=dtype)
+    tiff = convert_to_tiff(emd_file, tiled=tiled)
+    img_data, _ = load_emd(emd_file)
+    np.testing.assert_array_equal(tifffile.imread(tiff), img_data)
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from PIL import Image
+from emd_convert.emd_reader import VeloxEMD, load_emd
+from emd_convert.synthetic_emd import write_velox_emd
+from emd_convert.preview import bin_image, make_preview
+from emd_convert.denoise import denoise
+from emd_convert.tiled import tiled_preview, write_png_tiled
+
+
+@pytest.mark.parametrize("shape, max_memory", [((1001, 999), 10**5), ((1001, 1000), 10**6), ((1000, 1000), 10**6)])
+def test_tiled_preview_matches_in_memory_binning(tmp_path, shape, max_memory):
+    emd_file = write_velox_emd(tmp_path / "odd.emd", *shape)
+    img_data, _ = load_emd(emd_file)
+    with VeloxEMD(emd_file) as emd, open(tmp_path / "tmp", "w+b") as tmp:
+        processed, (low, high), _, _ = tiled_preview(emd, tmp, 2, max_memory)
+        expected = denoise(bin_image(img_data, 2), "median")
+        np.testing.assert_array_equal(processed, expected)
+        assert (low, high) == (expected.min(), expected.max())
+
+@pytest.mark.parametrize("shape", [(1001, 999), (1001, 1000)])
+def test_tiled_png_matches_in_memory_bin_preview(tmp_path, shape):
+    emd_file = write_velox_emd(tmp_path / "odd.emd", *shape)
+    png = write_png_tiled(emd_file, tmp_path / "odd.png", max_memory=10**5)
+    img_data, px_size = load_emd(emd_file)
+    preview, _ = make_preview(img_data, px_size, downsample_factor=0.5, mode="bin")
+    tiled = np.asarray(Image.open(png))
+    assert tiled.shape == preview.shape == (shape[0] // 2, shape[1] // 2)
+    np.testing.assert_array_equal(tiled, preview)
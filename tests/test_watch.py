@@ -0,0 +1,67 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from emd_convert.synthetic_emd import write_velox_emd
+from emd_convert.watch_emd import DirectoryPoller, EmdWatcher
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+def test_poller_reports_new_files_once(tmp_path):
+    found = []
+    poller = DirectoryPoller(tmp_path, found.append)
+    (tmp_path / "a.emd").write_bytes(b"a")
+    (tmp_path / "grid").mkdir()
+    poller.poll()
+    assert found == [tmp_path / "a.emd"]
+    (tmp_path / "grid" / "b.emd").write_bytes(b"b")
+    poller.poll()
+    poller.poll()
+    assert found == [tmp_path / "a.emd", tmp_path / "grid" / "b.emd"]
+
+def test_files_settle_before_conversion(tmp_path):
+    watcher = EmdWatcher(tmp_path, settle_time=0.2)
+    emd_file = tmp_path / "a.emd"
+    emd_file.write_bytes(b"a")
+    watcher.notice(emd_file)
+    watcher.notice(tmp_path / "a.png")
+    assert watcher._settled_files() == []
+    time.sleep(0.25)
+    # still growing: the settle time starts again
+    emd_file.write_bytes(b"ab")
+    assert watcher._settled_files() == []
+    time.sleep(0.25)
+    assert watcher._settled_files() == [emd_file]
+    emd_file.unlink()
+    assert watcher._settled_files() == [] and watcher._pending == {}
+
+def test_watch_converts_new_files(tmp_path):
+    write_velox_emd(tmp_path / "old.emd", 64, 48)
+    cmd = [sys.executable, "-m", "emd_convert", "watch", str(tmp_path), "--formats", "mrc", "--polling",
+           "--settle-time", "0.2", "--poll-interval", "0.05"]
+    env = {**os.environ, "PYTHONPATH": str(Path(__file__).parents[1])}
+    process = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        time.sleep(1)
+        # written elsewhere and moved in, like a finished acquisition
+        write_velox_emd(tmp_path / ".new.tmp", 64, 48)
+        (tmp_path / ".new.tmp").rename(tmp_path / "new.emd")
+        # the manifest is saved once the conversion is collected
+        wait_for(lambda: (tmp_path / ".emd_convert_manifest.json").exists())
+    finally:
+        process.send_signal(signal.SIGINT)
+        output = process.communicate(timeout=30)[0]
+    assert "Stopping watcher" in output
+    assert (tmp_path / "new.mrc").exists()
+    # existing files are only converted with --initial
+    assert not (tmp_path / "old.mrc").exists()
+    with open(tmp_path / ".emd_convert_manifest.json") as f:
+        assert list(json.load(f)) == [str((tmp_path / "new.emd").resolve())]
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+import zarr
+from emd_convert.emd_reader import VeloxEMD, load_emd
+from emd_convert.synthetic_emd import write_velox_emd
+from emd_convert.convert_emd2zarr import convert_to_zarr, write_ngff, write_zarr
+
+
+@pytest.mark.parametrize("n_frames", [1, 5])
+def test_zarr_matches_frames(tmp_path, n_frames):
+    emd_file = write_velox_emd(tmp_path / "stack.emd", 101, 75, n_frames=n_frames)
+    img_data, _ = load_emd(emd_file)
+    group = zarr.open_group(str(convert_to_zarr(emd_file, chunks=32, threads=2)), mode="r")
+    np.testing.assert_array_equal(group["0"][:], img_data)
+
+@pytest.mark.parametrize("n_frames", [1, 5])
+def test_zarr_row_bands_match_in_memory(tmp_path, n_frames):
+    emd_file = write_velox_emd(tmp_path / "stack.emd", 203, 75, n_frames=n_frames)
+    img_data, px_size = load_emd(emd_file)
+    in_memory = zarr.open_group(str(write_zarr(img_data, px_size, tmp_path / "memory.zarr", chunks=16, n_levels=3)), mode="r")
+    with VeloxEMD(emd_file) as emd:
+        # bands of 64 rows, several per file
+        blocks = emd.iter_row_blocks(max_bytes=64 * 75 * n_frames * emd.dtype.itemsize, multiple=16 * 4)
+        streamed = write_ngff(blocks, emd.n_frames, emd.shape[-2:], emd.dtype, px_size, tmp_path / "streamed.zarr",
+                              chunks=16, n_levels=3)
+    streamed = zarr.open_group(str(streamed), mode="r")
+    for level in ["0", "1", "2"]:
+        np.testing.assert_array_equal(streamed[level][:], in_memory[level][:])